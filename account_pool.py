@@ -0,0 +1,262 @@
+"""
+Pool de cuentas de NotebookLM
+Cada cuenta de Google tiene su propio almacén de credenciales, coordinador de
+re-autenticación y sondeo. Las consultas van a la cuenta sana con menos
+llamadas en curso; si una cuenta deja de estar autenticada se aparta durante
+un tiempo y el trabajo pasa a las demás.
+
+Cuentas (se combinan):
+  NOTEBOOKLM_COOKIES / ~/.notebooklm-mcp/auth.json   cuenta "default"
+  NOTEBOOKLM_COOKIES_<NOMBRE>                         una cuenta por variable
+  NOTEBOOKLM_AUTH_FILES=[nombre=]ruta,...             una cuenta por archivo
+Todas las cuentas deben tener acceso a los mismos cuadernos.
+"""
+import os
+import time
+import asyncio
+from collections import OrderedDict
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Optional
+
+from credentials import (
+    CredentialStore,
+    ReauthCoordinator,
+    CredentialMonitor,
+    DEFAULT_AUTH_FILE,
+    REAUTH_COOKIES_FILE,
+)
+
+
+# ============================================================================
+# Configuración
+# ============================================================================
+
+# Segundos que una cuenta queda apartada tras fallar la autenticación
+ACCOUNT_COOLDOWN = float(os.environ.get("ACCOUNT_COOLDOWN", "120"))
+# Conversaciones recordadas para mantener los seguimientos en la misma cuenta
+ACCOUNT_MAX_PINS = int(os.environ.get("ACCOUNT_MAX_PINS", "10000"))
+
+COOKIES_ENV_PREFIX = "NOTEBOOKLM_COOKIES_"
+
+
+class Account:
+    """Una cuenta de Google con su cliente, re-autenticación y sondeo"""
+
+    def __init__(self, store: CredentialStore, coordinator: ReauthCoordinator, monitor: CredentialMonitor):
+        self.store = store
+        self.coordinator = coordinator
+        self.monitor = monitor
+        self.in_flight = 0
+        self.cooldown_until = 0.0
+        self.failed_generation = -1
+
+        self.requests = 0
+        self.auth_failures = 0
+        self.failovers = 0  # Consultas que salieron de esta cuenta hacia otra
+
+    @property
+    def name(self) -> str:
+        return self.store.name
+
+    @property
+    def healthy(self) -> bool:
+        """Con cliente y sin fallo de autenticación reciente no resuelto"""
+        if self.store.client is None:
+            return False
+        if self.store.generation > self.failed_generation:
+            return True  # Credenciales renovadas desde el fallo
+        return time.monotonic() >= self.cooldown_until
+
+    def stats(self) -> dict:
+        return {
+            "name": self.name,
+            "healthy": self.healthy,
+            "in_flight": self.in_flight,
+            "cooldown_remaining_s": round(max(self.cooldown_until - time.monotonic(), 0), 1)
+            if self.store.generation <= self.failed_generation else 0,
+            "requests": self.requests,
+            "auth_failures": self.auth_failures,
+            "failovers": self.failovers,
+            "credentials": self.store.stats(),
+            "reauth": self.coordinator.stats(),
+            "probe": self.monitor.stats(),
+        }
+
+
+class ClientPool:
+    def __init__(self, accounts: list[Account], cooldown: float = ACCOUNT_COOLDOWN, max_pins: int = ACCOUNT_MAX_PINS):
+        if not accounts:
+            raise ValueError("El pool necesita al menos una cuenta")
+        self.accounts = accounts
+        self.cooldown = cooldown
+        self.max_pins = max_pins
+        self._by_name = {account.name: account for account in accounts}
+        self._pins: OrderedDict[str, str] = OrderedDict()
+        self._background: set[asyncio.Task] = set()
+        self.conversations_moved = 0
+
+    # ------------------------------------------------------------------
+    # Construcción desde el entorno
+    # ------------------------------------------------------------------
+
+    @classmethod
+    def from_env(cls, run_probe=None, shared=None, client_factory=None) -> "ClientPool":
+        stores: list[tuple[CredentialStore, Optional[Path]]] = []
+        names: set[str] = set()
+
+        def unique(name: str) -> str:
+            candidate, n = name, 2
+            while candidate in names:
+                candidate, n = f"{name}{n}", n + 1
+            names.add(candidate)
+            return candidate
+
+        extra_files = []
+        for item in filter(None, (p.strip() for p in os.environ.get("NOTEBOOKLM_AUTH_FILES", "").split(","))):
+            name, _, path = item.rpartition("=")
+            extra_files.append((name, Path(path).expanduser()))
+        extra_envs = sorted(
+            key for key, value in os.environ.items() if key.startswith(COOKIES_ENV_PREFIX) and value
+        )
+
+        # La cuenta "default" mantiene el comportamiento de siempre; solo se
+        # omite si hay otras cuentas y no tiene credenciales propias
+        default_file = DEFAULT_AUTH_FILE.expanduser()
+        has_default = bool(os.environ.get("NOTEBOOKLM_COOKIES")) or default_file.exists()
+        listed_default = any(path.resolve() == default_file.resolve() for _, path in extra_files)
+        if (has_default and not listed_default) or not (extra_files or extra_envs):
+            stores.append((CredentialStore(name=unique("default"), client_factory=client_factory), REAUTH_COOKIES_FILE))
+
+        for name, path in extra_files:
+            # El CLI de re-autenticación solo escribe el auth.json por defecto
+            cookies_file = REAUTH_COOKIES_FILE if path.resolve() == default_file.resolve() else None
+            store = CredentialStore(env_var=None, auth_file=path, name=unique(name or path.stem),
+                                    client_factory=client_factory)
+            stores.append((store, cookies_file))
+
+        for key in extra_envs:
+            name = key[len(COOKIES_ENV_PREFIX):].lower()
+            stores.append((CredentialStore(env_var=key, auth_file=None, name=unique(name),
+                                           client_factory=client_factory), None))
+
+        accounts = []
+        for store, cookies_file in stores:
+            coordinator = ReauthCoordinator(store, cookies_file=cookies_file, shared=shared)
+            monitor = CredentialMonitor(store, coordinator, run_probe=run_probe, shared=shared)
+            accounts.append(Account(store, coordinator, monitor))
+        return cls(accounts)
+
+    # ------------------------------------------------------------------
+    # Selección de cuenta
+    # ------------------------------------------------------------------
+
+    @property
+    def primary(self) -> Account:
+        return self.accounts[0]
+
+    def get(self, name: str) -> Optional[Account]:
+        return self._by_name.get(name)
+
+    def pick(self, conversation_id: Optional[str] = None, exclude: set = frozenset()) -> Optional[Account]:
+        """
+        Cuenta para una consulta: la de la conversación si sigue sana; si no,
+        la sana con menos llamadas en curso. Si ninguna está sana se devuelve
+        la menos cargada de las que tienen cliente (mejor intentar que fallar).
+        """
+        if conversation_id is not None:
+            pinned = self._by_name.get(self._pins.get(conversation_id, ""))
+            if pinned is not None and pinned.name not in exclude and pinned.healthy:
+                return pinned
+        candidates = [a for a in self.accounts if a.name not in exclude and a.store.client is not None]
+        if not candidates:
+            return None
+        healthy = [a for a in candidates if a.healthy] or candidates
+        return min(healthy, key=lambda a: (a.in_flight, a.requests))
+
+    def has_alternative(self, exclude: set) -> bool:
+        """Hay otra cuenta sana a la que pasar el trabajo"""
+        return any(a.name not in exclude and a.healthy for a in self.accounts)
+
+    @contextmanager
+    def use(self, account: Account):
+        """Contabiliza una llamada en curso en la cuenta"""
+        account.in_flight += 1
+        account.requests += 1
+        try:
+            yield account
+        finally:
+            account.in_flight -= 1
+
+    # ------------------------------------------------------------------
+    # Conversaciones
+    # ------------------------------------------------------------------
+
+    def pin(self, conversation_id: Optional[str], account: Account) -> None:
+        if not conversation_id:
+            return
+        self._pins[conversation_id] = account.name
+        self._pins.move_to_end(conversation_id)
+        while len(self._pins) > self.max_pins:
+            self._pins.popitem(last=False)
+
+    def account_for(self, conversation_id: Optional[str]) -> Optional[Account]:
+        return self._by_name.get(self._pins.get(conversation_id or "", ""))
+
+    def adopt_conversation(self, conversation_id: Optional[str], account: Account) -> None:
+        """
+        Si una conversación pasa a otra cuenta se copia su historial local,
+        que es lo que el cliente envía a NotebookLM en los seguimientos.
+        """
+        previous = self.account_for(conversation_id)
+        if previous is None or previous is account:
+            return
+        source = getattr(previous.store.client, "_conversation_cache", None)
+        target = getattr(account.store.client, "_conversation_cache", None)
+        if source is not None and target is not None and conversation_id in source:
+            target.setdefault(conversation_id, list(source[conversation_id]))
+            self.conversations_moved += 1
+            print(f"[POOL] Conversacion {conversation_id[:8]} movida de {previous.name} a {account.name}")
+        self.pin(conversation_id, account)
+
+    # ------------------------------------------------------------------
+    # Salud
+    # ------------------------------------------------------------------
+
+    def mark_auth_failure(self, account: Account, generation: int) -> None:
+        """Aparta la cuenta hasta que se renueven sus credenciales o pase el cooldown"""
+        account.auth_failures += 1
+        account.failed_generation = max(account.failed_generation, generation)
+        account.cooldown_until = time.monotonic() + self.cooldown
+
+    def reauth_in_background(self, account: Account, generation: int) -> None:
+        """Renueva la cuenta sin que la consulta que falló tenga que esperar"""
+        task = asyncio.create_task(account.coordinator.reauth(generation))
+        self._background.add(task)
+        task.add_done_callback(self._background.discard)
+
+    async def ensure_clients(self) -> bool:
+        """Comprueba si cambiaron las credenciales de cada cuenta; True si hay algún cliente"""
+        for account in self.accounts:
+            await account.store.get_client_async()
+        return any(account.store.client is not None for account in self.accounts)
+
+    def start(self) -> None:
+        for account in self.accounts:
+            account.monitor.start()
+
+    async def stop(self) -> None:
+        for account in self.accounts:
+            await account.monitor.stop()
+
+    @property
+    def authenticated(self) -> bool:
+        return any(account.store.client is not None for account in self.accounts)
+
+    def stats(self) -> dict:
+        return {
+            "accounts": [account.stats() for account in self.accounts],
+            "healthy": sum(1 for account in self.accounts if account.healthy),
+            "pinned_conversations": len(self._pins),
+            "conversations_moved": self.conversations_moved,
+        }
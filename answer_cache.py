@@ -0,0 +1,441 @@
+"""
+Caché de respuestas para /query
+Dos niveles: LRU en memoria con TTL y presupuesto de bytes, y SQLite en disco
+con las respuestas comprimidas (sobrevive a reinicios del servidor).
+"""
+import os
+import json
+import time
+import zlib
+import asyncio
+import hashlib
+import sqlite3
+import threading
+import unicodedata
+from collections import OrderedDict
+from pathlib import Path
+from typing import Optional
+
+
+# ============================================================================
+# Configuración
+# ============================================================================
+
+ANSWER_CACHE_ENABLED = os.environ.get("ANSWER_CACHE_ENABLED", "1") != "0"
+ANSWER_CACHE_TTL = float(os.environ.get("ANSWER_CACHE_TTL", str(12 * 3600)))
+ANSWER_CACHE_MAX_ENTRIES = int(os.environ.get("ANSWER_CACHE_MAX_ENTRIES", "1000"))
+ANSWER_CACHE_MAX_BYTES = int(os.environ.get("ANSWER_CACHE_MAX_BYTES", str(32 * 1024 * 1024)))
+ANSWER_CACHE_DISK_MAX_BYTES = int(os.environ.get("ANSWER_CACHE_DISK_MAX_BYTES", str(256 * 1024 * 1024)))
+ANSWER_CACHE_DB = os.environ.get(
+    "ANSWER_CACHE_DB", str(Path(__file__).parent / "answer_cache.sqlite3")
+)
+# Segundos entre comprobaciones de purgas hechas por otros workers
+ANSWER_CACHE_SYNC_INTERVAL = float(os.environ.get("ANSWER_CACHE_SYNC_INTERVAL", "1"))
+# Estado compartido: una marca por ámbito purgado ("*" = todo) y su generación
+PURGE_PREFIX = "answer_cache:purge:"
+PURGE_GENERATION = "answer_cache:purges"
+
+# Sobrecoste aproximado por entrada en memoria (claves, tuplas, dict)
+_ENTRY_OVERHEAD = 256
+
+
+# ============================================================================
+# Claves
+# ============================================================================
+
+_TRAILING_PUNCTUATION = " \t\n?¿!¡.,;:"
+
+
+def normalize_question(question: str) -> str:
+    """
+    Normaliza una pregunta para usarla como clave:
+    sin tildes, en minúsculas, con espacios colapsados y sin puntuación final.
+    """
+    text = unicodedata.normalize("NFKD", question)
+    text = "".join(c for c in text if not unicodedata.combining(c))
+    text = " ".join(text.casefold().split())
+    return text.strip(_TRAILING_PUNCTUATION)
+
+
+def cache_key(notebook_id: str, question: str) -> str:
+    """Clave de caché: notebook_id + pregunta normalizada"""
+    raw = f"{notebook_id}\n{normalize_question(question)}"
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def _entry_size(entry: dict) -> int:
+    return (
+        len(entry.get("answer", "").encode("utf-8"))
+        + len(entry.get("question", "").encode("utf-8"))
+        + _ENTRY_OVERHEAD
+    )
+
+
+# ============================================================================
+# Nivel 1: memoria
+# ============================================================================
+
+class MemoryTier:
+    """LRU en memoria acotado por número de entradas y por bytes"""
+
+    def __init__(self, max_entries: int, max_bytes: int):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._data: OrderedDict[str, tuple[float, int, dict]] = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, key: str) -> Optional[dict]:
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return None
+            expires_at, size, entry = item
+            if expires_at <= time.time():
+                self._remove(key)
+                self.expirations += 1
+                return None
+            self._data.move_to_end(key)
+            return entry
+
+    def put(self, key: str, entry: dict, expires_at: float) -> None:
+        size = _entry_size(entry)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._data:
+                self._remove(key)
+            self._data[key] = (expires_at, size, entry)
+            self._bytes += size
+            while self._data and (
+                len(self._data) > self.max_entries or self._bytes > self.max_bytes
+            ):
+                oldest = next(iter(self._data))
+                self._remove(oldest)
+                self.evictions += 1
+
+    def _remove(self, key: str) -> None:
+        _, size, _ = self._data.pop(key)
+        self._bytes -= size
+
+    def delete(self, key: str) -> bool:
+        with self._lock:
+            if key in self._data:
+                self._remove(key)
+                return True
+            return False
+
+    def purge(self, notebook_id: Optional[str] = None) -> int:
+        with self._lock:
+            if notebook_id is None:
+                removed = len(self._data)
+                self._data.clear()
+                self._bytes = 0
+                return removed
+            keys = [k for k, (_, _, e) in self._data.items() if e.get("notebook_id") == notebook_id]
+            for k in keys:
+                self._remove(k)
+            return len(keys)
+
+    def stats(self) -> dict:
+        return {
+            "entries": len(self._data),
+            "bytes": self._bytes,
+            "max_entries": self.max_entries,
+            "max_bytes": self.max_bytes,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+        }
+
+
+# ============================================================================
+# Nivel 2: disco (SQLite)
+# ============================================================================
+
+class DiskTier:
+    """Respuestas comprimidas con zlib en SQLite, acotadas por bytes"""
+
+    def __init__(self, path: str, max_bytes: int):
+        self.path = path
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS answers (
+                key TEXT PRIMARY KEY,
+                notebook_id TEXT NOT NULL,
+                question TEXT NOT NULL,
+                payload BLOB NOT NULL,
+                size INTEGER NOT NULL,
+                created_at REAL NOT NULL,
+                expires_at REAL NOT NULL,
+                last_access REAL NOT NULL,
+                hits INTEGER NOT NULL DEFAULT 0
+            )
+        """)
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_answers_access ON answers(last_access)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_answers_notebook ON answers(notebook_id)")
+        self._conn.commit()
+        self.evictions = 0
+
+    def get(self, key: str) -> Optional[tuple[dict, float]]:
+        """Devuelve (entrada, expires_at) o None"""
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT payload, expires_at FROM answers WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            payload, expires_at = row
+            if expires_at <= now:
+                self._conn.execute("DELETE FROM answers WHERE key = ?", (key,))
+                self._conn.commit()
+                return None
+            self._conn.execute(
+                "UPDATE answers SET last_access = ?, hits = hits + 1 WHERE key = ?", (now, key)
+            )
+            self._conn.commit()
+        return json.loads(zlib.decompress(payload)), expires_at
+
+    def put(self, key: str, entry: dict, expires_at: float) -> None:
+        payload = zlib.compress(json.dumps(entry, ensure_ascii=False).encode("utf-8"), 6)
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO answers "
+                "(key, notebook_id, question, payload, size, created_at, expires_at, last_access, hits) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, 0)",
+                (key, entry.get("notebook_id", ""), entry.get("question", "")[:500],
+                 payload, len(payload), entry.get("created_at", now), expires_at, now),
+            )
+            self._evict(now)
+            self._conn.commit()
+
+    def _evict(self, now: float) -> None:
+        """Borra caducadas y, si se supera el presupuesto, las menos usadas"""
+        self._conn.execute("DELETE FROM answers WHERE expires_at <= ?", (now,))
+        total = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM answers").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        excess = total - self.max_bytes
+        freed = 0
+        victims = []
+        for key, size in self._conn.execute("SELECT key, size FROM answers ORDER BY last_access ASC"):
+            victims.append((key,))
+            freed += size
+            if freed >= excess:
+                break
+        self._conn.executemany("DELETE FROM answers WHERE key = ?", victims)
+        self.evictions += len(victims)
+
+    def delete(self, key: str) -> bool:
+        with self._lock:
+            cur = self._conn.execute("DELETE FROM answers WHERE key = ?", (key,))
+            self._conn.commit()
+            return cur.rowcount > 0
+
+    def purge(self, notebook_id: Optional[str] = None) -> int:
+        with self._lock:
+            if notebook_id is None:
+                cur = self._conn.execute("DELETE FROM answers")
+            else:
+                cur = self._conn.execute("DELETE FROM answers WHERE notebook_id = ?", (notebook_id,))
+            self._conn.commit()
+            return cur.rowcount
+
+    def entries(self, notebook_id: Optional[str] = None, limit: int = 50) -> list[dict]:
+        sql = "SELECT key, notebook_id, question, size, created_at, expires_at, last_access, hits FROM answers"
+        params: tuple = ()
+        if notebook_id is not None:
+            sql += " WHERE notebook_id = ?"
+            params = (notebook_id,)
+        sql += " ORDER BY last_access DESC LIMIT ?"
+        with self._lock:
+            rows = self._conn.execute(sql, params + (limit,)).fetchall()
+        columns = ["key", "notebook_id", "question", "compressed_bytes", "created_at", "expires_at", "last_access", "hits"]
+        return [dict(zip(columns, row)) for row in rows]
+
+    def questions(self, limit: int) -> list[dict]:
+        """
+        Clave, cuaderno y pregunta completa de las entradas vigentes usadas
+        más recientemente. La columna `question` está recortada para mostrarla;
+        la pregunta entera sale del payload.
+        """
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT key, notebook_id, payload FROM answers WHERE expires_at > ? "
+                "ORDER BY last_access DESC LIMIT ?", (time.time(), limit)
+            ).fetchall()
+        return [
+            {"key": key, "notebook_id": notebook_id, "question": json.loads(zlib.decompress(payload))["question"]}
+            for key, notebook_id, payload in rows
+        ]
+
+    def stats(self) -> dict:
+        with self._lock:
+            count, total = self._conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM answers"
+            ).fetchone()
+        return {
+            "path": self.path,
+            "entries": count,
+            "compressed_bytes": total,
+            "max_bytes": self.max_bytes,
+            "evictions": self.evictions,
+        }
+
+
+# ============================================================================
+# Caché combinada
+# ============================================================================
+
+class AnswerCache:
+    """
+    Caché de dos niveles. Las operaciones de disco se ejecutan en hilos
+    para no bloquear el event loop.
+    """
+
+    def __init__(
+        self,
+        ttl: float = ANSWER_CACHE_TTL,
+        max_entries: int = ANSWER_CACHE_MAX_ENTRIES,
+        max_bytes: int = ANSWER_CACHE_MAX_BYTES,
+        db_path: Optional[str] = ANSWER_CACHE_DB,
+        disk_max_bytes: int = ANSWER_CACHE_DISK_MAX_BYTES,
+        shared=None,
+    ):
+        self.ttl = ttl
+        # El nivel de disco ya es común a todos los workers; SharedState
+        # (opcional) propaga las purgas a los niveles en memoria de los demás
+        self.shared = shared
+        self._purge_marks: dict[str, float] = {}
+        self._purges_synced_at = 0.0
+        self._purge_generation = 0.0
+        self.memory = MemoryTier(max_entries, max_bytes)
+        self.disk: Optional[DiskTier] = None
+        if db_path:
+            try:
+                self.disk = DiskTier(db_path, disk_max_bytes)
+            except Exception as e:
+                print(f"[CACHE] Nivel de disco desactivado ({db_path}): {e}")
+        self.hits = {"memory": 0, "disk": 0}
+        self.misses = 0
+        self.stores = 0
+
+    async def get(self, notebook_id: str, question: str) -> tuple[Optional[dict], Optional[str]]:
+        """Devuelve (entrada, nivel) con nivel 'memory' o 'disk', o (None, None)"""
+        return await self.get_by_key(cache_key(notebook_id, question))
+
+    async def get_by_key(self, key: str) -> tuple[Optional[dict], Optional[str]]:
+        await self._sync_purges()
+        entry = self.memory.get(key)
+        if entry is not None:
+            self.hits["memory"] += 1
+            return entry, "memory"
+
+        if self.disk is not None:
+            try:
+                found = await asyncio.to_thread(self.disk.get, key)
+            except Exception as e:
+                print(f"[CACHE] Error leyendo disco: {e}")
+                found = None
+            if found is not None:
+                entry, expires_at = found
+                self.memory.put(key, entry, expires_at)
+                self.hits["disk"] += 1
+                return entry, "disk"
+
+        self.misses += 1
+        return None, None
+
+    async def put(self, notebook_id: str, question: str, answer: str) -> None:
+        key = cache_key(notebook_id, question)
+        now = time.time()
+        entry = {
+            "notebook_id": notebook_id,
+            "question": question,
+            "answer": answer,
+            "created_at": now,
+        }
+        expires_at = now + self.ttl
+        self.memory.put(key, entry, expires_at)
+        self.stores += 1
+        if self.disk is not None:
+            try:
+                await asyncio.to_thread(self.disk.put, key, entry, expires_at)
+            except Exception as e:
+                print(f"[CACHE] Error escribiendo disco: {e}")
+
+    async def purge(self, notebook_id: Optional[str] = None) -> dict:
+        removed_memory = self.memory.purge(notebook_id)
+        removed_disk = 0
+        if self.disk is not None:
+            removed_disk = await asyncio.to_thread(self.disk.purge, notebook_id)
+        if self.shared is not None:
+            await asyncio.to_thread(self._publish_purge, notebook_id or "*")
+        return {"memory": removed_memory, "disk": removed_disk}
+
+    def _publish_purge(self, scope: str) -> None:
+        """
+        Una clave por ámbito (dos purgas simultáneas no se pisan) y un
+        contador de generación para que los demás workers sepan que hay
+        purgas nuevas sin leer todas las marcas
+        """
+        self._purge_marks[scope] = time.time()
+        # Una marca más antigua que el TTL ya no puede afectar a ninguna entrada
+        self.shared.set(f"{PURGE_PREFIX}{scope}", self._purge_marks[scope], self.ttl)
+        self.shared.incr(PURGE_GENERATION)
+
+    def _read_purges(self) -> Optional[tuple[float, dict]]:
+        """Generación y marcas de purga, o None si no hay purgas nuevas"""
+        generation = self.shared.counter(PURGE_GENERATION)
+        if generation == self._purge_generation:
+            return None
+        return generation, self.shared.items(PURGE_PREFIX)
+
+    async def _sync_purges(self) -> None:
+        """Aplica en memoria las purgas que hayan hecho otros workers"""
+        if self.shared is None or time.monotonic() - self._purges_synced_at < ANSWER_CACHE_SYNC_INTERVAL:
+            return
+        self._purges_synced_at = time.monotonic()
+        try:
+            update = await asyncio.to_thread(self._read_purges)
+        except Exception as e:
+            print(f"[CACHE] Error leyendo purgas compartidas: {e}")
+            return
+        if update is None:
+            return
+        self._purge_generation, marks = update
+        for key, purged_at in marks.items():
+            scope = key[len(PURGE_PREFIX):]
+            if purged_at > self._purge_marks.get(scope, 0):
+                self._purge_marks[scope] = purged_at
+                self.memory.purge(None if scope == "*" else scope)
+
+    async def entries(self, notebook_id: Optional[str] = None, limit: int = 50) -> list[dict]:
+        if self.disk is None:
+            return []
+        return await asyncio.to_thread(self.disk.entries, notebook_id, limit)
+
+    async def questions(self, limit: int) -> list[dict]:
+        """Preguntas completas de la caché en disco (las usadas más recientemente primero)"""
+        if self.disk is None:
+            return []
+        return await asyncio.to_thread(self.disk.questions, limit)
+
+    async def stats(self) -> dict:
+        lookups = self.misses + sum(self.hits.values())
+        disk_stats = await asyncio.to_thread(self.disk.stats) if self.disk is not None else None
+        return {
+            "ttl": self.ttl,
+            "hits": dict(self.hits),
+            "misses": self.misses,
+            "hit_ratio": round(sum(self.hits.values()) / lookups, 4) if lookups else 0.0,
+            "stores": self.stores,
+            "memory": self.memory.stats(),
+            "disk": disk_stats,
+        }
@@ -4,21 +4,54 @@ Actúa como puente entre Streamlit y la API de NotebookLM
 """
 import os
 import asyncio
-import subprocess
+import math
 import time
-from typing import Optional
+import uuid
+import hmac
+import threading
+import functools
+from typing import Optional, AsyncIterator, Awaitable, Callable
 from contextlib import asynccontextmanager
 
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Header, Depends, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse, JSONResponse, Response
 from pydantic import BaseModel
 import httpx  # Para manejar excepciones HTTP específicas
 import json
-from pathlib import Path
 
 # Importar las bibliotecas de NotebookLM MCP
 from notebooklm_mcp.auth import load_cached_tokens
-from notebooklm_mcp.api_client import NotebookLMClient, AuthenticationError
+from notebooklm_mcp.api_client import AuthenticationError
+
+from account_pool import ClientPool, Account
+from answer_cache import AnswerCache, ANSWER_CACHE_ENABLED, cache_key
+from semantic_cache import SemanticIndex, SEMANTIC_CACHE_ENABLED, SEMANTIC_CACHE_MAX_ENTRIES, np
+from singleflight import SingleFlight
+from upstream_stream import stream_query
+from request_log import RequestLog, RequestTrace
+from upstream import UpstreamExecutor, UpstreamBusy, DEFAULT_PRIORITY, priority_rank
+from deadline import Deadline, DeadlineExceeded
+from circuit_breaker import CircuitBreaker, CircuitOpen
+from rate_limit import RateLimiter, RateLimited, current_client
+from metrics import Registry, SIZE_BUCKETS
+from metadata_cache import MetadataCache
+from shared_state import SharedState
+from sessions import SessionStore, SESSION_MAX_PROMPT_CHARS
+from jobs import JobStore
+from upstream_recording import UpstreamRecording
+from cache_warmer import CacheWarmer, CACHE_WARMER_ENABLED, CACHE_WARMER_MAX_AGE
+from prompts import NOTEBOOK_ID, SYSTEM_INSTRUCTIONS, SUGGESTED_QUESTIONS
+from source_index import (
+    SourceLibrary,
+    UnsupportedDocument,
+    extract_text,
+    SOURCE_INDEX_ENABLED,
+    SOURCE_INDEX_AUTO,
+    SOURCE_INDEX_FALLBACK,
+    SOURCE_INDEX_FALLBACK_PASSAGES,
+    SOURCE_INDEX_MAX_UPLOAD_BYTES,
+)
 
 
 # ============================================================================
@@ -30,6 +63,7 @@ class QueryRequest(BaseModel):
     notebook_id: str
     conversation_id: Optional[str] = None
     timeout: Optional[int] = 120
+    priority: Optional[str] = None  # interactive | bulk | background (o cabecera X-Priority)
 
 
 class QueryResponse(BaseModel):
@@ -37,6 +71,88 @@ class QueryResponse(BaseModel):
     answer: Optional[str] = None
     conversation_id: Optional[str] = None
     error: Optional[str] = None
+    cached: bool = False
+    cache_tier: Optional[str] = None  # "memory", "disk" o "semantic" si se sirvió desde caché
+    request_id: Optional[str] = None
+    degraded: bool = False  # NotebookLM no disponible: respuesta con fragmentos de las fuentes
+    passages: Optional[list[dict]] = None
+
+
+class BatchQueryRequest(BaseModel):
+    notebook_id: str
+    questions: list[str]
+    timeout: Optional[int] = 120
+    concurrency: Optional[int] = None  # Limitado por BATCH_MAX_CONCURRENCY
+    stream: bool = False  # True: resultados como NDJSON a medida que estén en orden
+    priority: Optional[str] = None  # Por defecto "bulk"
+
+
+class BatchItemResult(BaseModel):
+    index: int
+    question: str
+    success: bool
+    answer: Optional[str] = None
+    conversation_id: Optional[str] = None
+    error: Optional[str] = None
+    status: Optional[int] = None  # Código HTTP equivalente si la pregunta falló
+    cached: bool = False
+    cache_tier: Optional[str] = None
+    elapsed_ms: float = 0.0
+    request_id: Optional[str] = None
+
+
+class BatchQueryResponse(BaseModel):
+    success: bool
+    notebook_id: str
+    total: int
+    succeeded: int
+    failed: int
+    elapsed_ms: float
+    batch_id: str
+    results: list[BatchItemResult]
+
+
+class SessionCreateRequest(BaseModel):
+    notebook_id: str
+    system_prompt: str = ""  # Se antepone solo a la primera pregunta de la sesión
+
+
+class SessionQueryRequest(BaseModel):
+    question: str  # Solo el turno nuevo del usuario
+    timeout: Optional[int] = 120
+    priority: Optional[str] = None
+
+
+class SessionInfo(BaseModel):
+    session_id: str
+    notebook_id: str
+    conversation_id: Optional[str] = None
+    prompt_hash: Optional[str] = None
+    turns: list[dict] = []
+    created_at: float
+    updated_at: float
+    expires_in_s: float
+
+
+class JobRequest(BaseModel):
+    question: str
+    notebook_id: Optional[str] = None  # Obligatorio salvo con session_id
+    conversation_id: Optional[str] = None
+    session_id: Optional[str] = None  # Pregunta dentro de una sesión (solo el turno nuevo)
+    timeout: Optional[int] = 120
+    priority: Optional[str] = None
+
+
+class JobInfo(BaseModel):
+    job_id: str
+    status: str  # queued | running | done | failed
+    kind: str
+    created_at: float
+    updated_at: float
+    session_id: Optional[str] = None
+    result: Optional[QueryResponse] = None
+    error: Optional[str] = None
+    status_code: Optional[int] = None  # Código HTTP equivalente si el trabajo falló
 
 
 class NotebookInfo(BaseModel):
@@ -50,14 +166,372 @@ class HealthResponse(BaseModel):
     status: str
     message: str
     authenticated: bool
+    credential_probe: Optional[dict] = None  # Sondeo de la cuenta principal
+    accounts: Optional[dict] = None
+    circuit_breaker: Optional[dict] = None
 
 
 # ============================================================================
 # Cliente Global
 # ============================================================================
 
-# Cliente NotebookLM (se inicializa al startup)
-client: Optional[NotebookLMClient] = None
+# Estado común a todos los workers de uvicorn (SQLite WAL): leases de
+# re-autenticación, sondeo y rotación del registro, cooldowns, purgas de
+# caché e historiales
+shared_state = SharedState()
+
+# Registro JSONL de peticiones escrito desde un hilo en segundo plano
+request_log = RequestLog(shared=shared_state)
+# Segundos que se conserva el historial compartido de una conversación
+CONVERSATION_TTL = float(os.environ.get("CONVERSATION_TTL", "21600"))
+# Segundos entre limpiezas de claves caducadas del estado compartido
+SHARED_STATE_CLEANUP_INTERVAL = float(os.environ.get("SHARED_STATE_CLEANUP_INTERVAL", "600"))
+
+# Sesiones: instrucciones del sistema registradas una vez por conversación
+session_store = SessionStore(shared_state)
+
+# Consultas largas en segundo plano (POST /jobs) para no superar el límite
+# de ~100 s por petición del túnel
+job_store = JobStore(shared_state)
+
+# Pool acotado para todas las llamadas bloqueantes a NotebookLM, con límite
+# por cuaderno y cola de espera limitada (429 cuando no hay capacidad)
+upstream_executor = UpstreamExecutor()
+
+# Circuit breaker de las consultas y lecturas de NotebookLM: con el servicio
+# caído falla al momento (503) y la API responde desde la caché o con las
+# fuentes indexadas en lugar de esperar cada timeout
+upstream_breaker = CircuitBreaker()
+
+# Token bucket por cliente (API key o IP) delante de los endpoints que llegan
+# a NotebookLM; el cliente también sirve para repartir la cola del ejecutor
+rate_limiter = RateLimiter()
+
+# Pool de cuentas: cada cuenta tiene un cliente NotebookLM de larga duración
+# que solo se reconstruye cuando cambian sus credenciales, su coordinador de
+# re-autenticación (`notebooklm-mcp-auth --file` como subproceso asíncrono,
+# una sola vez por caducidad) y su sondeo en segundo plano, que renueva las
+# credenciales antes de que una consulta real tenga que esperar.
+# Con una sola cuenta (lo habitual) se comporta como un único cliente.
+# Con varios workers solo uno re-autentica o sondea cada cuenta a la vez.
+# UPSTREAM_MODE=record graba las llamadas a NotebookLM; replay las reproduce.
+upstream_recording = UpstreamRecording()
+if upstream_recording.mode == "replay":
+    # Sin red ni credenciales: basta una cookie ficticia para crear el cliente
+    os.environ.setdefault("NOTEBOOKLM_COOKIES", "replay=1")
+client_pool = ClientPool.from_env(
+    run_probe=functools.partial(upstream_executor.run, priority="background"),
+    shared=shared_state,
+    client_factory=upstream_recording.factory
+)
+
+
+# ============================================================================
+# Métricas (/metrics)
+# ============================================================================
+
+# Se alimentan de las trazas de las peticiones al terminar (finish_trace); los
+# indicadores de estado se leen de los componentes en el momento del scrape
+metrics = Registry(prefix="notebooklm_")
+request_count = metrics.counter(
+    "requests_total", "Peticiones por tipo y resultado", ("kind", "outcome")
+)
+request_seconds = metrics.histogram(
+    "request_duration_seconds", "Duracion total de la peticion", labelnames=("kind",)
+)
+phase_seconds = metrics.histogram(
+    "phase_duration_seconds",
+    "Duracion de cada fase (credentials, queue_wait, upstream_attempt_N, reauth, response_build...)",
+    labelnames=("kind", "phase")
+)
+answer_size = metrics.histogram(
+    "answer_chars", "Longitud de las respuestas en caracteres", SIZE_BUCKETS, ("kind",)
+)
+queue_wait_seconds = metrics.histogram(
+    "queue_wait_seconds", "Espera en la cola del ejecutor por clase de prioridad", labelnames=("priority",)
+)
+deadline_remaining = metrics.histogram(
+    "deadline_remaining_seconds", "Plazo sin consumir al terminar la consulta", labelnames=("kind",)
+)
+deadline_exceeded = metrics.counter(
+    "deadline_exceeded_total", "Consultas cortadas por agotar su plazo, por fase", ("kind", "phase")
+)
+metrics.callback("upstream_active", "Llamadas a NotebookLM en curso",
+                 lambda: upstream_executor.stats()["active"])
+metrics.callback("upstream_queue_depth", "Peticiones esperando plaza en el ejecutor",
+                 lambda: upstream_executor.stats()["queue_depth"])
+metrics.callback("upstream_queued", "Peticiones en cola por clase de prioridad",
+                 lambda: {(name,): c["queued"] for name, c in upstream_executor.stats()["by_priority"].items()},
+                 labelnames=("priority",))
+metrics.callback("upstream_preempted_total", "Peticiones desplazadas de la cola por otras mas prioritarias",
+                 lambda: {(name,): c["preempted"] for name, c in upstream_executor.stats()["by_priority"].items()},
+                 kind="counter", labelnames=("priority",))
+metrics.callback("upstream_rejected_total", "Peticiones rechazadas con 429",
+                 lambda: {
+                     ("queue_full",): upstream_executor.rejected_queue_full,
+                     ("timeout",): upstream_executor.rejected_timeout,
+                 }, kind="counter", labelnames=("reason",))
+metrics.callback("circuit_state", "Estado del circuit breaker (0 cerrado, 1 semiabierto, 2 abierto)",
+                 lambda: {"closed": 0, "half_open": 1, "open": 2}[upstream_breaker.state])
+metrics.callback("circuit_rejected_total", "Llamadas a NotebookLM no intentadas por el circuit breaker",
+                 lambda: upstream_breaker.rejected, kind="counter")
+metrics.callback("rate_limited_total", "Peticiones rechazadas por el limite por cliente",
+                 lambda: rate_limiter.rejected, kind="counter")
+metrics.callback("rate_limit_clients", "Clientes con bucket en memoria",
+                 rate_limiter.client_count)
+metrics.callback("jobs_running", "Trabajos asincronos en curso en este worker",
+                 lambda: job_store.stats()["running"])
+metrics.callback("jobs_total", "Trabajos asincronos por resultado",
+                 lambda: {
+                     ("completed",): job_store.completed,
+                     ("failed",): job_store.failed,
+                     ("rejected",): job_store.rejected,
+                 }, kind="counter", labelnames=("outcome",))
+metrics.callback("account_healthy", "1 si la cuenta esta sana",
+                 lambda: {(a.name,): int(a.healthy) for a in client_pool.accounts},
+                 labelnames=("account",))
+metrics.callback("account_in_flight", "Llamadas en curso por cuenta",
+                 lambda: {(a.name,): a.in_flight for a in client_pool.accounts},
+                 labelnames=("account",))
+metrics.callback("credential_generation", "Generacion del cliente NotebookLM",
+                 lambda: {(a.name,): a.store.generation for a in client_pool.accounts},
+                 labelnames=("account",))
+metrics.callback("credential_rebuilds_total", "Reconstrucciones del cliente por motivo",
+                 lambda: {(a.name, reason): n for a in client_pool.accounts for reason, n in a.store.rebuilds.items()},
+                 kind="counter", labelnames=("account", "reason"))
+metrics.callback("reauth_runs_total", "Ejecuciones de re-autenticacion por resultado",
+                 lambda: {(a.name, outcome): n for a in client_pool.accounts for outcome, n in a.coordinator.outcomes.items()},
+                 kind="counter", labelnames=("account", "outcome"))
+metrics.callback("answer_cache_hits_total", "Aciertos de la cache de respuestas por nivel",
+                 lambda: dict(answer_cache.hits) if answer_cache else {},
+                 kind="counter", labelnames=("tier",))
+metrics.callback("answer_cache_misses_total", "Fallos de la cache de respuestas",
+                 lambda: answer_cache.misses if answer_cache else None, kind="counter")
+metrics.callback("semantic_cache_hits_total", "Respuestas servidas a una pregunta equivalente",
+                 lambda: semantic_index.hits if semantic_index else None, kind="counter")
+metrics.callback("query_coalesced_total", "Consultas servidas por una llamada identica en curso",
+                 lambda: query_flights.coalesced, kind="counter")
+metrics.callback("request_log_dropped_total", "Registros descartados por cola llena",
+                 lambda: request_log.dropped, kind="counter")
+
+
+# ============================================================================
+# Caché de respuestas
+# ============================================================================
+
+answer_cache: Optional[AnswerCache] = AnswerCache(shared=shared_state) if ANSWER_CACHE_ENABLED else None
+
+# Preguntas equivalentes redactadas de otra forma (necesita numpy)
+semantic_index: Optional[SemanticIndex] = None
+if answer_cache is not None and SEMANTIC_CACHE_ENABLED:
+    if np is None:
+        print("[CACHE] Cache semantica desactivada: numpy no esta instalado")
+    else:
+        semantic_index = SemanticIndex()
+        semantic_index.register_prompt(SYSTEM_INSTRUCTIONS)
+
+
+def is_cacheable(request: QueryRequest) -> bool:
+    """
+    Solo se cachean las consultas de primer turno: una respuesta dentro de una
+    conversación depende del historial y no se puede compartir.
+    """
+    return request.conversation_id is None
+
+
+async def lookup_answer(request: QueryRequest) -> tuple[Optional[dict], Optional[str], Optional[float]]:
+    """
+    (entrada, nivel, similitud) de la caché: primero la pregunta exacta y, si
+    no está, la pregunta equivalente más parecida del índice semántico
+    """
+    entry, tier = await answer_cache.get(request.notebook_id, request.question)
+    if entry is not None or semantic_index is None:
+        return entry, tier, None
+    key, similarity = await asyncio.to_thread(semantic_index.lookup, request.notebook_id, request.question)
+    if key is None:
+        return None, None, None
+    entry, _ = await answer_cache.get_by_key(key)
+    if entry is None:
+        # Caducada, desalojada o purgada por otro worker
+        await asyncio.to_thread(semantic_index.discard, request.notebook_id, request.question, key)
+        return None, None, None
+    return entry, "semantic", round(similarity, 3)
+
+
+async def store_answer(request: QueryRequest, answer: str) -> None:
+    await answer_cache.put(request.notebook_id, request.question, answer)
+    if semantic_index is not None:
+        # Fuera del event loop: cada cierto número de preguntas se recalculan los IDF
+        await asyncio.to_thread(
+            semantic_index.add, request.notebook_id, request.question, cache_key(request.notebook_id, request.question)
+        )
+
+
+async def load_semantic_index() -> None:
+    """Indexa las preguntas que ya están en la caché en disco"""
+    if semantic_index is None:
+        return
+    entries = await answer_cache.questions(SEMANTIC_CACHE_MAX_ENTRIES)
+    indexed = await asyncio.to_thread(semantic_index.load, entries[::-1])
+    print(f"[CACHE] Indice semantico cargado: {indexed} preguntas")
+
+
+async def seed_conversation(question: str, answer: str) -> Optional[str]:
+    """
+    Crea una conversación nueva en el cliente con el turno servido desde caché,
+    para que las preguntas de seguimiento conserven el contexto.
+    """
+    account = client_pool.pick()
+    if account is None:
+        return None
+    cache_turn = getattr(account.store.client, "_cache_conversation_turn", None)
+    if cache_turn is None:
+        return None
+    conversation_id = str(uuid.uuid4())
+    cache_turn(conversation_id, question, answer)
+    client_pool.pin(conversation_id, account)
+    await publish_conversation(conversation_id, account)
+    return conversation_id
+
+
+# ============================================================================
+# Historial de conversaciones compartido entre workers
+# ============================================================================
+# El cliente guarda el historial en memoria y lo reenvía en cada seguimiento.
+# Con varios workers el siguiente turno puede llegar a otro proceso, así que
+# tras cada turno se publica y antes de un seguimiento se recupera.
+
+async def publish_conversation(conversation_id: Optional[str], account: Account) -> None:
+    cache = getattr(account.store.client, "_conversation_cache", None)
+    if not conversation_id or shared_state.process_local or not cache or conversation_id not in cache:
+        return
+    turns = [{"query": t.query, "answer": t.answer} for t in cache[conversation_id]]
+    try:
+        await asyncio.to_thread(shared_state.set, f"conversation:{conversation_id}", turns, CONVERSATION_TTL)
+    except Exception as e:
+        print(f"[WARN] No se pudo publicar la conversacion {conversation_id[:8]}: {e}")
+
+
+async def hydrate_conversation(conversation_id: Optional[str], account: Account) -> None:
+    """Trae el historial publicado por otro worker si es más largo que el local"""
+    client = account.store.client
+    cache = getattr(client, "_conversation_cache", None)
+    if not conversation_id or shared_state.process_local or cache is None:
+        return
+    try:
+        turns = await asyncio.to_thread(shared_state.get, f"conversation:{conversation_id}")
+    except Exception as e:
+        print(f"[WARN] No se pudo leer la conversacion {conversation_id[:8]}: {e}")
+        return
+    if not turns or len(turns) <= len(cache.get(conversation_id, [])):
+        return
+    cache.pop(conversation_id, None)
+    for turn in turns:
+        client._cache_conversation_turn(conversation_id, turn["query"], turn["answer"])
+
+
+def release_conversation(conversation_id: Optional[str]) -> None:
+    """Olvida el historial local de una conversación en todas las cuentas"""
+    if not conversation_id:
+        return
+    for account in client_pool.accounts:
+        clear = getattr(account.store.client, "clear_conversation", None)
+        if clear is not None:
+            clear(conversation_id)
+
+
+# ============================================================================
+# Caché de metadatos de cuadernos
+# ============================================================================
+
+async def notebook_sources_changed(notebook_id: str, detail_is_current: bool = False) -> None:
+    """Las fuentes de un cuaderno cambiaron: sus respuestas cacheadas ya no valen"""
+    print(f"[META] Fuentes del cuaderno {notebook_id} modificadas")
+    if not detail_is_current:
+        metadata_cache.invalidate(f"notebook:{notebook_id}")
+    if answer_cache is not None:
+        removed = await answer_cache.purge(notebook_id)
+        if semantic_index is not None:
+            await asyncio.to_thread(semantic_index.purge, notebook_id)
+        print(f"[CACHE] Purgada por cambio de fuentes ({notebook_id}): {removed}")
+    if cache_warmer is not None and cache_warmer.notebook_id == notebook_id:
+        cache_warmer.trigger(f"sources:{notebook_id}")
+    if source_library is not None and (
+        source_library.index(notebook_id) is not None or (SOURCE_INDEX_AUTO and notebook_id == NOTEBOOK_ID)
+    ):
+        ingest_in_background(notebook_id, "sources")
+
+
+async def on_metadata_change(key: str, old, new) -> None:
+    """Detecta cambios de fuentes al refrescar /notebooks o /notebook/{id}"""
+    if key == "notebooks":
+        old_counts = {nb["id"]: nb["source_count"] for nb in old}
+        for nb in new:
+            if nb["id"] in old_counts and old_counts[nb["id"]] != nb["source_count"]:
+                await notebook_sources_changed(nb["id"])
+    elif key.startswith("notebook:") and old.get("sources") != new.get("sources"):
+        await notebook_sources_changed(key.split(":", 1)[1], detail_is_current=True)
+
+
+# /notebooks y /notebook/{id} se sirven desde memoria y se refrescan en
+# segundo plano al caducar (stale-while-revalidate)
+metadata_cache = MetadataCache(on_change=on_metadata_change)
+
+
+# Consultas idénticas en curso (mismo cuaderno y pregunta normalizada, sin
+# conversation_id) comparten una única llamada a NotebookLM
+query_flights = SingleFlight("query")
+
+
+# Token de los endpoints de administración (sin él quedan cerrados)
+ADMIN_TOKEN = os.environ.get("ADMIN_TOKEN", "")
+
+
+def resolve_priority(requested: Optional[str], header: Optional[str], default: str = DEFAULT_PRIORITY) -> str:
+    """Clase de prioridad del cuerpo, de la cabecera X-Priority o la por defecto (400 si no existe)"""
+    priority = (requested or header or default).strip().lower()
+    try:
+        priority_rank(priority)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return priority
+
+
+async def identify_client(request: Request, x_api_key: Optional[str] = Header(default=None)) -> Optional[str]:
+    """
+    Cliente de la petición (None si no se limita). Es async para que
+    current_client quede fijado en el contexto del endpoint
+    """
+    client = rate_limiter.identify(request.client.host if request.client else None, request.headers, x_api_key)
+    current_client.set(client)
+    return client
+
+
+async def limit_client(client: Optional[str] = Depends(identify_client)) -> Optional[str]:
+    """Cobra una ficha del bucket del cliente (429 si no le quedan)"""
+    charge_client(client)
+    return client
+
+
+def charge_client(client: Optional[str], cost: float = 1) -> None:
+    if client is None:
+        return
+    retry_after = rate_limiter.take(client, cost)
+    if retry_after:
+        print(f"[LIMIT] {client} sin cupo (reintento en {retry_after:.1f}s)")
+        raise RateLimited(client, math.ceil(retry_after))
+
+
+def require_admin(x_admin_token: Optional[str] = Header(default=None)):
+    """
+    Exige la cabecera X-Admin-Token. Sin ADMIN_TOKEN configurado los
+    endpoints de administración quedan cerrados: el puente suele estar
+    expuesto a Internet a través del túnel.
+    """
+    if not ADMIN_TOKEN:
+        raise HTTPException(status_code=403, detail="Administracion desactivada: define ADMIN_TOKEN")
+    if not hmac.compare_digest(x_admin_token or "", ADMIN_TOKEN):
+        raise HTTPException(status_code=403, detail="Token de administracion invalido")
 
 
 # Importar CLI de auth para refresco automático
@@ -67,133 +541,990 @@ except ImportError:
     run_headless_auth = None
 
 
+def init_client(force_refresh: bool = False) -> bool:
+    """
+    Inicializa los clientes NotebookLM de todas las cuentas.
+    Sin force_refresh solo se reconstruyen si las credenciales cambiaron.
+    """
+    if force_refresh:
+        return any([account.store.refresh(reason="manual") for account in client_pool.accounts])
+    for account in client_pool.accounts:
+        account.store.get_client()
+    return client_pool.authenticated
+
+
 # ============================================================================
-# Re-autenticacion Automatica
+# Ejecución de consultas
 # ============================================================================
 
-# Control de tiempo para evitar re-auth excesivos
-last_reauth_time = 0
-REAUTH_COOLDOWN = 30  # Segundos minimos entre re-autenticaciones
+async def run_upstream(fn, *args, notebook_id: Optional[str] = None, priority: str = DEFAULT_PRIORITY, **kwargs):
+    """upstream_executor.run detrás del circuit breaker (lecturas de metadatos y fuentes)"""
+    upstream_breaker.check()
+    async with upstream_executor.slot(notebook_id, priority=priority, client=current_client.get()):
+        with upstream_breaker.guard():
+            return await upstream_executor.call(fn, *args, **kwargs)
+
 
-def auto_reauth() -> bool:
+@asynccontextmanager
+async def deadline_slot(notebook_id: str, deadline: Deadline, phase: str, priority: Optional[str] = None):
     """
-    Ejecuta notebooklm-mcp-auth --file automaticamente para renovar credenciales.
-    Usa el archivo cookies.txt del directorio del proyecto si existe.
-    Retorna True si tuvo exito, False en caso contrario.
+    Plaza del ejecutor sin esperar en cola más de lo que permite el plazo.
+    Si la espera se agota porque ya no queda tiempo para `phase`, el error es
+    DeadlineExceeded en lugar de 429.
     """
-    global last_reauth_time
+    deadline.require(phase)
+    try:
+        slot = await upstream_executor.acquire(
+            notebook_id, deadline.queue_wait(upstream_executor.max_wait), priority, current_client.get()
+        )
+    except UpstreamBusy:
+        deadline.require(phase)
+        raise
+    try:
+        yield slot
+    finally:
+        upstream_executor.release(slot)
+
+
+async def execute_query(
+    request: QueryRequest, trace: RequestTrace, attempt: int, account: Account, deadline: Deadline
+) -> QueryResponse:
+    """Ejecuta la consulta contra NotebookLM con el cliente de la cuenta"""
+    client = account.store.client
+    full_query = request.question
+
+    phase = f"upstream_attempt_{attempt}"
+    upstream_breaker.check()
+    async with deadline_slot(request.notebook_id, deadline, phase, request.priority) as slot:
+        trace.add_phase("queue_wait", slot.waited)
+        with trace.phase(phase), upstream_breaker.guard():
+            # El intento dispone solo del tiempo que le queda a la petición
+            result = await upstream_executor.call(
+                client.query,
+                notebook_id=request.notebook_id,
+                query_text=full_query,
+                conversation_id=request.conversation_id,
+                timeout=deadline.require(phase)
+            )
+    conversation_id = result.get("conversation_id") if isinstance(result, dict) else None
+    client_pool.pin(conversation_id, account)
+    await publish_conversation(conversation_id, account)
 
-    current_time = time.time()
+    if isinstance(result, dict):
+        answer = result.get("answer") or result.get("text") or result.get("content") or ""
+        conv_id = result.get("conversation_id")
+    else:
+        answer = str(result)
+        conv_id = None
+
+    trace.set(
+        attempts=attempt,
+        account=account.name,
+        result_type=type(result).__name__,
+        raw_result=request_log.truncate(result),
+        answer_chars=len(answer),
+        answer=request_log.truncate(answer),
+        outcome="success" if answer.strip() else "empty_answer"
+    )
 
-    # Evitar re-auth muy frecuentes
-    if current_time - last_reauth_time < REAUTH_COOLDOWN:
-        print(f"[REAUTH] Cooldown activo. Esperando {REAUTH_COOLDOWN}s entre re-autenticaciones.")
-        return False
+    return QueryResponse(
+        success=True,
+        answer=answer,
+        conversation_id=conv_id
+    )
 
-    # Buscar archivo cookies.txt
-    project_dir = Path(__file__).parent
-    cookies_file = project_dir / "cookies.txt"
 
-    if not cookies_file.exists():
-        print("[REAUTH] No existe cookies.txt - re-autenticacion automatica no disponible")
-        print("[REAUTH] Para habilitar re-auth automatica:")
-        print("  1. Abre Chrome -> notebooklm.google.com")
-        print("  2. F12 -> Network -> filtrar 'batchexecute'")
-        print("  3. Copia el header 'cookie' y guardalo en cookies.txt")
-        return False
+async def query_account(
+    account: Account, request: QueryRequest, trace: RequestTrace, attempt: int, deadline: Deadline
+) -> tuple[Optional[QueryResponse], int, int]:
+    """
+    Intento normal y, si falla la autenticación, recarga de tokens del disco.
+    Devuelve (respuesta o None si la cuenta sigue sin autenticar, último
+    número de intento, generación de credenciales con la que falló).
+    """
+    # Intento normal
+    attempt += 1
+    print(f"[RETRY] Intento {attempt} ({account.name}): Consulta normal...")
+    generation = account.store.generation
+    try:
+        return await execute_query(request, trace, attempt, account, deadline), attempt, generation
+    except AuthenticationError as e:
+        print(f"[WARN] Error de autenticacion en intento {attempt} ({account.name}): {e}")
+
+    # Recargar tokens del disco (salvo que otra petición ya haya renovado el
+    # cliente mientras tanto)
+    attempt += 1
+    if account.store.generation == generation:
+        print(f"[RETRY] Intento {attempt} ({account.name}): Recargando tokens del disco...")
+        # Recargar solo tiene sentido si después queda tiempo para el intento
+        deadline.require("credential_reload")
+        with trace.phase("credential_reload"):
+            await asyncio.to_thread(account.store.refresh, "auth_error")
+    else:
+        print(f"[RETRY] Intento {attempt} ({account.name}): Credenciales ya renovadas por otra peticion")
+    generation = account.store.generation
+    try:
+        return await execute_query(request, trace, attempt, account, deadline), attempt, generation
+    except AuthenticationError as e:
+        print(f"[WARN] Error de autenticacion en intento {attempt} ({account.name}): {e}")
+    return None, attempt, generation
 
-    print(f"[REAUTH] Encontrado cookies.txt, iniciando re-autenticacion...")
 
+async def run_query_with_retries(
+    request: QueryRequest, trace: RequestTrace, deadline: Optional[Deadline] = None
+) -> QueryResponse:
+    """
+    Ejecuta la consulta con re-autenticacion automatica si es necesario.
+    Flujo de reintentos (ver query_account para los dos primeros pasos):
+      1. Intento normal en la cuenta menos cargada
+      2. Si falla auth -> recargar tokens del disco
+      3. Si sigue fallando -> si hay otra cuenta sana se pasa a ella (esta se
+         re-autentica en segundo plano); si no, re-autenticacion compartida
+         y reintentar
+    Todos los pasos descuentan del mismo plazo (request.timeout); el paso que
+    ya no cabe no se lanza y la consulta termina con 504.
+    """
+    if deadline is None:
+        deadline = Deadline.for_timeout(request.timeout)
+    trace.set(deadline_s=deadline.budget)
     try:
-        # Ejecutar notebooklm-mcp-auth --file pasando el archivo por stdin
-        result = subprocess.run(
-            ["notebooklm-mcp-auth", "--file"],
-            input=str(cookies_file) + "\n",
-            capture_output=True,
-            text=True,
-            timeout=60
+        attempt = 0
+        excluded: set[str] = set()
+        while True:
+            account = client_pool.pick(request.conversation_id, exclude=excluded)
+            if account is None:
+                raise AuthenticationError("No hay ninguna cuenta de NotebookLM disponible")
+            client_pool.adopt_conversation(request.conversation_id, account)
+            await hydrate_conversation(request.conversation_id, account)
+
+            with client_pool.use(account):
+                response, attempt, generation = await query_account(account, request, trace, attempt, deadline)
+            if response is not None:
+                return response
+
+            client_pool.mark_auth_failure(account, generation)
+            excluded.add(account.name)
+            if client_pool.has_alternative(excluded):
+                # Otra cuenta atiende la consulta; esta se renueva sin esperar
+                print(f"[POOL] Cuenta {account.name} sin credenciales validas, pasando a otra cuenta")
+                account.failovers += 1
+                trace.set(failovers=trace.fields.get("failovers", 0) + 1)
+                client_pool.reauth_in_background(account, generation)
+                continue
+
+            # Re-autenticacion automatica (compartida entre peticiones)
+            attempt += 1
+            print(f"[RETRY] Intento {attempt} ({account.name}): Ejecutando re-autenticacion automatica...")
+            # La re-autenticación sigue en segundo plano aunque esta petición
+            # deje de esperarla (reauth() está protegida con shield)
+            reauth_wait = deadline.require("reauth") - deadline.min_attempt
+            if reauth_wait <= 0:
+                raise DeadlineExceeded("reauth", deadline.budget, deadline.remaining())
+            with trace.phase("reauth"):
+                try:
+                    reauth_success = await asyncio.wait_for(account.coordinator.reauth(generation), reauth_wait)
+                except asyncio.TimeoutError:
+                    raise DeadlineExceeded("reauth", deadline.budget, deadline.remaining())
+            trace.set(reauth=account.coordinator.last_outcome)
+
+            if reauth_success:
+                try:
+                    with client_pool.use(account):
+                        return await execute_query(request, trace, attempt, account, deadline)
+                except AuthenticationError as e:
+                    print(f"[ERROR] Error incluso despues de re-auth: {e}")
+                    raise e
+            else:
+                print("[ERROR] Re-autenticacion automatica fallida")
+                raise AuthenticationError("Re-autenticacion automatica fallida. Verifica que Chrome este logueado en Google.")
+
+    except DeadlineExceeded as e:
+        print(f"[DEADLINE] {e}")
+        trace.set(outcome="deadline_exceeded", deadline_phase=e.phase)
+        raise HTTPException(status_code=504, detail=str(e))
+    except AuthenticationError as e:
+        print(f"[ERROR] Error final de autenticacion: {e}")
+        trace.set(outcome="auth_error", error=str(e))
+        raise HTTPException(
+            status_code=401,
+            detail=f"Error de autenticacion: {str(e)}. Si el problema persiste, ejecuta 'notebooklm-mcp-auth --file' manualmente."
         )
+    except httpx.HTTPStatusError as e:
+        error_detail = f"Error HTTP {e.response.status_code}: {e.response.text[:200]}"
+        print(f"[ERROR] HTTPStatusError: {error_detail}")
+        trace.set(outcome="http_error", status=e.response.status_code, error=request_log.truncate(error_detail))
+        return QueryResponse(
+            success=False,
+            error=f"Error del servidor NotebookLM ({e.response.status_code})."
+        )
+    except CircuitOpen as e:
+        print(f"[CIRCUIT] Consulta no intentada: {e}")
+        trace.set(outcome="circuit_open", retry_after=e.retry_after)
+        raise
+    except UpstreamBusy as e:
+        print(f"[BUSY] Consulta rechazada: {e}")
+        trace.set(outcome="busy", retry_after=e.retry_after)
+        raise
+    except Exception as e:
+        print(f"[ERROR] Error inesperado: {type(e).__name__}: {e}")
+        trace.set(outcome="error", error=f"{type(e).__name__}: {e}")
+        return QueryResponse(
+            success=False,
+            error=f"Error inesperado: {type(e).__name__}: {str(e)}"
+        )
+    finally:
+        trace.set(deadline_remaining_s=round(deadline.remaining(), 3))
+
+
+def finish_trace(trace: RequestTrace) -> None:
+    """Vuelca la traza a las métricas y al registro de peticiones"""
+    outcome = trace.fields.get("outcome", "unknown")
+    request_count.inc(trace.kind, outcome)
+    request_seconds.observe(trace.elapsed_ms() / 1000, trace.kind)
+    for phase, ms in trace.phases.items():
+        phase_seconds.observe(ms / 1000, trace.kind, phase)
+    if "answer_chars" in trace.fields:
+        answer_size.observe(trace.fields["answer_chars"], trace.kind)
+    if "queue_wait" in trace.phases:
+        queue_wait_seconds.observe(trace.phases["queue_wait"] / 1000, trace.fields.get("priority", DEFAULT_PRIORITY))
+    if "deadline_remaining_s" in trace.fields:
+        deadline_remaining.observe(trace.fields["deadline_remaining_s"], trace.kind)
+    if "deadline_phase" in trace.fields:
+        deadline_exceeded.inc(trace.kind, trace.fields["deadline_phase"])
+    request_log.log_trace(trace)
+
+
+def start_query_trace(kind: str, request: QueryRequest) -> RequestTrace:
+    """Crea la traza de una consulta con los campos comunes"""
+    trace = RequestTrace(kind)
+    trace.set(
+        notebook_id=request.notebook_id,
+        follow_up=request.conversation_id is not None,
+        priority=request.priority or DEFAULT_PRIORITY,
+        client=current_client.get(),
+        question_chars=len(request.question),
+        question=request_log.truncate(request.question)
+    )
+    return trace
+
 
-        last_reauth_time = time.time()
-
-        if result.returncode == 0:
-            print("[REAUTH] Re-autenticacion exitosa!")
-            print(f"[REAUTH] Output: {result.stdout[:300] if result.stdout else 'OK'}")
-            return True
-        else:
-            print(f"[REAUTH] Fallo con codigo {result.returncode}")
-            print(f"[REAUTH] STDOUT: {result.stdout[:500] if result.stdout else 'Vacio'}")
-            print(f"[REAUTH] STDERR: {result.stderr[:500] if result.stderr else 'Vacio'}")
-            return False
-
-    except subprocess.TimeoutExpired:
-        print("[REAUTH] Timeout - la re-autenticacion tardo demasiado")
-        last_reauth_time = time.time()
-        return False
-    except FileNotFoundError:
-        print("[REAUTH] Error: notebooklm-mcp-auth no encontrado en PATH")
-        return False
+async def answer_query(request: QueryRequest, trace: RequestTrace, lookup_cache: bool = True) -> QueryResponse:
+    """
+    Responde una consulta: caché, coalescencia de consultas idénticas y, si
+    hace falta, llamada a NotebookLM con reintentos. Con lookup_cache=False
+    se pide siempre a NotebookLM (la respuesta sí se guarda en caché).
+    El plazo de la consulta empieza a contar aquí.
+    """
+    deadline = Deadline.for_timeout(request.timeout)
+    # Cada cuenta detecta re-logins (cambios en auth.json o en la variable de
+    # entorno) sin reconstruir el cliente en cada consulta.
+    with trace.phase("credentials"):
+        authenticated = await client_pool.ensure_clients()
+    if not authenticated:
+        trace.set(outcome="not_initialized")
+        raise HTTPException(
+            status_code=503,
+            detail="Cliente NotebookLM no inicializado"
+        )
+
+    print(f"[QUERY] Consulta recibida: {request.question[:50]}...")
+
+    if not is_cacheable(request):
+        return await run_query_with_retries(request, trace, deadline)
+
+    if answer_cache is not None and lookup_cache:
+        with trace.phase("cache_lookup"):
+            entry, tier, similarity = await lookup_answer(request)
+        if entry is not None:
+            print(f"[CACHE] Acierto ({tier})")
+            trace.set(outcome="cache_hit", cache_tier=tier, answer_chars=len(entry["answer"]))
+            if similarity is not None:
+                trace.set(similarity=similarity)
+            return QueryResponse(
+                success=True,
+                answer=entry["answer"],
+                conversation_id=await seed_conversation(request.question, entry["answer"]),
+                cached=True,
+                cache_tier=tier
+            )
+
+    async def fetch_and_store() -> QueryResponse:
+        # Se guarda en caché dentro de la llamada compartida: aunque todos los
+        # solicitantes se desconecten, la respuesta no se pierde
+        response = await run_query_with_retries(request, trace, deadline)
+        if answer_cache is not None and response.success and response.answer and response.answer.strip():
+            with trace.phase("cache_store"):
+                await store_answer(request, response.answer)
+        return response
+
+    key = cache_key(request.notebook_id, request.question)
+    started = time.perf_counter()
+    response, shared = await query_flights.do(key, fetch_and_store)
+    if shared:
+        # Las fases de la llamada las registra la traza de quien la lanzó
+        trace.add_phase("coalesced_wait", time.perf_counter() - started)
+        trace.set(outcome="coalesced", answer_chars=len(response.answer or ""))
+    if shared and response.success and response.answer:
+        # Cada solicitante recibe su propia conversación para los seguimientos
+        print("[QUERY] Respuesta compartida con una consulta identica en curso")
+        response = response.model_copy(update={
+            "conversation_id": await seed_conversation(request.question, response.answer)
+        })
+    return response
+
+
+# ============================================================================
+# Streaming (SSE)
+# ============================================================================
+
+# Intervalo de los comentarios keepalive: el túnel de Cloudflare corta las
+# conexiones que pasan ~100 s sin recibir datos
+SSE_HEARTBEAT_INTERVAL = float(os.environ.get("SSE_HEARTBEAT_INTERVAL", "15"))
+
+
+def sse_event(event: str, data: dict) -> str:
+    """Formatea un evento server-sent-events"""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+async def iterate_upstream_stream(
+    request: QueryRequest, stop_event: threading.Event, account: Account, deadline: Deadline
+) -> AsyncIterator[tuple[str, object]]:
+    """Ejecuta stream_query() en un hilo y entrega sus elementos al event loop"""
+    loop = asyncio.get_running_loop()
+    queue: asyncio.Queue = asyncio.Queue()
+    client = account.store.client
+
+    def push(item):
+        try:
+            loop.call_soon_threadsafe(queue.put_nowait, item)
+        except RuntimeError:
+            pass  # El event loop ya se cerró
+
+    def producer():
+        try:
+            for item in stream_query(
+                client,
+                notebook_id=request.notebook_id,
+                query_text=request.question,
+                conversation_id=request.conversation_id,
+                timeout=timeout,
+                stop_event=stop_event
+            ):
+                push(("item", item))
+        except BaseException as e:
+            push(("error", e))
+        finally:
+            push(("end", None))
+
+    # La plaza del ejecutor se mantiene mientras dura la lectura del stream.
+    # Su duración depende de la respuesta: no cuenta como llamada lenta
+    upstream_breaker.check()
+    async with deadline_slot(request.notebook_id, deadline, "upstream_stream", request.priority) as slot:
+        yield "queued", slot.waited
+        timeout = deadline.require("upstream_stream")
+        with upstream_breaker.guard(track_latency=False):
+            worker = loop.run_in_executor(upstream_executor.pool, producer)
+            try:
+                while True:
+                    kind, payload = await queue.get()
+                    if kind == "item":
+                        yield payload
+                    elif kind == "error":
+                        raise payload
+                    else:
+                        break
+            finally:
+                stop_event.set()
+                await asyncio.shield(worker)
+
+
+async def produce_query_events(
+    request: QueryRequest,
+    queue: asyncio.Queue,
+    trace: RequestTrace,
+    on_done: Optional[Callable[[QueryResponse], Awaitable[None]]] = None,
+) -> None:
+    """Genera los eventos SSE de una consulta y los deja en la cola"""
+    cacheable = is_cacheable(request)
+    deadline = Deadline.for_timeout(request.timeout)
+    trace.set(deadline_s=deadline.budget)
+
+    async def done(response: QueryResponse) -> None:
+        response = response.model_copy(update={"request_id": trace.request_id})
+        if on_done is not None:
+            await on_done(response)
+        await queue.put(sse_event("done", response.model_dump()))
+
+    sent = ""
+
+    async def error(status: int, message: str, outcome: str, **extra) -> None:
+        if not sent:
+            # Nada enviado todavía: se puede responder con las fuentes indexadas
+            degraded = await degraded_response(request, trace, message)
+            if degraded is not None:
+                await queue.put(sse_event("chunk", {"delta": degraded.answer}))
+                await done(degraded)
+                return
+        trace.set(outcome=outcome, status=status, error=request_log.truncate(message), **extra)
+        trace.set(deadline_remaining_s=round(deadline.remaining(), 3))
+        await queue.put(sse_event("error", {"status": status, "error": message, "request_id": trace.request_id, **extra}))
+
+    if cacheable and answer_cache is not None:
+        with trace.phase("cache_lookup"):
+            entry, tier, similarity = await lookup_answer(request)
+        if entry is not None:
+            print(f"[CACHE] Acierto en streaming ({tier})")
+            trace.set(outcome="cache_hit", cache_tier=tier, answer_chars=len(entry["answer"]))
+            if similarity is not None:
+                trace.set(similarity=similarity)
+            await queue.put(sse_event("chunk", {"delta": entry["answer"]}))
+            await done(QueryResponse(
+                success=True,
+                answer=entry["answer"],
+                conversation_id=await seed_conversation(request.question, entry["answer"]),
+                cached=True,
+                cache_tier=tier
+            ))
+            return
+
+    account = client_pool.pick(request.conversation_id)
+    if account is None:
+        await error(503, "Cliente NotebookLM no inicializado", "not_initialized")
+        return
+    client_pool.adopt_conversation(request.conversation_id, account)
+    await hydrate_conversation(request.conversation_id, account)
+    trace.set(account=account.name)
+
+    result = None
+    chunks = 0
+    stop_event = threading.Event()
+    try:
+        with trace.phase("upstream_stream"), client_pool.use(account):
+            async for kind, payload in iterate_upstream_stream(request, stop_event, account, deadline):
+                if kind == "queued":
+                    trace.add_phase("queue_wait", payload)
+                elif kind == "answer":
+                    text = payload
+                    if not sent:
+                        trace.set(first_chunk_ms=round(trace.elapsed_ms(), 2))
+                    if text.startswith(sent):
+                        await queue.put(sse_event("chunk", {"delta": text[len(sent):]}))
+                    else:
+                        await queue.put(sse_event("replace", {"text": text}))
+                    sent = text
+                    chunks += 1
+                elif kind == "done":
+                    result = payload
+    except AuthenticationError as e:
+        if sent:
+            await error(401, f"Error de autenticacion: {e}", "auth_error")
+            return
+        # Nada enviado todavía: se recurre al flujo completo de reintentos
+        print(f"[STREAM] Error de autenticacion, usando flujo con reintentos: {e}")
+        try:
+            response = await run_query_with_retries(request, trace, deadline)
+        except HTTPException as http_error:
+            outcome = "deadline_exceeded" if http_error.status_code == 504 else "auth_error"
+            await error(http_error.status_code, http_error.detail, outcome)
+            return
+        except UpstreamBusy as busy:
+            await error(busy.status_code, str(busy), busy_outcome(busy), retry_after=busy.retry_after)
+            return
+        if response.success and response.answer:
+            await queue.put(sse_event("chunk", {"delta": response.answer}))
+            if cacheable and answer_cache is not None and response.answer.strip():
+                await store_answer(request, response.answer)
+        await done(response)
+        return
+    except DeadlineExceeded as e:
+        print(f"[DEADLINE] Streaming: {e}")
+        trace.set(deadline_phase=e.phase)
+        await error(504, str(e), "deadline_exceeded")
+        return
+    except CircuitOpen as e:
+        print(f"[CIRCUIT] Consulta en streaming no intentada: {e}")
+        await error(e.status_code, str(e), "circuit_open", retry_after=e.retry_after)
+        return
+    except UpstreamBusy as e:
+        print(f"[BUSY] Consulta en streaming rechazada: {e}")
+        await error(429, str(e), "busy", retry_after=e.retry_after)
+        return
+    except httpx.HTTPStatusError as e:
+        print(f"[ERROR] HTTPStatusError en streaming: {e.response.status_code}")
+        await error(e.response.status_code, f"Error del servidor NotebookLM ({e.response.status_code}).", "http_error")
+        return
     except Exception as e:
-        print(f"[REAUTH] Error inesperado: {e}")
-        last_reauth_time = time.time()
-        return False
+        print(f"[ERROR] Error inesperado en streaming: {type(e).__name__}: {e}")
+        await error(500, f"Error inesperado: {type(e).__name__}: {str(e)}", "error")
+        return
+
+    answer = (result or {}).get("answer") or sent
+    client_pool.pin((result or {}).get("conversation_id"), account)
+    await publish_conversation((result or {}).get("conversation_id"), account)
+    trace.set(
+        chunks=chunks,
+        deadline_remaining_s=round(deadline.remaining(), 3),
+        answer_chars=len(answer),
+        answer=request_log.truncate(answer),
+        outcome="success" if answer.strip() else "empty_answer"
+    )
+    if cacheable and answer_cache is not None and answer.strip():
+        await store_answer(request, answer)
+    await done(QueryResponse(
+        success=True,
+        answer=answer,
+        conversation_id=(result or {}).get("conversation_id")
+    ))
+
+
+# ============================================================================
+# Consultas por lotes
+# ============================================================================
+
+BATCH_MAX_QUESTIONS = int(os.environ.get("BATCH_MAX_QUESTIONS", "200"))
+BATCH_MAX_CONCURRENCY = int(os.environ.get("BATCH_MAX_CONCURRENCY", "4"))
+# Reintentos de una pregunta rechazada por falta de capacidad (429)
+BATCH_BUSY_RETRIES = int(os.environ.get("BATCH_BUSY_RETRIES", "3"))
+
+
+async def run_batch_item(index: int, request: QueryRequest, batch_id: str) -> BatchItemResult:
+    """Responde una pregunta del lote con el mismo flujo que /query"""
+    trace = start_query_trace("query_batch_item", request)
+    trace.set(batch_id=batch_id, batch_index=index)
+    started = time.perf_counter()
+    item = BatchItemResult(index=index, question=request.question, success=False, request_id=trace.request_id)
+    try:
+        for busy_retry in range(BATCH_BUSY_RETRIES + 1):
+            try:
+                response = await answer_query(request, trace)
+                break
+            except UpstreamBusy as e:
+                if busy_retry >= BATCH_BUSY_RETRIES:
+                    raise
+                # Un lote no tiene prisa: se espera lo que indique el ejecutor
+                with trace.phase("busy_backoff"):
+                    await asyncio.sleep(e.retry_after)
+        item.success = response.success
+        item.answer = response.answer
+        item.conversation_id = response.conversation_id
+        item.error = response.error
+        item.cached = response.cached
+        item.cache_tier = response.cache_tier
+        if not response.success:
+            item.status = 502
+    except HTTPException as e:
+        trace.set(status=e.status_code, error=request_log.truncate(e.detail))
+        item.status = e.status_code
+        item.error = str(e.detail)
+    except UpstreamBusy as e:
+        trace.set(outcome=busy_outcome(e), status=e.status_code, error=str(e))
+        item.status = e.status_code
+        item.error = str(e)
+    except Exception as e:
+        print(f"[BATCH] Error inesperado en la pregunta {index}: {type(e).__name__}: {e}")
+        trace.set(outcome="error", error=f"{type(e).__name__}: {e}")
+        item.status = 500
+        item.error = f"Error inesperado: {type(e).__name__}: {str(e)}"
+    finally:
+        finish_trace(trace)
+    item.elapsed_ms = round((time.perf_counter() - started) * 1000, 2)
+    return item
+
+
+def start_batch(batch: BatchQueryRequest, batch_id: str) -> list[asyncio.Task]:
+    """Lanza todas las preguntas con paralelismo acotado"""
+    concurrency = max(1, min(batch.concurrency or BATCH_MAX_CONCURRENCY, BATCH_MAX_CONCURRENCY))
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def bounded(index: int, question: str) -> BatchItemResult:
+        async with semaphore:
+            request = QueryRequest(
+                question=question, notebook_id=batch.notebook_id, timeout=batch.timeout, priority=batch.priority
+            )
+            return await run_batch_item(index, request, batch_id)
+
+    return [asyncio.create_task(bounded(i, q)) for i, q in enumerate(batch.questions)]
+
+
+def summarize_batch(batch: BatchQueryRequest, batch_id: str, results: list[BatchItemResult], started: float) -> dict:
+    succeeded = sum(1 for r in results if r.success)
+    return {
+        "success": succeeded == len(results),
+        "notebook_id": batch.notebook_id,
+        "total": len(results),
+        "succeeded": succeeded,
+        "failed": len(results) - succeeded,
+        "elapsed_ms": round((time.perf_counter() - started) * 1000, 2),
+        "batch_id": batch_id,
+    }
+
+
+async def batch_ndjson_stream(batch: BatchQueryRequest, batch_id: str) -> AsyncIterator[str]:
+    """Entrega cada resultado (en orden) como una línea JSON y al final el resumen"""
+    started = time.perf_counter()
+    tasks = start_batch(batch, batch_id)
+    results = []
+    try:
+        for task in tasks:
+            result = await task
+            results.append(result)
+            yield json.dumps({"type": "result", **result.model_dump()}, ensure_ascii=False) + "\n"
+        summary = summarize_batch(batch, batch_id, results, started)
+        print(f"[BATCH] Lote {batch_id} terminado: {summary['succeeded']}/{summary['total']} correctas")
+        yield json.dumps({"type": "summary", **summary}, ensure_ascii=False) + "\n"
+    finally:
+        # Si el cliente se desconecta se cancelan las preguntas pendientes
+        for task in tasks:
+            if not task.done():
+                task.cancel()
+
+
+async def query_event_stream(
+    request: QueryRequest,
+    on_done: Optional[Callable[[QueryResponse], Awaitable[None]]] = None,
+    trace_fields: Optional[dict] = None,
+) -> AsyncIterator[str]:
+    """Reenvía los eventos de la consulta intercalando keepalives"""
+    queue: asyncio.Queue = asyncio.Queue()
+    trace = start_query_trace("query_stream", request)
+    trace.set(**(trace_fields or {}))
+
+    async def run():
+        try:
+            await produce_query_events(request, queue, trace, on_done)
+        finally:
+            await queue.put(None)
 
+    producer = asyncio.create_task(run())
+    try:
+        while True:
+            try:
+                event = await asyncio.wait_for(queue.get(), timeout=SSE_HEARTBEAT_INTERVAL)
+            except asyncio.TimeoutError:
+                yield ": keepalive\n\n"
+                continue
+            if event is None:
+                break
+            yield event
+    finally:
+        # Si el cliente se desconecta se detiene la lectura del upstream
+        if not producer.done():
+            producer.cancel()
+            trace.set(outcome="client_disconnected")
+        finish_trace(trace)
+
+
+# ============================================================================
+# Sesiones
+# ============================================================================
+
+async def load_session(session_id: str) -> dict:
+    session = await session_store.get(session_id)
+    if session is None:
+        raise HTTPException(status_code=404, detail="Sesion no encontrada o caducada")
+    return session
+
+
+def session_request(session: dict, body: SessionQueryRequest) -> QueryRequest:
+    if semantic_index is not None and not session.get("conversation_id"):
+        # Las instrucciones de la sesión no cuentan para la similitud
+        semantic_index.register_prompt(session.get("system_prompt", ""))
+    return QueryRequest(
+        question=session_store.question_for(session, body.question),
+        notebook_id=session["notebook_id"],
+        conversation_id=session.get("conversation_id"),
+        timeout=body.timeout,
+        priority=body.priority
+    )
+
+
+def session_info(session: dict) -> SessionInfo:
+    return SessionInfo(
+        session_id=session["id"],
+        notebook_id=session["notebook_id"],
+        conversation_id=session.get("conversation_id"),
+        prompt_hash=session.get("prompt_hash"),
+        turns=session["turns"],
+        created_at=session["created_at"],
+        updated_at=session["updated_at"],
+        expires_in_s=round(max(session["updated_at"] + session_store.ttl - time.time(), 0), 1)
+    )
+
+
+# ============================================================================
+# Trabajos asíncronos
+# ============================================================================
+
+def job_info(job: dict) -> JobInfo:
+    return JobInfo(
+        job_id=job["id"],
+        status=job["status"],
+        kind=job["kind"],
+        created_at=job["created_at"],
+        updated_at=job["updated_at"],
+        session_id=job.get("session_id"),
+        result=job["result"],
+        error=job["error"],
+        status_code=job["status_code"]
+    )
+
+
+async def run_query_job(
+    job_id: str,
+    request: QueryRequest,
+    session: Optional[dict] = None,
+    user_turn: Optional[str] = None
+) -> dict:
+    """Cuerpo de un trabajo: el mismo flujo que /query (o la consulta de sesión)"""
+    trace = start_query_trace("job", request)
+    trace.set(job_id=job_id)
+    if session is not None:
+        trace.set(session_id=session["id"], prompt_hash=session.get("prompt_hash"))
+    try:
+        response = await answer_with_fallback(request, trace)
+        if session is not None and response.success and not response.degraded:
+            await session_store.record_turn(session, user_turn, response.answer or "", response.conversation_id)
+        return response.model_copy(update={"request_id": trace.request_id}).model_dump()
+    except HTTPException as e:
+        trace.set(status=e.status_code, error=request_log.truncate(e.detail))
+        raise
+    except UpstreamBusy as e:
+        trace.set(outcome=busy_outcome(e), status=e.status_code, error=str(e))
+        raise
+    finally:
+        finish_trace(trace)
 
-def init_client(force_refresh: bool = False):
+
+# ============================================================================
+# Precalentamiento de la caché
+# ============================================================================
+
+async def warm_question(notebook_id: str, question: str) -> str:
     """
-    Inicializa el cliente NotebookLM con tokens del archivo auth.json.
+    Pide una pregunta sugerida tal como la envía el chat (con las
+    instrucciones del sistema) si su respuesta en caché falta o es antigua
     """
-    global client
-    
-    # 1. Cargar desde Variables de Entorno (Prioridad Nube)
-    cookie_header = os.environ.get("NOTEBOOKLM_COOKIES", "")
-    if cookie_header:
+    request = QueryRequest(question=SYSTEM_INSTRUCTIONS + question, notebook_id=notebook_id, priority="background")
+    max_age = CACHE_WARMER_MAX_AGE or answer_cache.ttl / 2
+    entry, _ = await answer_cache.get(notebook_id, request.question)
+    if entry is not None and time.time() - entry["created_at"] < max_age:
+        return "fresh"
+
+    trace = start_query_trace("warmup", request)
+    try:
+        response = await answer_query(request, trace, lookup_cache=False)
+    except UpstreamBusy:
+        return "busy"
+    except HTTPException:
+        return "error"
+    finally:
+        finish_trace(trace)
+    # Nadie va a seguir esta conversación
+    release_conversation(response.conversation_id)
+    if not response.success:
+        return "error"
+    return "warmed" if response.answer and response.answer.strip() else "empty"
+
+
+def warmer_idle() -> bool:
+    """Sin cola y con al menos la mitad de los workers libres"""
+    executor = upstream_executor.stats()
+    return executor["queue_depth"] == 0 and executor["active"] < max(executor["max_workers"] // 2, 1)
+
+
+async def check_warmed_sources() -> None:
+    """Refresca los metadatos del cuaderno para detectar cambios de fuentes"""
+    notebook_id = cache_warmer.notebook_id
+    await metadata_cache.get(f"notebook:{notebook_id}", lambda: fetch_notebook(notebook_id, priority="background"))
+
+
+cache_warmer: Optional[CacheWarmer] = None
+if CACHE_WARMER_ENABLED and answer_cache is not None:
+    cache_warmer = CacheWarmer(
+        NOTEBOOK_ID,
+        SUGGESTED_QUESTIONS,
+        warm_question,
+        warmer_idle,
+        shared=shared_state,
+        before_round=check_warmed_sources
+    )
+
+
+# ============================================================================
+# Índice local de fuentes
+# ============================================================================
+
+source_library: Optional[SourceLibrary] = None
+if SOURCE_INDEX_ENABLED:
+    if np is None:
+        print("[SEARCH] Indice de fuentes desactivado: numpy no esta instalado")
+    else:
+        source_library = SourceLibrary()
+
+source_flights = SingleFlight("source_index")
+background_tasks: set[asyncio.Task] = set()
+
+
+async def ingest_notebook_sources(notebook_id: str, refresh: bool = False) -> dict:
+    """
+    Descarga el texto de las fuentes nuevas del cuaderno (o de todas con
+    refresh), olvida las que se quitaron y reconstruye el índice
+    """
+    async def run() -> dict:
+        notebook = await fetch_notebook(notebook_id, priority="background")
+        sources = [source for source in notebook["sources"] or [] if source.get("id")]
+        stored = await asyncio.to_thread(source_library.documents, notebook_id)
+        known = {d["source_id"] for d in stored if d["origin"] == "notebooklm"}
+        fetched, failed = 0, 0
+        for source in sources:
+            if source["id"] in known and not refresh:
+                continue
+            try:
+                client = metadata_client()
+                fulltext = await run_upstream(
+                    client.get_source_fulltext, source["id"], notebook_id=notebook_id, priority="background"
+                )
+            except UpstreamBusy:
+                raise
+            except Exception as e:
+                print(f"[SEARCH] No se pudo descargar la fuente {source.get('title')}: {type(e).__name__}: {e}")
+                failed += 1
+                continue
+            await asyncio.to_thread(
+                source_library.save_document, notebook_id, source["id"],
+                fulltext.get("title") or source.get("title") or "", fulltext.get("content") or "", "notebooklm"
+            )
+            fetched += 1
+        pruned = await asyncio.to_thread(source_library.prune, notebook_id, {s["id"] for s in sources})
+        built = await asyncio.to_thread(source_library.build, notebook_id)
+        return {"notebook_id": notebook_id, "fetched": fetched, "failed": failed, "pruned": pruned, **built}
+
+    result, _ = await source_flights.do(notebook_id, run)
+    return result
+
+
+def ingest_in_background(notebook_id: str, reason: str) -> None:
+    """Indexa el cuaderno sin bloquear; con varios workers lo hace uno"""
+    async def run():
         try:
-            cookies = {}
-            for item in cookie_header.split(";"):
-                if "=" in item:
-                    k, v = item.strip().split("=", 1)
-                    cookies[k] = v
-            client = NotebookLMClient(cookies=cookies)
-            print("[Cloud] Cliente inicializado con Env Vars")
-            return True
+            if not await asyncio.to_thread(shared_state.try_acquire, f"source_index:{notebook_id}", 600):
+                return
+            result = await ingest_notebook_sources(notebook_id)
+            print(f"[SEARCH] Fuentes de {notebook_id[:8]} indexadas ({reason}): "
+                  f"{result['fetched']} nuevas, {result['passages']} fragmentos")
         except Exception as e:
-            print(f"[ERROR] Error cookies env: {e}")
+            print(f"[SEARCH] Error indexando {notebook_id[:8]} ({reason}): {type(e).__name__}: {e}")
 
-    # 2. Carga desde Disco (Manual para evitar cache de la librería)
-    auth_file = Path.home() / ".notebooklm-mcp" / "auth.json"
-    print(f"[INFO] Cargando tokens frescos desde {auth_file}...")
-    
-    if not auth_file.exists():
-        print("[ERROR] No se encontro auth.json. Usa 'notebooklm-mcp-auth'.")
-        return False
-    
+    task = asyncio.create_task(run())
+    background_tasks.add(task)
+    task.add_done_callback(background_tasks.discard)
+
+
+def user_question(question: str) -> str:
+    """La pregunta sin las instrucciones del sistema que la preceden"""
+    if semantic_index is not None:
+        return semantic_index.split(question)[1]
+    return question.removeprefix(SYSTEM_INSTRUCTIONS)
+
+
+def degraded_answer(passages: list[dict]) -> str:
+    parts = ["NotebookLM no está disponible en este momento. Estos fragmentos de las fuentes "
+             "del cuaderno están relacionados con tu pregunta:"]
+    for passage in passages:
+        quoted = "\n".join(f"> {line}" for line in passage["passage"].splitlines())
+        parts.append(f"**{passage['title']}**\n{quoted}")
+    return "\n\n".join(parts)
+
+
+async def degraded_response(request: QueryRequest, trace: RequestTrace, reason: str) -> Optional[QueryResponse]:
+    """Respuesta con fragmentos de las fuentes, o None si no hay índice o nada relevante"""
+    if source_library is None or not SOURCE_INDEX_FALLBACK:
+        return None
     try:
-        with open(auth_file, "r") as f:
-            data = json.load(f)
-        
-        # Re-inicializar cliente con datos frescos
-        client = NotebookLMClient(
-            cookies=data.get("cookies", {}),
-            csrf_token=data.get("csrf_token"),
-            session_id=data.get("session_id")
-        )
-        print("[OK] Cliente NotebookLM sincronizado con disco (Manual)")
-        return True
+        with trace.phase("source_search"):
+            passages = await asyncio.to_thread(
+                source_library.search, request.notebook_id, user_question(request.question),
+                SOURCE_INDEX_FALLBACK_PASSAGES
+            )
     except Exception as e:
-        print(f"[ERROR] Error al instanciar cliente: {e}")
-        return False
+        print(f"[SEARCH] Error buscando en las fuentes: {e}")
+        return None
+    if not passages:
+        return None
+    print(f"[SEARCH] NotebookLM no disponible ({reason[:60]}); respondiendo con {len(passages)} fragmentos")
+    answer = degraded_answer(passages)
+    trace.set(outcome="degraded", degraded_reason=request_log.truncate(reason), answer_chars=len(answer))
+    return QueryResponse(success=True, answer=answer, degraded=True, passages=passages)
+
+
+async def answer_with_fallback(request: QueryRequest, trace: RequestTrace) -> QueryResponse:
+    """answer_query, recurriendo a las fuentes indexadas si NotebookLM falla"""
+    try:
+        response = await answer_query(request, trace)
+    except HTTPException as e:
+        degraded = await degraded_response(request, trace, str(e.detail))
+        if degraded is None:
+            raise
+        return degraded
+    except UpstreamBusy as e:
+        degraded = await degraded_response(request, trace, str(e))
+        if degraded is None:
+            raise
+        return degraded
+    if not response.success:
+        degraded = await degraded_response(request, trace, response.error or "error")
+        if degraded is not None:
+            return degraded
+    return response
+
+
+# ============================================================================
+# Ciclo de vida
+# ============================================================================
+
+async def shared_state_janitor() -> None:
+    """
+    Borra periódicamente claves, contadores y leases caducados, y libera en
+    los clientes el historial de las sesiones que han caducado
+    """
+    while True:
+        await asyncio.sleep(SHARED_STATE_CLEANUP_INTERVAL)
+        try:
+            for conversation_id in await session_store.sweep():
+                release_conversation(conversation_id)
+            removed = await asyncio.to_thread(shared_state.cleanup)
+            if removed:
+                print(f"[STATE] {removed} entradas caducadas eliminadas")
+        except Exception as e:
+            print(f"[STATE] Error limpiando el estado compartido: {e}")
 
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     """Manejo del ciclo de vida de la aplicación"""
     # Startup
-    print("[START] Iniciando servidor FastAPI para NotebookLM...")
+    print(f"[START] Iniciando servidor FastAPI para NotebookLM (pid {os.getpid()})...")
+    request_log.start()
     init_client()
+    client_pool.start()
+    await load_semantic_index()
+    if source_library is not None and SOURCE_INDEX_AUTO and source_library.index(NOTEBOOK_ID) is None:
+        ingest_in_background(NOTEBOOK_ID, "startup")
+    janitor = asyncio.create_task(shared_state_janitor())
+    if cache_warmer is not None:
+        cache_warmer.start()
     yield
     # Shutdown
     print("[STOP] Cerrando servidor...")
+    janitor.cancel()
+    await job_store.stop()
+    if cache_warmer is not None:
+        await cache_warmer.stop()
+    await client_pool.stop()
+    upstream_executor.shutdown()
+    upstream_recording.close()
+    await asyncio.to_thread(request_log.stop)
 
 
 # ============================================================================
@@ -217,6 +1548,36 @@ app.add_middleware(
 )
 
 
+def busy_outcome(exc: UpstreamBusy) -> str:
+    """Resultado de la traza de una llamada no atendida"""
+    return "circuit_open" if isinstance(exc, CircuitOpen) else "busy"
+
+
+@app.exception_handler(RateLimited)
+async def rate_limited_handler(request, exc: RateLimited):
+    """Cliente sin cupo: 429 con Retry-After"""
+    retry_after = int(exc.retry_after)
+    return JSONResponse(
+        status_code=429,
+        content={"detail": str(exc), "retry_after": retry_after},
+        headers={"Retry-After": str(retry_after)}
+    )
+
+
+@app.exception_handler(UpstreamBusy)
+async def upstream_busy_handler(request, exc: UpstreamBusy):
+    """
+    Sin capacidad hacia NotebookLM (429) o circuito abierto (503): respuesta
+    inmediata con Retry-After
+    """
+    retry_after = int(exc.retry_after)
+    return JSONResponse(
+        status_code=exc.status_code,
+        content={"detail": str(exc), "retry_after": retry_after},
+        headers={"Retry-After": str(retry_after)}
+    )
+
+
 # ============================================================================
 # Endpoints
 # ============================================================================
@@ -227,124 +1588,263 @@ async def root():
     return HealthResponse(
         status="ok",
         message="NotebookLM Bridge API activa",
-        authenticated=client is not None
+        authenticated=client_pool.authenticated
     )
 
 
 @app.get("/health", response_model=HealthResponse)
 async def health_check():
-    """Health check del servidor"""
+    """Health check del servidor ("degraded" mientras el circuito no está cerrado)"""
+    circuit = upstream_breaker.stats()
+    healthy = circuit["state"] == "closed"
     return HealthResponse(
-        status="ok",
-        message="Servidor funcionando correctamente",
-        authenticated=client is not None
+        status="ok" if healthy else "degraded",
+        message="Servidor funcionando correctamente" if healthy else
+        "NotebookLM no responde correctamente; se sirven respuestas cacheadas o de las fuentes",
+        circuit_breaker=circuit,
+        authenticated=client_pool.authenticated,
+        credential_probe=client_pool.primary.monitor.stats(),
+        accounts={
+            account.name: {
+                "healthy": account.healthy,
+                "in_flight": account.in_flight,
+                "last_probe": account.monitor.last_result,
+            }
+            for account in client_pool.accounts
+        }
     )
 
 
-@app.post("/query", response_model=QueryResponse)
-async def query_notebook(request: QueryRequest):
+@app.post("/query", response_model=QueryResponse, dependencies=[Depends(limit_client)])
+async def query_notebook(request: QueryRequest, x_priority: Optional[str] = Header(default=None)):
     """
     Realiza una consulta con re-autenticacion automatica si es necesario.
-    Flujo de reintentos:
-      1. Intento normal
-      2. Si falla auth -> recargar tokens del disco
-      3. Si sigue fallando -> ejecutar auto_reauth() y reintentar
+    Las consultas de primer turno se sirven desde la caché de respuestas
+    cuando es posible (ver run_query_with_retries para el flujo de reintentos).
     """
-    global client
-
-    # FORZAR re-carga de tokens en cada consulta para asegurar que
-    # si el usuario hizo re-login, lo pillemos al vuelo.
-    init_client()
+    request.priority = resolve_priority(request.priority, x_priority)
+    trace = start_query_trace("query", request)
+    try:
+        response = await answer_with_fallback(request, trace)
+        with trace.phase("response_build"):
+            return response.model_copy(update={"request_id": trace.request_id})
+    except HTTPException as e:
+        trace.set(status=e.status_code, error=request_log.truncate(e.detail))
+        raise
+    except UpstreamBusy as e:
+        trace.set(outcome=busy_outcome(e), status=e.status_code, error=str(e))
+        raise
+    finally:
+        finish_trace(trace)
+
+
+@app.post("/query/stream", dependencies=[Depends(limit_client)])
+async def query_notebook_stream(request: QueryRequest, x_priority: Optional[str] = Header(default=None)):
+    """
+    Variante de /query con server-sent-events. Eventos:
+      chunk   {"delta": ...}   texto nuevo de la respuesta
+      replace {"text": ...}    la respuesta acumulada cambió por completo
+      done    QueryResponse    respuesta final
+      error   {"status", "error"}
+    Cada SSE_HEARTBEAT_INTERVAL segundos sin datos se envía un comentario keepalive.
+    """
+    request.priority = resolve_priority(request.priority, x_priority)
+    if not await client_pool.ensure_clients():
+        raise HTTPException(
+            status_code=503,
+            detail="Cliente NotebookLM no inicializado"
+        )
 
-    print(f"[QUERY] Consulta recibida: {request.question[:50]}...")
+    print(f"[STREAM] Consulta recibida: {request.question[:50]}...")
+    return StreamingResponse(
+        query_event_stream(request),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
 
-    async def execute_query():
-        """Ejecuta la consulta contra NotebookLM"""
-        full_query = request.question
 
-        with open("debug_log.txt", "a", encoding="utf-8") as f:
-            f.write(f"\n--- NUEVA CONSULTA ---\nPregunta: {full_query[:100]}...\n")
+@app.post("/query/batch")
+async def query_batch(
+    batch: BatchQueryRequest,
+    x_priority: Optional[str] = Header(default=None),
+    client: Optional[str] = Depends(identify_client)
+):
+    """
+    Ejecuta muchas preguntas sobre un cuaderno con paralelismo acotado.
+    Cada pregunta sigue el flujo de /query (caché, coalescencia y reintentos).
+    Los resultados mantienen el orden de `questions`; con stream=true se
+    envían como NDJSON (una línea "result" por pregunta y una "summary").
+    Por defecto las preguntas van con prioridad "bulk": el chat pasa delante.
+    """
+    batch.priority = resolve_priority(batch.priority, x_priority, "bulk")
+    if not batch.questions:
+        raise HTTPException(status_code=400, detail="La lista de preguntas esta vacia")
+    if len(batch.questions) > BATCH_MAX_QUESTIONS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Demasiadas preguntas ({len(batch.questions)}); maximo {BATCH_MAX_QUESTIONS}"
+        )
+    # Un lote cuenta como una petición por pregunta (como mucho, el bucket lleno)
+    charge_client(client, len(batch.questions))
+    if not await client_pool.ensure_clients():
+        raise HTTPException(
+            status_code=503,
+            detail="Cliente NotebookLM no inicializado"
+        )
 
-        result = await asyncio.to_thread(
-            client.query,
-            notebook_id=request.notebook_id,
-            query_text=full_query,
-            conversation_id=request.conversation_id,
-            timeout=request.timeout
+    batch_id = uuid.uuid4().hex[:16]
+    print(f"[BATCH] Lote {batch_id}: {len(batch.questions)} preguntas")
+    if batch.stream:
+        return StreamingResponse(
+            batch_ndjson_stream(batch, batch_id),
+            media_type="application/x-ndjson",
+            headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
         )
 
-        with open("debug_log.txt", "a", encoding="utf-8") as f:
-            f.write(f"RESULTADO BRUTO: {result}\n")
-            f.write(f"TIPO: {type(result)}\n")
+    started = time.perf_counter()
+    tasks = start_batch(batch, batch_id)
+    try:
+        results = await asyncio.gather(*tasks)
+    finally:
+        for task in tasks:
+            if not task.done():
+                task.cancel()
+    summary = summarize_batch(batch, batch_id, results, started)
+    print(f"[BATCH] Lote {batch_id} terminado: {summary['succeeded']}/{summary['total']} correctas")
+    return BatchQueryResponse(results=results, **summary)
+
+
+@app.post("/sessions", response_model=SessionInfo)
+async def create_session(body: SessionCreateRequest):
+    """
+    Registra una sesión con sus instrucciones del sistema. Después basta con
+    enviar cada pregunta a /sessions/{id}/query (o /query/stream).
+    """
+    if len(body.system_prompt) > SESSION_MAX_PROMPT_CHARS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Instrucciones demasiado largas ({len(body.system_prompt)}); maximo {SESSION_MAX_PROMPT_CHARS}"
+        )
+    session = await session_store.create(body.notebook_id, body.system_prompt)
+    print(f"[SESSION] Sesion {session['id'][:8]} creada")
+    return session_info(session)
+
+
+@app.get("/sessions/{session_id}", response_model=SessionInfo)
+async def get_session(session_id: str):
+    """Estado de la sesión con su historial compacto"""
+    return session_info(await load_session(session_id))
+
+
+@app.delete("/sessions/{session_id}")
+async def delete_session(session_id: str):
+    """Cierra la sesión y libera su historial en el servidor"""
+    session = await session_store.delete(session_id)
+    if session is None:
+        raise HTTPException(status_code=404, detail="Sesion no encontrada o caducada")
+    release_conversation(session.get("conversation_id"))
+    if session.get("conversation_id"):
+        await asyncio.to_thread(shared_state.delete, f"conversation:{session['conversation_id']}")
+    return {"deleted": True, "session_id": session_id}
+
+
+@app.post("/sessions/{session_id}/query", response_model=QueryResponse, dependencies=[Depends(limit_client)])
+async def query_session(session_id: str, body: SessionQueryRequest, x_priority: Optional[str] = Header(default=None)):
+    """/query dentro de una sesión: solo se envía el turno nuevo del usuario"""
+    body.priority = resolve_priority(body.priority, x_priority)
+    session = await load_session(session_id)
+    request = session_request(session, body)
+    trace = start_query_trace("session_query", request)
+    trace.set(session_id=session_id, prompt_hash=session.get("prompt_hash"))
+    try:
+        response = await answer_with_fallback(request, trace)
+        if response.success and not response.degraded:
+            await session_store.record_turn(session, body.question, response.answer or "", response.conversation_id)
+        with trace.phase("response_build"):
+            return response.model_copy(update={"request_id": trace.request_id})
+    except HTTPException as e:
+        trace.set(status=e.status_code, error=request_log.truncate(e.detail))
+        raise
+    except UpstreamBusy as e:
+        trace.set(outcome=busy_outcome(e), status=e.status_code, error=str(e))
+        raise
+    finally:
+        finish_trace(trace)
+
+
+@app.post("/sessions/{session_id}/query/stream", dependencies=[Depends(limit_client)])
+async def query_session_stream(session_id: str, body: SessionQueryRequest, x_priority: Optional[str] = Header(default=None)):
+    """/query/stream dentro de una sesión (mismos eventos SSE)"""
+    body.priority = resolve_priority(body.priority, x_priority)
+    session = await load_session(session_id)
+    if not await client_pool.ensure_clients():
+        raise HTTPException(
+            status_code=503,
+            detail="Cliente NotebookLM no inicializado"
+        )
 
-        if isinstance(result, dict):
-            answer = result.get("answer") or result.get("text") or result.get("content") or ""
-            conv_id = result.get("conversation_id")
-        else:
-            answer = str(result)
-            conv_id = None
+    async def record(response: QueryResponse) -> None:
+        if response.success and not response.degraded:
+            await session_store.record_turn(session, body.question, response.answer or "", response.conversation_id)
+
+    return StreamingResponse(
+        query_event_stream(
+            session_request(session, body),
+            on_done=record,
+            trace_fields={"session_id": session_id, "prompt_hash": session.get("prompt_hash")}
+        ),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
 
-        with open("debug_log.txt", "a", encoding="utf-8") as f:
-            f.write(f"RESPUESTA EXTRAIDA: {answer[:100] if answer else 'VACIA'}...\n")
-            f.write("----------------------\n")
 
-        return QueryResponse(
-            success=True,
-            answer=answer,
-            conversation_id=conv_id
+@app.post("/jobs", response_model=JobInfo, status_code=202, dependencies=[Depends(limit_client)])
+async def submit_job(body: JobRequest, response: Response, x_priority: Optional[str] = Header(default=None)):
+    """
+    Lanza la consulta en segundo plano y devuelve su id al momento. El
+    resultado se recoge con GET /jobs/{id}: así una consulta larga no choca
+    con el límite de ~100 s por petición del túnel.
+    """
+    priority = resolve_priority(body.priority, x_priority)
+    session = None
+    if body.session_id:
+        session = await load_session(body.session_id)
+        request = session_request(session, SessionQueryRequest(
+            question=body.question, timeout=body.timeout, priority=priority
+        ))
+    elif body.notebook_id:
+        request = QueryRequest(
+            question=body.question,
+            notebook_id=body.notebook_id,
+            conversation_id=body.conversation_id,
+            timeout=body.timeout,
+            priority=priority
         )
+    else:
+        raise HTTPException(status_code=400, detail="Falta notebook_id o session_id")
 
-    try:
-        # Intento 1: Consulta normal
-        print("[RETRY] Intento 1/3: Consulta normal...")
-        try:
-            return await execute_query()
-        except AuthenticationError as e:
-            print(f"[WARN] Error de autenticacion en intento 1: {e}")
-
-        # Intento 2: Recargar tokens del disco
-        print("[RETRY] Intento 2/3: Recargando tokens del disco...")
-        init_client(force_refresh=True)
-        try:
-            return await execute_query()
-        except AuthenticationError as e:
-            print(f"[WARN] Error de autenticacion en intento 2: {e}")
-
-        # Intento 3: Re-autenticacion automatica
-        print("[RETRY] Intento 3/3: Ejecutando re-autenticacion automatica...")
-        reauth_success = await asyncio.to_thread(auto_reauth)
+    job = await job_store.submit(
+        "session_query" if session is not None else "query",
+        lambda job_id: run_query_job(job_id, request, session, body.question),
+        Deadline.for_timeout(request.timeout).budget,
+        session_id=body.session_id
+    )
+    print(f"[JOBS] Trabajo {job['id'][:8]} lanzado: {body.question[:50]}...")
+    response.headers["Location"] = f"/jobs/{job['id']}"
+    return job_info(job)
 
-        if reauth_success:
-            # Recargar cliente con nuevos tokens
-            init_client(force_refresh=True)
-            try:
-                return await execute_query()
-            except AuthenticationError as e:
-                print(f"[ERROR] Error incluso despues de re-auth: {e}")
-                raise e
-        else:
-            print("[ERROR] Re-autenticacion automatica fallida")
-            raise AuthenticationError("Re-autenticacion automatica fallida. Verifica que Chrome este logueado en Google.")
 
-    except AuthenticationError as e:
-        print(f"[ERROR] Error final de autenticacion: {e}")
-        raise HTTPException(
-            status_code=401,
-            detail=f"Error de autenticacion: {str(e)}. Si el problema persiste, ejecuta 'notebooklm-mcp-auth --file' manualmente."
-        )
-    except httpx.HTTPStatusError as e:
-        error_detail = f"Error HTTP {e.response.status_code}: {e.response.text[:200]}"
-        print(f"[ERROR] HTTPStatusError: {error_detail}")
-        return QueryResponse(
-            success=False,
-            error=f"Error del servidor NotebookLM ({e.response.status_code})."
-        )
-    except Exception as e:
-        print(f"[ERROR] Error inesperado: {type(e).__name__}: {e}")
-        return QueryResponse(
-            success=False,
-            error=f"Error inesperado: {type(e).__name__}: {str(e)}"
-        )
+@app.get("/jobs/{job_id}", response_model=JobInfo)
+async def get_job(job_id: str, wait: float = 0):
+    """
+    Estado del trabajo y, al terminar, su resultado (QueryResponse) o su
+    error. Con wait=N espera hasta N segundos (máximo JOBS_MAX_WAIT) a que
+    termine antes de responder.
+    """
+    job = await job_store.wait(job_id, wait)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Trabajo no encontrado o caducado")
+    return job_info(job)
 
 
 @app.get("/debug-tokens")
@@ -365,58 +1865,192 @@ async def debug_tokens():
     }
 
 
-@app.get("/notebooks", response_model=list[NotebookInfo])
-async def list_notebooks():
-    """Lista todos los cuadernos disponibles"""
-    if not client:
+def set_metadata_headers(response: Response, status: str, age: float) -> None:
+    """Indica si la respuesta salió de la caché de metadatos y su antigüedad"""
+    response.headers["X-Cache-Status"] = status
+    response.headers["Age"] = str(int(age))
+
+
+def metadata_client():
+    """Cliente para leer metadatos: cualquier cuenta sirve"""
+    account = client_pool.pick()
+    if account is None:
+        raise RuntimeError("Cliente NotebookLM no inicializado")
+    return account.store.client
+
+
+async def fetch_notebooks() -> list[dict]:
+    client = metadata_client()
+    notebooks = await run_upstream(client.list_notebooks)
+    return [
+        NotebookInfo(
+            id=nb.id,
+            title=nb.title,
+            source_count=nb.source_count,
+            url=nb.url
+        ).model_dump()
+        for nb in notebooks
+    ]
+
+
+async def fetch_notebook(notebook_id: str, priority: str = DEFAULT_PRIORITY) -> dict:
+    client = metadata_client()
+    notebook = await run_upstream(client.get_notebook, notebook_id, notebook_id=notebook_id, priority=priority)
+    return {
+        "id": notebook.id,
+        "title": notebook.title,
+        "source_count": notebook.source_count,
+        "sources": notebook.sources,
+        "url": notebook.url
+    }
+
+
+@app.get("/notebooks", response_model=list[NotebookInfo], dependencies=[Depends(limit_client)])
+async def list_notebooks(response: Response):
+    """
+    Lista todos los cuadernos disponibles.
+    Se sirve desde la caché de metadatos (cabeceras X-Cache-Status y Age).
+    """
+    if not await client_pool.ensure_clients():
         raise HTTPException(
             status_code=503,
             detail="Cliente NotebookLM no inicializado"
         )
-    
+
     try:
-        notebooks = await asyncio.to_thread(client.list_notebooks)
-        return [
-            NotebookInfo(
-                id=nb.id,
-                title=nb.title,
-                source_count=nb.source_count,
-                url=nb.url
-            )
-            for nb in notebooks
-        ]
+        notebooks, status, age = await metadata_cache.get("notebooks", fetch_notebooks)
+    except UpstreamBusy:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
+    set_metadata_headers(response, status, age)
+    return notebooks
 
 
-@app.get("/notebook/{notebook_id}")
-async def get_notebook(notebook_id: str):
-    """Obtiene información detallada de un cuaderno"""
-    if not client:
+@app.get("/notebook/{notebook_id}", dependencies=[Depends(limit_client)])
+async def get_notebook(notebook_id: str, response: Response):
+    """
+    Obtiene información detallada de un cuaderno.
+    Se sirve desde la caché de metadatos (cabeceras X-Cache-Status y Age).
+    """
+    if not await client_pool.ensure_clients():
         raise HTTPException(
             status_code=503,
             detail="Cliente NotebookLM no inicializado"
         )
-    
+
     try:
-        notebook = await asyncio.to_thread(client.get_notebook, notebook_id)
-        return {
-            "id": notebook.id,
-            "title": notebook.title,
-            "source_count": notebook.source_count,
-            "sources": notebook.sources,
-            "url": notebook.url
-        }
+        notebook, status, age = await metadata_cache.get(
+            f"notebook:{notebook_id}", lambda: fetch_notebook(notebook_id)
+        )
+    except UpstreamBusy:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
+    set_metadata_headers(response, status, age)
+    return notebook
+
+
+@app.get("/notebook/{notebook_id}/search", dependencies=[Depends(limit_client)])
+async def search_notebook_sources(notebook_id: str, q: str, limit: int = 10):
+    """
+    Busca en el índice local de las fuentes del cuaderno (BM25) y devuelve
+    los fragmentos más relevantes. No llama a NotebookLM.
+    """
+    if source_library is None:
+        raise HTTPException(status_code=503, detail="Indice de fuentes desactivado")
+    started = time.perf_counter()
+    index = await asyncio.to_thread(source_library.index, notebook_id)
+    if index is None:
+        raise HTTPException(status_code=404, detail="Las fuentes de este cuaderno no estan indexadas")
+    results = await asyncio.to_thread(source_library.search, notebook_id, q, max(1, min(limit, 50)))
+    return {
+        "notebook_id": notebook_id,
+        "query": q,
+        "indexed_at": index.meta["built_at"],
+        "took_ms": round((time.perf_counter() - started) * 1000, 2),
+        "results": results
+    }
+
+
+@app.post("/notebook/{notebook_id}/sources/index", dependencies=[Depends(require_admin)])
+async def index_notebook_sources(notebook_id: str, refresh: bool = False):
+    """
+    Descarga de NotebookLM el texto de las fuentes del cuaderno y reconstruye
+    el índice local (refresh=true vuelve a descargar también las conocidas)
+    """
+    if source_library is None:
+        raise HTTPException(status_code=503, detail="Indice de fuentes desactivado")
+    if not await client_pool.ensure_clients():
+        raise HTTPException(
+            status_code=503,
+            detail="Cliente NotebookLM no inicializado"
+        )
+    try:
+        return await ingest_notebook_sources(notebook_id, refresh)
+    except UpstreamBusy:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=502, detail=f"Error indexando las fuentes: {type(e).__name__}: {e}")
+
+
+async def read_body_limited(request: Request, limit: int) -> bytes:
+    """
+    Lee el cuerpo sin pasar de `limit` bytes (413 si los supera): rechaza
+    por Content-Length antes de leer y, si falta o miente, corta la lectura
+    en cuanto se excede en vez de cargar el cuerpo entero en memoria.
+    """
+    too_large = HTTPException(status_code=413, detail="Documento demasiado grande")
+    try:
+        declared = int(request.headers.get("content-length", "0"))
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Content-Length invalido")
+    if declared > limit:
+        raise too_large
+
+    chunks = []
+    size = 0
+    async for chunk in request.stream():
+        size += len(chunk)
+        if size > limit:
+            raise too_large
+        chunks.append(chunk)
+    return b"".join(chunks)
+
+
+@app.post("/notebook/{notebook_id}/sources/upload", dependencies=[Depends(require_admin)])
+async def upload_notebook_source(notebook_id: str, title: str, request: Request):
+    """
+    Añade al índice local un documento (PDF o texto en el cuerpo de la
+    petición). Un documento con el mismo título sustituye al anterior.
+    """
+    if source_library is None:
+        raise HTTPException(status_code=503, detail="Indice de fuentes desactivado")
+    data = await read_body_limited(request, SOURCE_INDEX_MAX_UPLOAD_BYTES)
+    try:
+        text = await asyncio.to_thread(extract_text, data, request.headers.get("content-type", ""))
+    except UnsupportedDocument as e:
+        raise HTTPException(status_code=415, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=f"No se pudo leer el documento: {type(e).__name__}: {e}")
+    if not text.strip():
+        raise HTTPException(status_code=400, detail="El documento no contiene texto")
+
+    await asyncio.to_thread(source_library.save_document, notebook_id, f"upload:{title}", title, text, "upload")
+    built = await asyncio.to_thread(source_library.build, notebook_id)
+    return {"notebook_id": notebook_id, "title": title, "chars": len(text), **built}
 
 
 @app.post("/refresh-auth")
 async def refresh_auth():
-    """Intenta refrescar la autenticación"""
-    success = init_client()
+    """Fuerza la reconstrucción de los clientes con las credenciales actuales"""
+    success = await asyncio.to_thread(init_client, True)
     if success:
-        return {"status": "success", "message": "Autenticación refrescada"}
+        return {
+            "status": "success",
+            "message": "Autenticación refrescada",
+            "accounts": {account.name: account.store.stats() for account in client_pool.accounts}
+        }
     else:
         raise HTTPException(
             status_code=401,
@@ -424,6 +2058,61 @@ async def refresh_auth():
         )
 
 
+@app.get("/stats")
+async def stats():
+    """Estadísticas internas del puente"""
+    return {
+        "accounts": client_pool.stats(),
+        "answer_cache": await answer_cache.stats() if answer_cache else None,
+        "semantic_cache": semantic_index.stats() if semantic_index else None,
+        "source_index": source_library.stats() if source_library else None,
+        "cache_warmer": cache_warmer.stats() if cache_warmer else None,
+        "query_coalescing": query_flights.stats(),
+        "upstream": upstream_executor.stats(),
+        "circuit_breaker": upstream_breaker.stats(),
+        "rate_limit": rate_limiter.stats(),
+        "metadata_cache": metadata_cache.stats(),
+        "request_log": request_log.stats(),
+        "sessions": session_store.stats(),
+        "jobs": job_store.stats(),
+        "upstream_recording": upstream_recording.stats(),
+        "shared_state": await asyncio.to_thread(shared_state.stats)
+    }
+
+
+@app.get("/metrics")
+async def prometheus_metrics():
+    """Métricas en formato de texto de Prometheus"""
+    return Response(
+        content=metrics.render(),
+        media_type="text/plain; version=0.0.4; charset=utf-8"
+    )
+
+
+@app.get("/cache", dependencies=[Depends(require_admin)])
+async def inspect_cache(notebook_id: Optional[str] = None, limit: int = 50):
+    """Estadísticas y entradas más recientes de la caché de respuestas"""
+    if answer_cache is None:
+        return {"enabled": False}
+    return {
+        "enabled": True,
+        "stats": await answer_cache.stats(),
+        "entries": await answer_cache.entries(notebook_id, min(limit, 500))
+    }
+
+
+@app.delete("/cache", dependencies=[Depends(require_admin)])
+async def purge_cache(notebook_id: Optional[str] = None):
+    """Vacía la caché de respuestas (completa o de un cuaderno)"""
+    if answer_cache is None:
+        return {"enabled": False, "removed": {"memory": 0, "disk": 0}}
+    removed = await answer_cache.purge(notebook_id)
+    if semantic_index is not None:
+        await asyncio.to_thread(semantic_index.purge, notebook_id)
+    print(f"[CACHE] Purgada (notebook_id={notebook_id}): {removed}")
+    return {"enabled": True, "removed": removed}
+
+
 # ============================================================================
 # Punto de entrada
 # ============================================================================
@@ -442,8 +2131,19 @@ if __name__ == "__main__":
     print("  GET  /           - Health check")
     print("  GET  /health     - Health check")
     print("  POST /query      - Consultar cuaderno")
+    print("  POST /query/stream - Consultar cuaderno (SSE)")
+    print("  POST /query/batch - Consultar muchas preguntas")
+    print("  POST /sessions   - Crear sesion con instrucciones del sistema")
+    print("  POST /sessions/{id}/query - Consultar dentro de una sesion")
     print("  GET  /notebooks  - Listar cuadernos")
     print("  GET  /notebook/{id} - Obtener cuaderno")
+    print("  POST /refresh-auth - Recargar credenciales")
+    print("  GET  /stats      - Estadisticas internas")
+    print("  GET  /metrics    - Metricas Prometheus")
+    print("  GET  /cache      - Inspeccionar cache de respuestas")
+    print("  DELETE /cache    - Vaciar cache de respuestas")
+    if not ADMIN_TOKEN:
+        print("  (endpoints de administracion cerrados: define ADMIN_TOKEN)")
     print()
     print("=" * 60)
 
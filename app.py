@@ -2,10 +2,20 @@
 Chat Streamlit Premium para NotebookLM
 Adaptado para el Presupuesto 2026 - Diputación de Sevilla
 """
+import os
+import time
+import threading
 import streamlit as st
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import json
 import base64
+from typing import Optional
+
+# Cuaderno, instrucciones del sistema y preguntas sugeridas (compartidos con
+# el precalentamiento de la caché del servidor)
+from prompts import NOTEBOOK_ID, SYSTEM_INSTRUCTIONS, SUGGESTED_QUESTIONS
 
 # ============================================================================
 # Configuración
@@ -19,21 +29,30 @@ try:
 except Exception:
     API_BASE_URL = "http://127.0.0.1:8000"
 
-# ID del cuaderno (Actualizado para el nuevo contexto si es necesario,
-# por ahora mantenemos el ID pero el usuario indicó que el contenido cambió)
-NOTEBOOK_ID = "0523ea1e-7973-400a-a749-55a805205030"
-
-# Instrucciones del sistema para NotebookLM
-SYSTEM_INSTRUCTIONS = """
-INSTRUCCIONES OBLIGATORIAS:
-- Responde SIEMPRE en castellano (espanol de Espana).
-- Basate UNICAMENTE en la informacion contenida en las fuentes del notebook.
-- NO inventes, supongas ni extrapoles informacion que no este en las fuentes.
-- Si no dispones de la informacion solicitada, responde claramente: "No dispongo de esa informacion en las fuentes disponibles."
-- Cita las fuentes cuando sea posible.
-
-CONSULTA DEL USUARIO:
-"""
+def setting(name: str, default: str) -> str:
+    """Valor de st.secrets, de una variable de entorno o por defecto"""
+    try:
+        if name in st.secrets:
+            return str(st.secrets[name])
+    except Exception:
+        pass
+    return os.environ.get(name, default)
+
+# Conexiones reutilizadas hacia la API y reintentos ante 429/503
+HTTP_POOL_SIZE = int(setting("HTTP_POOL_SIZE", "10"))
+HTTP_RETRIES = int(setting("HTTP_RETRIES", "2"))
+HTTP_BACKOFF = float(setting("HTTP_BACKOFF", "0.5"))  # 0.5, 1, 2... segundos
+# Segundos entre comprobaciones de /health en segundo plano
+HEALTH_CHECK_INTERVAL = float(setting("HEALTH_CHECK_INTERVAL", "30"))
+# Clave del frontend ante el límite por cliente de la API (RATE_LIMIT_API_KEYS):
+# todos los usuarios del chat llegan desde la misma IP
+API_KEY = setting("API_KEY", "")
+# Segundos que espera cada sondeo de GET /jobs/{id} (por debajo de los ~100 s del túnel)
+JOB_POLL_WAIT = float(setting("JOB_POLL_WAIT", "25"))
+# Respuestas en streaming (SSE con keepalives). Con "0" cada pregunta va como
+# trabajo asíncrono (POST /jobs + sondeo): para proxies que acumulan el SSE
+# y cortan igualmente a los ~100 s
+STREAM_ANSWERS = setting("STREAM_ANSWERS", "1") != "0"
 
 # ============================================================================
 # Configuración de la página
@@ -170,34 +189,196 @@ local_css()
 # Funciones de API
 # ============================================================================
 
-@st.cache_data(ttl=60)
+@st.cache_resource
+def get_http_session() -> requests.Session:
+    """
+    Sesión HTTP compartida por todas las ejecuciones del script: mantiene las
+    conexiones abiertas (keep-alive) en vez de abrir una por petición.
+    Solo se reintentan los 429/503 y los fallos de conexión, nunca una
+    lectura cortada (la consulta podría haberse ejecutado ya).
+    """
+    session = requests.Session()
+    retry = Retry(
+        total=HTTP_RETRIES,
+        read=0,
+        status_forcelist=(429, 503),
+        allowed_methods=frozenset({"GET", "POST", "DELETE"}),
+        backoff_factor=HTTP_BACKOFF,
+        respect_retry_after_header=True,
+        raise_on_status=False
+    )
+    adapter = HTTPAdapter(pool_connections=2, pool_maxsize=HTTP_POOL_SIZE, max_retries=retry)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    if API_KEY:
+        session.headers["X-API-Key"] = API_KEY
+    return session
+
+class HealthMonitor:
+    """Consulta /health en un hilo propio; las ejecuciones del script solo leen el último estado"""
+
+    def __init__(self, session: requests.Session, interval: float):
+        self.session = session
+        self.interval = interval
+        self.status = {"status": "checking", "authenticated": False}
+        threading.Thread(target=self._run, name="api-health", daemon=True).start()
+
+    def _run(self):
+        while True:
+            try:
+                response = self.session.get(f"{API_BASE_URL}/health", timeout=5)
+                if response.status_code == 200:
+                    self.status = response.json()
+                else:
+                    self.status = {"status": "error", "authenticated": False}
+            except Exception:
+                self.status = {"status": "disconnected", "authenticated": False}
+            time.sleep(self.interval)
+
+@st.cache_resource
+def get_health_monitor() -> HealthMonitor:
+    return HealthMonitor(get_http_session(), HEALTH_CHECK_INTERVAL)
+
 def check_api_health() -> dict:
+    return get_health_monitor().status
+
+def create_session(notebook_id: str) -> Optional[str]:
+    """
+    Registra las instrucciones del sistema una sola vez en el servidor.
+    Devuelve None si el servidor no ofrece sesiones (se usa /query).
+    """
     try:
-        response = requests.get(f"{API_BASE_URL}/health", timeout=5)
+        response = get_http_session().post(
+            f"{API_BASE_URL}/sessions",
+            json={"notebook_id": notebook_id, "system_prompt": SYSTEM_INSTRUCTIONS},
+            timeout=10
+        )
         if response.status_code == 200:
-            return response.json()
-        return {"status": "error", "authenticated": False}
+            return response.json()["session_id"]
     except Exception:
-        return {"status": "disconnected", "authenticated": False}
+        pass
+    return None
+
+def query_request(question: str, notebook_id: str, conversation_id: str, session_id: str, stream: bool) -> tuple[str, dict]:
+    """URL y cuerpo de la consulta: con sesión solo viaja el turno del usuario"""
+    suffix = "/stream" if stream else ""
+    if session_id:
+        return f"{API_BASE_URL}/sessions/{session_id}/query{suffix}", {"question": question, "timeout": 120}
+    # Sin sesión: concatenar instrucciones del sistema con la pregunta del usuario
+    payload = {
+        "question": SYSTEM_INSTRUCTIONS + question,
+        "notebook_id": notebook_id,
+        "conversation_id": conversation_id,
+        "timeout": 120
+    }
+    return f"{API_BASE_URL}/query{suffix}", payload
+
+def query_direct(url: str, payload: dict, session_id: str = None) -> dict:
+    """Consulta en una sola petición (servidores sin /jobs)"""
+    response = get_http_session().post(url, json=payload, timeout=130)
+    if response.status_code == 200:
+        return response.json()
+    if response.status_code == 404 and session_id:
+        return {"success": False, "session_expired": True, "error": "La sesion ha caducado"}
+    return {"success": False, "error": f"Error {response.status_code}"}
+
+def error_detail(response: requests.Response) -> Optional[str]:
+    """`detail` de una respuesta de error de FastAPI; None si el cuerpo no es JSON (p. ej. HTML del túnel)"""
+    try:
+        body = response.json()
+    except ValueError:
+        return None
+    return body.get("detail") if isinstance(body, dict) else None
 
-def query_notebooklm(question: str, notebook_id: str, conversation_id: str = None) -> dict:
+def query_notebooklm(question: str, notebook_id: str, conversation_id: str = None, session_id: str = None) -> dict:
+    """
+    Consulta sin streaming como trabajo asíncrono: POST /jobs devuelve el id
+    al momento y GET /jobs/{id}?wait=... espera el resultado por tramos, así
+    ninguna petición se acerca al límite de ~100 s del túnel.
+    """
     try:
-        # Concatenar instrucciones del sistema con la pregunta del usuario
-        full_question = SYSTEM_INSTRUCTIONS + question
-
-        payload = {
-            "question": full_question,
-            "notebook_id": notebook_id,
-            "conversation_id": conversation_id,
-            "timeout": 120
-        }
-        response = requests.post(f"{API_BASE_URL}/query", json=payload, timeout=130)
-        if response.status_code == 200:
-            return response.json()
-        return {"success": False, "error": f"Error {response.status_code}"}
+        url, payload = query_request(question, notebook_id, conversation_id, session_id, stream=False)
+        job_payload = dict(payload, session_id=session_id) if session_id else payload
+        response = get_http_session().post(f"{API_BASE_URL}/jobs", json=job_payload, timeout=10)
+        # Ruta inexistente (servidor sin /jobs, o 404 no JSON de un proxy): consulta directa
+        if response.status_code == 405 or (response.status_code == 404 and error_detail(response) in ("Not Found", None)):
+            return query_direct(url, payload, session_id)
+        if response.status_code == 404 and session_id:
+            return {"success": False, "session_expired": True, "error": "La sesion ha caducado"}
+        if response.status_code != 202:
+            return {"success": False, "error": f"Error {response.status_code}"}
+
+        job = response.json()
+        give_up_at = time.monotonic() + payload["timeout"] + 60
+        while job["status"] not in ("done", "failed"):
+            if time.monotonic() > give_up_at:
+                return {"success": False, "error": "La consulta no ha terminado a tiempo"}
+            response = get_http_session().get(
+                f"{API_BASE_URL}/jobs/{job['job_id']}",
+                params={"wait": JOB_POLL_WAIT},
+                timeout=JOB_POLL_WAIT + 15
+            )
+            if response.status_code == 404:
+                return {"success": False, "error": "La consulta ha caducado en el servidor"}
+            if response.status_code != 200:
+                return {"success": False, "error": f"Error {response.status_code}"}
+            job = response.json()
+
+        if job["status"] == "done":
+            return job["result"]
+        return {"success": False, "error": job.get("error") or f"Error {job.get('status_code')}"}
     except Exception as e:
         return {"success": False, "error": str(e)}
 
+def stream_notebooklm(question: str, notebook_id: str, conversation_id: str, result: dict, session_id: str = None):
+    """
+    Generador para st.write_stream: va produciendo el texto de la respuesta a
+    medida que llega por /query/stream. Al terminar deja en `result` la
+    respuesta final (mismo formato que /query). Si el servidor no ofrece
+    streaming marca result["fallback"] para usar /jobs; si la sesión ya no
+    existe marca result["session_expired"].
+    """
+    url, payload = query_request(question, notebook_id, conversation_id, session_id, stream=True)
+    try:
+        # Timeout de lectura entre trozos: el servidor envía keepalives cada 15 s
+        with get_http_session().post(url, json=payload, stream=True, timeout=(10, 60)) as response:
+            if response.status_code == 404 and session_id:
+                result.update({"success": False, "session_expired": True, "error": "La sesion ha caducado"})
+                return
+            if response.status_code in (404, 405):
+                result["fallback"] = True
+                return
+            if response.status_code != 200:
+                result.update({"success": False, "error": f"Error {response.status_code}"})
+                return
+
+            event, data_lines = None, []
+            for line in response.iter_lines(decode_unicode=True):
+                if line is None:
+                    continue
+                if line.startswith(":"):
+                    continue  # keepalive
+                if line.startswith("event:"):
+                    event = line[6:].strip()
+                elif line.startswith("data:"):
+                    data_lines.append(line[5:].strip())
+                elif line == "" and event:
+                    data = json.loads("\n".join(data_lines)) if data_lines else {}
+                    if event == "chunk":
+                        yield data.get("delta", "")
+                    elif event == "replace":
+                        result["replaced"] = True
+                    elif event == "done":
+                        result.update(data)
+                    elif event == "error":
+                        result.update({"success": False, "error": data.get("error")})
+                    event, data_lines = None, []
+
+            if "success" not in result:
+                result.update({"success": False, "error": "La conexion se cerro antes de completar la respuesta"})
+    except Exception as e:
+        result.update({"success": False, "error": str(e)})
+
 # ============================================================================
 # Interfaz de Usuario
 # ============================================================================
@@ -219,6 +400,10 @@ with st.sidebar:
     health = check_api_health()
     if health.get("status") == "ok":
         st.markdown('<div style="color: #4ade80; font-size: 0.9rem; font-weight: 600;">● Sistema en Línea</div>', unsafe_allow_html=True)
+    elif health.get("status") == "degraded":
+        st.markdown('<div style="color: #fbbf24; font-size: 0.9rem; font-weight: 600;">● Servicio Limitado (respuestas desde las fuentes)</div>', unsafe_allow_html=True)
+    elif health.get("status") == "checking":
+        st.markdown('<div style="color: #94a3b8; font-size: 0.9rem; font-weight: 600;">◌ Comprobando conexión...</div>', unsafe_allow_html=True)
     else:
         st.markdown('<div style="color: #f87171; font-size: 0.9rem; font-weight: 600;">○ Sistema Fuera de Línea</div>', unsafe_allow_html=True)
 
@@ -234,19 +419,19 @@ with st.sidebar:
     st.markdown("---")
     st.markdown("### 💡 Sugerencias de análisis")
     with st.expander("Ver ejemplos de preguntas"):
-        st.markdown("""
-        - ¿Cuál es el gasto total en políticas sociales?
-        - Resume la inversión prevista para Prodetur.
-        - ¿Cuánto aumenta el presupuesto respecto a 2025?
-        - ¿Cuáles son las mayores partidas de subvenciones?
-        - Desglosa el presupuesto por capítulos.
-        """)
+        st.markdown("\n".join(f"- {question}" for question in SUGGESTED_QUESTIONS))
     
     st.markdown("---")
     
     if st.button("🗑️ Nueva Conversación", use_container_width=True):
+        if st.session_state.get("session_id"):
+            try:
+                get_http_session().delete(f"{API_BASE_URL}/sessions/{st.session_state.session_id}", timeout=5)
+            except Exception:
+                pass
         st.session_state.messages = []
         st.session_state.conversation_id = None
+        st.session_state.session_id = None
         st.rerun()
 
     st.caption("v2.0 | IA Fiscal Diputación Sevilla")
@@ -259,6 +444,8 @@ if "messages" not in st.session_state:
     st.session_state.messages = []
 if "conversation_id" not in st.session_state:
     st.session_state.conversation_id = None
+if "session_id" not in st.session_state:
+    st.session_state.session_id = None
 
 # Mostrar historial
 for message in st.session_state.messages:
@@ -272,29 +459,55 @@ if prompt := st.chat_input("Consulta cualquier detalle sobre las cuentas de 2026
         st.markdown(prompt)
     
     with st.chat_message("assistant"):
+        placeholder = st.empty()
         with st.spinner("Analizando fuentes presupuestarias..."):
-            result = query_notebooklm(
-                question=prompt,
-                notebook_id=NOTEBOOK_ID,
-                conversation_id=st.session_state.conversation_id
-            )
-            
-            if result.get("success"):
-                response = result.get("answer") or ""
-                
-                # Manejar respuestas vacías de forma explícita
-                if not response.strip():
-                    response = "⚠️ **El sistema no ha encontrado información específica en las fuentes para esta consulta.** Por favor, intenta reformular la pregunta o consultar sobre otro área del presupuesto."
-                
-                if result.get("conversation_id"):
-                    st.session_state.conversation_id = result["conversation_id"]
-                
-                st.markdown(response)
-                st.session_state.messages.append({"role": "assistant", "content": response})
-            else:
-                error_msg = f"⚠️ **Error en la consulta:** {result.get('error')}"
-                st.error(error_msg)
-                st.session_state.messages.append({"role": "assistant", "content": error_msg})
+            # Una sesión nueva si caducó la anterior (el servidor olvida su contexto)
+            for _ in range(2):
+                if st.session_state.session_id is None:
+                    st.session_state.session_id = create_session(NOTEBOOK_ID)
+                result = {}
+                if STREAM_ANSWERS:
+                    # La respuesta se pinta a medida que llega
+                    with placeholder.container():
+                        st.write_stream(stream_notebooklm(
+                            question=prompt,
+                            notebook_id=NOTEBOOK_ID,
+                            conversation_id=st.session_state.conversation_id,
+                            result=result,
+                            session_id=st.session_state.session_id
+                        ))
+                else:
+                    result["fallback"] = True
+
+                if result.get("fallback"):
+                    result = query_notebooklm(
+                        question=prompt,
+                        notebook_id=NOTEBOOK_ID,
+                        conversation_id=st.session_state.conversation_id,
+                        session_id=st.session_state.session_id
+                    )
+                if not result.get("session_expired"):
+                    break
+                st.session_state.session_id = None
+
+        if result.get("success"):
+            response = result.get("answer") or ""
+
+            # Manejar respuestas vacías de forma explícita
+            if not response.strip():
+                response = "⚠️ **El sistema no ha encontrado información específica en las fuentes para esta consulta.** Por favor, intenta reformular la pregunta o consultar sobre otro área del presupuesto."
+
+            if result.get("conversation_id"):
+                st.session_state.conversation_id = result["conversation_id"]
+
+            # Texto definitivo (por si el streaming se reemplazó o no hubo streaming)
+            placeholder.markdown(response)
+            st.session_state.messages.append({"role": "assistant", "content": response})
+        else:
+            error_msg = f"⚠️ **Error en la consulta:** {result.get('error')}"
+            placeholder.empty()
+            st.error(error_msg)
+            st.session_state.messages.append({"role": "assistant", "content": error_msg})
 
 # Footer flotante discreto
 st.markdown(
@@ -0,0 +1,407 @@
+"""
+Prueba de carga del puente sin salir a Google
+Sustituye NotebookLMClient por un NotebookLM falso local (latencias
+configurables, caducidades de sesión, errores HTTP y respuestas vacías),
+lanza api_server.app en el mismo proceso y lo ataca con la concurrencia
+indicada. Informa de peticiones/s, latencias p50/p95/p99, reintentos y
+re-autenticaciones; con umbrales (--max-p95, --min-rps...) sale con código
+1 si no se cumplen, para detectar regresiones en CI.
+
+Ejemplos:
+  python benchmark.py --requests 500 --concurrency 32
+  python benchmark.py --latency lognormal:0.8,0.6 --auth-expiry-every 5 --http-error-rate 0.02
+  python benchmark.py --endpoint stream --max-p95 3 --min-rps 20 --json resultado.json
+"""
+import os
+import sys
+import json
+import math
+import time
+import random
+import asyncio
+import argparse
+import tempfile
+import threading
+import contextlib
+from typing import Optional
+
+
+# ============================================================================
+# NotebookLM falso
+# ============================================================================
+
+def parse_latency(spec: str):
+    """
+    Distribución de latencias del upstream, en segundos:
+      fixed:S  uniform:A,B  exponential:MEDIA  lognormal:MEDIANA,SIGMA
+    """
+    kind, _, params = spec.partition(":")
+    values = [float(v) for v in params.split(",") if v]
+    if kind == "fixed" and len(values) == 1:
+        return lambda rng: values[0]
+    if kind == "uniform" and len(values) == 2:
+        return lambda rng: rng.uniform(values[0], values[1])
+    if kind == "exponential" and len(values) == 1:
+        return lambda rng: rng.expovariate(1 / values[0])
+    if kind == "lognormal" and len(values) == 2:
+        return lambda rng: rng.lognormvariate(math.log(values[0]), values[1])
+    raise ValueError(f"Distribucion de latencia no valida: {spec}")
+
+
+class FakeUpstream:
+    """
+    Estado del NotebookLM simulado, común a todos los clientes. Solo acepta
+    la cookie SID vigente: una caducidad cambia el SID y las consultas fallan
+    con AuthenticationError hasta que la re-autenticación (simulada) publica
+    uno nuevo en NOTEBOOKLM_COOKIES.
+    """
+
+    def __init__(self, latency, http_error_rate: float = 0.0, empty_rate: float = 0.0,
+                 auth_expiry_every: float = 0.0, seed: int = 0):
+        self.latency = latency
+        self.http_error_rate = http_error_rate
+        self.empty_rate = empty_rate
+        self.auth_expiry_every = auth_expiry_every
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self.session = 1
+        self.expired = False
+        self._next_expiry = time.monotonic() + auth_expiry_every if auth_expiry_every else math.inf
+
+        self.calls = 0
+        self.auth_errors = 0
+        self.http_errors = 0
+        self.empty_answers = 0
+        self.expiries = 0
+
+    @property
+    def cookie_header(self) -> str:
+        return f"SID=bench-{self.session}"
+
+    def renew(self) -> None:
+        """Lo que hace notebooklm-mcp-auth: una sesión nueva y válida"""
+        with self._lock:
+            self.session += 1
+            self.expired = False
+        os.environ["NOTEBOOKLM_COOKIES"] = self.cookie_header
+
+    def _draw(self) -> tuple[float, float]:
+        with self._lock:
+            self.calls += 1
+            if time.monotonic() >= self._next_expiry:
+                self.expired = True
+                self.expiries += 1
+                self._next_expiry = time.monotonic() + self.auth_expiry_every
+            return self.latency(self._rng), self._rng.random()
+
+    def query(self, sid: str, query_text: str, conversation_id: Optional[str]) -> dict:
+        import httpx
+        from notebooklm_mcp.api_client import AuthenticationError
+
+        latency, roll = self._draw()
+        time.sleep(max(latency, 0))
+        if self.expired or sid != f"bench-{self.session}":
+            self.auth_errors += 1
+            raise AuthenticationError("Sesion caducada (simulada)")
+        if roll < self.http_error_rate:
+            self.http_errors += 1
+            request = httpx.Request("POST", "https://notebooklm.google.com/_/LabsTailwindUi/data/batchexecute")
+            raise httpx.HTTPStatusError("500 (simulado)", request=request, response=httpx.Response(500, request=request))
+        if roll < self.http_error_rate + self.empty_rate:
+            self.empty_answers += 1
+            answer = ""
+        else:
+            answer = f"Respuesta simulada a: {query_text[-80:]} " + "lorem ipsum " * 40
+        return {"answer": answer, "conversation_id": conversation_id or f"bench-conv-{self.calls}"}
+
+
+def make_fake_client(upstream: FakeUpstream):
+    """Clase con la interfaz de NotebookLMClient que usa el puente"""
+    from notebooklm_mcp.api_client import ConversationTurn
+
+    class FakeNotebookLMClient:
+        def __init__(self, cookies=None, csrf_token=None, session_id=None):
+            self.cookies = cookies or {}
+            self._conversation_cache = {}
+
+        def query(self, notebook_id, query_text, source_ids=None, conversation_id=None, timeout=120):
+            result = upstream.query(self.cookies.get("SID", ""), query_text, conversation_id)
+            self._cache_conversation_turn(result["conversation_id"], query_text, result["answer"])
+            return result
+
+        def list_notebooks(self):
+            return []
+
+        def get_notebook(self, notebook_id):
+            return None
+
+        def _cache_conversation_turn(self, conversation_id, query, answer):
+            turns = self._conversation_cache.setdefault(conversation_id, [])
+            turns.append(ConversationTurn(query=query, answer=answer, turn_number=len(turns) + 1))
+
+        def clear_conversation(self, conversation_id):
+            return self._conversation_cache.pop(conversation_id, None) is not None
+
+    return FakeNotebookLMClient
+
+
+# ============================================================================
+# Carga
+# ============================================================================
+
+def percentile(samples: list[float], q: float) -> float:
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    return ordered[min(int(math.ceil(len(ordered) * q)) - 1, len(ordered) - 1)]
+
+
+async def read_stream(response) -> dict:
+    """Último evento done/error de una respuesta SSE"""
+    result, event = {}, None
+    async for line in response.aiter_lines():
+        if line.startswith("event:"):
+            event = line[6:].strip()
+        elif line.startswith("data:") and event in ("done", "error"):
+            result = json.loads(line[5:].strip())
+            result.setdefault("success", event == "done")
+    return result
+
+
+async def drive(args, client, questions: list[str]) -> list[dict]:
+    """Lanza args.requests peticiones con args.concurrency en paralelo"""
+    rng = random.Random(args.seed)
+    plan = [rng.choice(questions) for _ in range(args.requests)]
+    results: list[dict] = []
+    next_index = 0
+
+    async def worker():
+        nonlocal next_index
+        while next_index < len(plan):
+            question = plan[next_index]
+            next_index += 1
+            body = {"notebook_id": args.notebook_id, "question": question, "timeout": 120}
+            started = time.perf_counter()
+            status, data = 0, {}
+            try:
+                if args.endpoint == "stream":
+                    async with client.stream("POST", "/query/stream", json=body) as response:
+                        status = response.status_code
+                        data = await read_stream(response) if status == 200 else {}
+                        status = data.get("status", status) if not data.get("success") else status
+                else:
+                    response = await client.post("/query", json=body)
+                    status = response.status_code
+                    data = response.json() if status == 200 else {}
+            except Exception as e:
+                data = {"error": f"{type(e).__name__}: {e}"}
+            results.append({
+                "latency": time.perf_counter() - started,
+                "status": status,
+                "success": bool(data.get("success")),
+                "empty": bool(data.get("success")) and not (data.get("answer") or "").strip(),
+                "cached": bool(data.get("cached")),
+            })
+
+    await asyncio.gather(*(worker() for _ in range(args.concurrency)))
+    return results
+
+
+async def run(args, upstream: FakeUpstream) -> dict:
+    import httpx
+    import api_server
+    from credentials import ReauthCoordinator
+
+    async def fake_auth_cli(self) -> str:
+        await asyncio.sleep(args.reauth_latency)
+        upstream.renew()
+        return "success"
+
+    ReauthCoordinator._run_auth_cli = fake_auth_cli
+
+    questions = [f"Pregunta de carga numero {i}" for i in range(args.questions or args.requests)]
+    if args.replay:
+        # Las preguntas de primer turno de la grabación
+        questions = api_server.upstream_recording.archive.questions()[:args.questions or None] or questions
+    transport = httpx.ASGITransport(app=api_server.app)
+    async with api_server.lifespan(api_server.app):
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+            started = time.perf_counter()
+            results = await drive(args, client, questions)
+            elapsed = time.perf_counter() - started
+            server_stats = (await client.get("/stats")).json()
+
+    latencies = [r["latency"] for r in results]
+    succeeded = sum(1 for r in results if r["success"])
+    statuses: dict[str, int] = {}
+    for r in results:
+        statuses[str(r["status"])] = statuses.get(str(r["status"]), 0) + 1
+    reauth = [a["reauth"] for a in server_stats["accounts"]["accounts"]]
+    leaders = server_stats["query_coalescing"]["upstream_calls"]
+    replay = server_stats["upstream_recording"] if args.replay else None
+    calls = sum(replay["served"].values()) if replay else upstream.calls
+    return {
+        "config": {k: v for k, v in vars(args).items() if k not in ("json", "verbose")},
+        "requests": len(results),
+        "elapsed_s": round(elapsed, 3),
+        "rps": round(len(results) / elapsed, 2) if elapsed else 0.0,
+        "latency_s": {
+            "p50": round(percentile(latencies, 0.50), 4),
+            "p95": round(percentile(latencies, 0.95), 4),
+            "p99": round(percentile(latencies, 0.99), 4),
+            "max": round(max(latencies, default=0.0), 4),
+            "mean": round(sum(latencies) / len(latencies), 4) if latencies else 0.0,
+        },
+        "succeeded": succeeded,
+        "error_rate": round(1 - succeeded / len(results), 4) if results else 0.0,
+        "empty_answers": sum(1 for r in results if r["empty"]),
+        "cached": sum(1 for r in results if r["cached"]),
+        "statuses": statuses,
+        "upstream": {
+            "calls": calls,
+            # Llamadas de más respecto a las consultas que llegaron a NotebookLM
+            # (solo /query pasa por la coalescencia que las cuenta)
+            "retries": max(calls - leaders, 0) if args.endpoint == "query" else None,
+            "auth_errors": upstream.auth_errors,
+            "http_errors": upstream.http_errors,
+            "empty_answers": upstream.empty_answers,
+            "session_expiries": upstream.expiries,
+        },
+        "replay": replay,
+        "reauth": {
+            "runs": sum(r["runs"] for r in reauth),
+            "parked_requests": sum(r["parked_requests"] for r in reauth),
+            "outcomes": [r["outcomes"] for r in reauth],
+        },
+        "upstream_executor": server_stats["upstream"],
+        "coalesced": server_stats["query_coalescing"]["upstream_calls_saved"],
+    }
+
+
+def check_thresholds(report: dict, args) -> list[str]:
+    failures = []
+    if args.max_p95 is not None and report["latency_s"]["p95"] > args.max_p95:
+        failures.append(f"p95 {report['latency_s']['p95']}s > {args.max_p95}s")
+    if args.max_p99 is not None and report["latency_s"]["p99"] > args.max_p99:
+        failures.append(f"p99 {report['latency_s']['p99']}s > {args.max_p99}s")
+    if args.min_rps is not None and report["rps"] < args.min_rps:
+        failures.append(f"{report['rps']} peticiones/s < {args.min_rps}")
+    if args.max_error_rate is not None and report["error_rate"] > args.max_error_rate:
+        failures.append(f"tasa de error {report['error_rate']} > {args.max_error_rate}")
+    if args.max_reauth_runs is not None and report["reauth"]["runs"] > args.max_reauth_runs:
+        failures.append(f"{report['reauth']['runs']} re-autenticaciones > {args.max_reauth_runs}")
+    return failures
+
+
+def print_report(report: dict, out) -> None:
+    lat = report["latency_s"]
+    up = report["upstream"]
+    print("=" * 60, file=out)
+    print(f"Peticiones: {report['requests']} en {report['elapsed_s']}s -> {report['rps']} peticiones/s", file=out)
+    print(f"Latencia:   p50 {lat['p50']}s  p95 {lat['p95']}s  p99 {lat['p99']}s  max {lat['max']}s", file=out)
+    print(f"Correctas:  {report['succeeded']} (tasa de error {report['error_rate']}), "
+          f"vacias {report['empty_answers']}, de cache {report['cached']}, coalescidas {report['coalesced']}", file=out)
+    print(f"Estados:    {report['statuses']}", file=out)
+    print(f"Upstream:   {up['calls']} llamadas, reintentos {up['retries']}, errores auth {up['auth_errors']}, "
+          f"errores HTTP {up['http_errors']}, caducidades {up['session_expiries']}", file=out)
+    print(f"Re-auth:    {report['reauth']['runs']} ejecuciones, {report['reauth']['parked_requests']} peticiones en espera", file=out)
+    print("=" * 60, file=out)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Prueba de carga del puente con un NotebookLM falso")
+    parser.add_argument("--requests", type=int, default=200, help="peticiones totales")
+    parser.add_argument("--concurrency", type=int, default=16, help="peticiones simultaneas")
+    parser.add_argument("--endpoint", choices=("query", "stream"), default="query")
+    parser.add_argument("--questions", type=int, default=0,
+                        help="preguntas distintas (0 = todas distintas; menos = aciertos de cache)")
+    parser.add_argument("--notebook-id", default="bench-notebook")
+    parser.add_argument("--latency", default="lognormal:0.5,0.4",
+                        help="fixed:S | uniform:A,B | exponential:MEDIA | lognormal:MEDIANA,SIGMA (segundos)")
+    parser.add_argument("--auth-expiry-every", type=float, default=0.0,
+                        help="segundos entre caducidades de la sesion (0 = nunca)")
+    parser.add_argument("--reauth-latency", type=float, default=1.0, help="segundos de la re-autenticacion simulada")
+    parser.add_argument("--http-error-rate", type=float, default=0.0, help="probabilidad de HTTP 500 por llamada")
+    parser.add_argument("--empty-rate", type=float, default=0.0, help="probabilidad de respuesta vacia")
+    parser.add_argument("--cache", action="store_true", help="activar la cache de respuestas")
+    parser.add_argument("--replay", help="reproducir una grabacion de UPSTREAM_MODE=record en vez del upstream falso")
+    parser.add_argument("--replay-speed", type=float, default=1.0, help="1 = tiempos grabados, 0 = sin esperas")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--verbose", action="store_true", help="mostrar los logs del servidor")
+    parser.add_argument("--json", help="guardar el informe en este archivo")
+    parser.add_argument("--max-p95", type=float)
+    parser.add_argument("--max-p99", type=float)
+    parser.add_argument("--min-rps", type=float)
+    parser.add_argument("--max-error-rate", type=float)
+    parser.add_argument("--max-reauth-runs", type=int)
+    args = parser.parse_args(argv)
+    try:
+        parse_latency(args.latency)
+    except ValueError as e:
+        parser.error(str(e))
+    return args
+
+
+def main(argv=None) -> int:
+    args = parse_args(argv)
+    upstream = FakeUpstream(
+        parse_latency(args.latency),
+        http_error_rate=args.http_error_rate,
+        empty_rate=args.empty_rate,
+        auth_expiry_every=args.auth_expiry_every,
+        seed=args.seed,
+    )
+
+    # Entorno aislado antes de importar el servidor: sin disco compartido,
+    # sin registro, sin sondeo y con las credenciales del upstream falso
+    workdir = tempfile.mkdtemp(prefix="notebooklm-bench-")
+    os.environ.update({
+        "NOTEBOOKLM_COOKIES": upstream.cookie_header,
+        "SHARED_STATE_DB": ":memory:",
+        "REQUEST_LOG_ENABLED": "0",
+        "CREDENTIAL_PROBE_INTERVAL": "0",
+        "ANSWER_CACHE_ENABLED": "1" if args.cache else "0",
+        "ANSWER_CACHE_DB": os.path.join(workdir, "answer_cache.sqlite3"),
+        "REAUTH_COOLDOWN": "0",
+        "AUTH_CHECK_INTERVAL": "0",
+    })
+    for key in [k for k in os.environ if k.startswith("NOTEBOOKLM_COOKIES_")] + ["NOTEBOOKLM_AUTH_FILES"]:
+        os.environ.pop(key, None)
+
+    if args.replay:
+        os.environ.update({
+            "UPSTREAM_MODE": "replay",
+            "UPSTREAM_RECORDING_PATH": args.replay,
+            "UPSTREAM_REPLAY_SPEED": str(args.replay_speed),
+        })
+    else:
+        os.environ["UPSTREAM_MODE"] = "live"
+        import notebooklm_mcp.api_client
+        notebooklm_mcp.api_client.NotebookLMClient = make_fake_client(upstream)
+        import credentials
+        credentials.NotebookLMClient = notebooklm_mcp.api_client.NotebookLMClient
+
+    out = sys.stdout
+    log = sys.stdout if args.verbose else open(os.path.join(workdir, "server.log"), "w")
+    print(f"[BENCH] {args.requests} peticiones a /{args.endpoint if args.endpoint == 'query' else 'query/stream'} "
+          f"con concurrencia {args.concurrency} "
+          f"({'grabacion ' + args.replay if args.replay else 'latencia ' + args.latency})", file=out)
+    with contextlib.redirect_stdout(log):
+        report = asyncio.run(run(args, upstream))
+    if not args.verbose:
+        log.close()
+        print(f"[BENCH] Log del servidor: {log.name}", file=out)
+
+    print_report(report, out)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+
+    failures = check_thresholds(report, args)
+    for failure in failures:
+        print(f"[BENCH] Umbral superado: {failure}", file=out)
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
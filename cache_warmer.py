@@ -0,0 +1,163 @@
+"""
+Precalentamiento de la caché de respuestas
+Las preguntas sugeridas del chat concentran buena parte del tráfico. Se
+responden al arrancar, periódicamente y cuando cambian las fuentes del
+cuaderno, para que el primer usuario las reciba desde la caché. Va de una en
+una y solo cuando el pool hacia NotebookLM está desocupado, sin competir con
+las consultas reales.
+"""
+import os
+import time
+import asyncio
+from typing import Awaitable, Callable, Optional
+
+
+# ============================================================================
+# Configuración
+# ============================================================================
+
+CACHE_WARMER_ENABLED = os.environ.get("CACHE_WARMER_ENABLED", "1") != "0"
+# Segundos entre rondas programadas
+CACHE_WARMER_INTERVAL = float(os.environ.get("CACHE_WARMER_INTERVAL", "3600"))
+# Espera tras el arranque antes de la primera ronda
+CACHE_WARMER_STARTUP_DELAY = float(os.environ.get("CACHE_WARMER_STARTUP_DELAY", "10"))
+# Respuestas más antiguas que esto (segundos) se vuelven a pedir; 0 = la mitad del TTL de la caché
+CACHE_WARMER_MAX_AGE = float(os.environ.get("CACHE_WARMER_MAX_AGE", "0"))
+# Segundos máximos esperando a que el pool quede libre antes de cada pregunta
+CACHE_WARMER_IDLE_WAIT = float(os.environ.get("CACHE_WARMER_IDLE_WAIT", "300"))
+
+
+class CacheWarmer:
+    """
+    `warm(notebook_id, question)` responde una pregunta y devuelve el
+    resultado ("fresh", "warmed", "empty", "busy", "error"); `is_idle()` dice si
+    hay capacidad libre hacia NotebookLM. Con `shared` (SharedState) solo un
+    worker hace cada ronda. `before_round()` (opcional) se llama al empezar
+    cada ronda, p. ej. para comprobar si cambiaron las fuentes.
+    """
+
+    def __init__(
+        self,
+        notebook_id: str,
+        questions: list[str],
+        warm: Callable[[str, str], Awaitable[str]],
+        is_idle: Callable[[], bool],
+        interval: float = CACHE_WARMER_INTERVAL,
+        startup_delay: float = CACHE_WARMER_STARTUP_DELAY,
+        idle_wait: float = CACHE_WARMER_IDLE_WAIT,
+        shared=None,
+        before_round: Optional[Callable[[], Awaitable[None]]] = None,
+    ):
+        self.notebook_id = notebook_id
+        self.questions = questions
+        self.warm = warm
+        self.is_idle = is_idle
+        self.interval = interval
+        self.startup_delay = startup_delay
+        self.idle_wait = idle_wait
+        self.shared = shared
+        self.before_round = before_round
+        self._task: Optional[asyncio.Task] = None
+        self._wakeup = asyncio.Event()
+        self._pending_reason: Optional[str] = None
+
+        self.rounds = 0
+        self.skipped_rounds = 0
+        self.results: dict[str, int] = {}
+        self.last_round_at: Optional[float] = None
+        self.last_round_duration: Optional[float] = None
+        self.last_round_reason: Optional[str] = None
+
+    def start(self) -> None:
+        if self._task is None and self.questions:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def trigger(self, reason: str = "manual") -> None:
+        """Adelanta la siguiente ronda (p. ej. tras un cambio de fuentes)"""
+        self._pending_reason = reason
+        self._wakeup.set()
+
+    async def _run(self) -> None:
+        await asyncio.sleep(self.startup_delay)
+        reason = "startup"
+        while True:
+            try:
+                await self.run_round(reason)
+            except Exception as e:
+                print(f"[WARM] Error en la ronda de precalentamiento: {e}")
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.interval)
+                reason = self._pending_reason or "manual"
+            except asyncio.TimeoutError:
+                reason = "scheduled"
+            self._wakeup.clear()
+            self._pending_reason = None
+
+    async def _take_round(self, reason: str) -> bool:
+        """Con varios workers, la ronda programada la hace solo uno"""
+        if self.shared is None:
+            return True
+        if reason in ("startup", "scheduled"):
+            name, ttl = "cache_warmer:scheduled", self.interval * 0.9
+        else:
+            name, ttl = f"cache_warmer:{reason}", 60
+        return await asyncio.to_thread(self.shared.try_acquire, name, ttl)
+
+    async def _wait_idle(self) -> bool:
+        deadline = time.monotonic() + self.idle_wait
+        while not self.is_idle():
+            if time.monotonic() >= deadline:
+                return False
+            await asyncio.sleep(1)
+        return True
+
+    async def run_round(self, reason: str) -> None:
+        if not await self._take_round(reason):
+            self.skipped_rounds += 1
+            return
+        started = time.monotonic()
+        if self.before_round is not None:
+            try:
+                await self.before_round()
+            except Exception as e:
+                print(f"[WARM] Error antes de la ronda: {e}")
+        counts: dict[str, int] = {}
+        for question in self.questions:
+            if not await self._wait_idle():
+                outcome = "busy"
+            else:
+                try:
+                    outcome = await self.warm(self.notebook_id, question)
+                except Exception as e:
+                    print(f"[WARM] Error precalentando '{question[:40]}': {type(e).__name__}: {e}")
+                    outcome = "error"
+            counts[outcome] = counts.get(outcome, 0) + 1
+            self.results[outcome] = self.results.get(outcome, 0) + 1
+
+        self.rounds += 1
+        self.last_round_at = time.time()
+        self.last_round_duration = time.monotonic() - started
+        self.last_round_reason = reason
+        print(f"[WARM] Ronda ({reason}) en {self.last_round_duration:.1f}s: {counts}")
+
+    def stats(self) -> dict:
+        return {
+            "notebook_id": self.notebook_id,
+            "questions": len(self.questions),
+            "interval_s": self.interval,
+            "rounds": self.rounds,
+            "skipped_rounds": self.skipped_rounds,
+            "results": dict(self.results),
+            "last_round_at": self.last_round_at,
+            "last_round_duration_s": round(self.last_round_duration, 2) if self.last_round_duration is not None else None,
+            "last_round_reason": self.last_round_reason,
+        }
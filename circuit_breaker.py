@@ -0,0 +1,261 @@
+"""
+Circuit breaker hacia NotebookLM
+Si NotebookLM empieza a devolver 5xx o a agotar los tiempos, cada consulta
+esperaría su timeout completo ocupando un hilo del pool. El breaker lleva la
+tasa de errores y de llamadas lentas de una ventana móvil; al superarse se
+abre y las llamadas fallan al momento (la API responde entonces desde la
+caché o con las fuentes indexadas). Pasado un tiempo deja pasar unas pocas
+llamadas de prueba (semiabierto) y, si salen bien, vuelve a cerrarse.
+
+Los errores de autenticación no cuentan: son de una cuenta, no del servicio,
+y ya los resuelven la recarga de credenciales y la re-autenticación.
+"""
+import os
+import math
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Optional
+
+import httpx
+
+from upstream import UpstreamBusy
+
+
+# ============================================================================
+# Configuración
+# ============================================================================
+
+CIRCUIT_BREAKER_ENABLED = os.environ.get("CIRCUIT_BREAKER_ENABLED", "1") != "0"
+# Ventana móvil de resultados y mínimo de llamadas para poder abrir
+CIRCUIT_WINDOW_SECONDS = float(os.environ.get("CIRCUIT_WINDOW_SECONDS", "60"))
+CIRCUIT_MIN_CALLS = int(os.environ.get("CIRCUIT_MIN_CALLS", "8"))
+# Proporción de errores (5xx, 429, timeouts, red) que abre el circuito
+CIRCUIT_FAILURE_RATE = float(os.environ.get("CIRCUIT_FAILURE_RATE", "0.5"))
+# Llamadas más lentas que esto cuentan como lentas; abre si lo son demasiadas
+CIRCUIT_SLOW_CALL_SECONDS = float(os.environ.get("CIRCUIT_SLOW_CALL_SECONDS", "60"))
+CIRCUIT_SLOW_CALL_RATE = float(os.environ.get("CIRCUIT_SLOW_CALL_RATE", "0.8"))
+# Tiempo abierto antes de probar; se duplica cada vez que la prueba falla
+CIRCUIT_OPEN_SECONDS = float(os.environ.get("CIRCUIT_OPEN_SECONDS", "30"))
+CIRCUIT_MAX_OPEN_SECONDS = float(os.environ.get("CIRCUIT_MAX_OPEN_SECONDS", "300"))
+# Llamadas de prueba simultáneas en semiabierto (y aciertos para cerrar)
+CIRCUIT_HALF_OPEN_PROBES = int(os.environ.get("CIRCUIT_HALF_OPEN_PROBES", "1"))
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+# Últimas transiciones que se muestran en /health
+TRANSITION_HISTORY = 20
+
+
+class CircuitOpen(UpstreamBusy):
+    """NotebookLM se considera caído: la llamada no se intenta"""
+
+    status_code = 503
+
+
+def is_upstream_failure(exc: BaseException) -> bool:
+    """Errores que indican que NotebookLM no está sano"""
+    if isinstance(exc, httpx.HTTPStatusError):
+        status = exc.response.status_code
+        return status >= 500 or status == 429
+    return isinstance(exc, (httpx.TransportError, TimeoutError))
+
+
+class CircuitBreaker:
+    """
+    Estado del circuito de un proceso. Todo se ejecuta en el event loop, así
+    que no necesita locks.
+    """
+
+    def __init__(
+        self,
+        window: float = CIRCUIT_WINDOW_SECONDS,
+        min_calls: int = CIRCUIT_MIN_CALLS,
+        failure_rate: float = CIRCUIT_FAILURE_RATE,
+        slow_call_seconds: float = CIRCUIT_SLOW_CALL_SECONDS,
+        slow_call_rate: float = CIRCUIT_SLOW_CALL_RATE,
+        open_seconds: float = CIRCUIT_OPEN_SECONDS,
+        max_open_seconds: float = CIRCUIT_MAX_OPEN_SECONDS,
+        half_open_probes: int = CIRCUIT_HALF_OPEN_PROBES,
+        enabled: bool = CIRCUIT_BREAKER_ENABLED,
+    ):
+        self.window = window
+        self.min_calls = min_calls
+        self.failure_rate = failure_rate
+        self.slow_call_seconds = slow_call_seconds
+        self.slow_call_rate = slow_call_rate
+        self.open_seconds = open_seconds
+        self.max_open_seconds = max_open_seconds
+        self.half_open_probes = max(half_open_probes, 1)
+        self.enabled = enabled
+
+        self._state = CLOSED
+        self._opened_at = 0.0
+        self._open_for = open_seconds
+        self._probes = 0
+        self._probe_successes = 0
+        # Cada transición cambia de época: una llamada de prueba de una fase
+        # semiabierta anterior ya no cuenta
+        self._epoch = 0
+        # (instante, fallo, lenta, duración)
+        self._outcomes: deque[tuple[float, bool, bool, float]] = deque()
+        self.transitions: deque[dict] = deque(maxlen=TRANSITION_HISTORY)
+
+        # Métricas
+        self.opened = 0
+        self.rejected = 0
+        self.failures = 0
+        self.successes = 0
+
+    # ------------------------------------------------------------------
+    # Estado
+    # ------------------------------------------------------------------
+
+    @property
+    def state(self) -> str:
+        if self._state == OPEN and time.monotonic() - self._opened_at >= self._open_for:
+            self._transition(HALF_OPEN, "fin del periodo abierto")
+        return self._state
+
+    def retry_after(self) -> float:
+        """Segundos hasta la próxima llamada de prueba"""
+        if self._state != OPEN:
+            return 1.0
+        return float(max(math.ceil(self._opened_at + self._open_for - time.monotonic()), 1))
+
+    def _transition(self, state: str, reason: str) -> None:
+        previous, self._state = self._state, state
+        self._epoch += 1
+        if state == OPEN:
+            self._opened_at = time.monotonic()
+            self.opened += 1
+        if state != HALF_OPEN:
+            self._probes = 0
+            self._probe_successes = 0
+        if state == CLOSED:
+            self._open_for = self.open_seconds
+            self._outcomes.clear()
+        self.transitions.append({"at": time.time(), "from": previous, "to": state, "reason": reason})
+        print(f"[CIRCUIT] {previous} -> {state}: {reason}")
+
+    def _prune(self, now: float) -> None:
+        while self._outcomes and now - self._outcomes[0][0] > self.window:
+            self._outcomes.popleft()
+
+    def _rates(self) -> tuple[int, float, float]:
+        self._prune(time.monotonic())
+        calls = len(self._outcomes)
+        if not calls:
+            return 0, 0.0, 0.0
+        failed = sum(1 for _, failure, _, _ in self._outcomes if failure)
+        slow = sum(1 for _, _, is_slow, _ in self._outcomes if is_slow)
+        return calls, failed / calls, slow / calls
+
+    # ------------------------------------------------------------------
+    # Admisión y resultados
+    # ------------------------------------------------------------------
+
+    def check(self) -> None:
+        """Falla al momento (CircuitOpen) si el circuito está abierto"""
+        if self.enabled and self.state == OPEN:
+            self.rejected += 1
+            raise CircuitOpen("NotebookLM no responde correctamente; circuito abierto", self.retry_after())
+
+    def _admit(self) -> Optional[int]:
+        """Deja pasar la llamada; la época si es una llamada de prueba"""
+        self.check()
+        if self._state != HALF_OPEN:
+            return None
+        if self._probes >= self.half_open_probes:
+            self.rejected += 1
+            raise CircuitOpen("NotebookLM en recuperación; esperando la llamada de prueba", self.retry_after())
+        self._probes += 1
+        return self._epoch
+
+    def _release_probe(self, probe: Optional[int]) -> bool:
+        """Libera la plaza de prueba; False si su fase semiabierta ya terminó"""
+        if probe is None or probe != self._epoch:
+            return False
+        self._probes -= 1
+        return True
+
+    def _record(self, failure: bool, duration: Optional[float], probe: Optional[int], reason: str = "") -> None:
+        now = time.monotonic()
+        slow = duration is not None and duration >= self.slow_call_seconds
+        if failure:
+            self.failures += 1
+        else:
+            self.successes += 1
+
+        if probe is not None:
+            if not self._release_probe(probe):
+                return
+            if failure or slow:
+                self._open_for = min(self._open_for * 2, self.max_open_seconds)
+                self._transition(OPEN, f"llamada de prueba fallida ({reason or 'lenta'})")
+            else:
+                self._probe_successes += 1
+                if self._probe_successes >= self.half_open_probes:
+                    self._transition(CLOSED, "llamadas de prueba correctas")
+            return
+        if self._state != CLOSED:
+            # Llamada admitida antes de abrirse el circuito
+            return
+
+        self._outcomes.append((now, failure, slow, duration or 0.0))
+        if not (failure or slow):
+            return
+        calls, failure_rate, slow_rate = self._rates()
+        if calls < self.min_calls:
+            return
+        if failure_rate >= self.failure_rate:
+            self._transition(OPEN, f"{failure_rate:.0%} de errores en {calls} llamadas ({reason})")
+        elif slow_rate >= self.slow_call_rate:
+            self._transition(OPEN, f"{slow_rate:.0%} de llamadas lentas en {calls} llamadas")
+
+    @contextmanager
+    def guard(self, track_latency: bool = True):
+        """
+        Envuelve una llamada a NotebookLM: la rechaza si el circuito está
+        abierto y anota su resultado. Con track_latency=False (streaming) la
+        duración no cuenta para las llamadas lentas.
+        """
+        if not self.enabled:
+            yield
+            return
+        probe = self._admit()
+        started = time.monotonic()
+        try:
+            yield
+        except Exception as e:
+            if is_upstream_failure(e):
+                self._record(True, None, probe, type(e).__name__)
+            else:
+                # Sin veredicto (p. ej. error de autenticación): la prueba queda libre
+                self._release_probe(probe)
+            raise
+        except BaseException:
+            self._release_probe(probe)
+            raise
+        self._record(False, time.monotonic() - started if track_latency else None, probe)
+
+    def stats(self) -> dict:
+        calls, failure_rate, slow_rate = self._rates()
+        durations = sorted(d for _, failure, _, d in self._outcomes if not failure and d)
+        return {
+            "enabled": self.enabled,
+            "state": self.state,
+            "retry_after_s": round(self.retry_after(), 1) if self._state == OPEN else 0,
+            "window_calls": calls,
+            "failure_rate": round(failure_rate, 3),
+            "slow_call_rate": round(slow_rate, 3),
+            "p95_latency_s": round(durations[min(int(len(durations) * 0.95), len(durations) - 1)], 3)
+            if durations else None,
+            "opened": self.opened,
+            "rejected": self.rejected,
+            "failures": self.failures,
+            "successes": self.successes,
+            "transitions": list(self.transitions),
+        }
@@ -0,0 +1,651 @@
+"""
+Almacén de credenciales para NotebookLM
+Mantiene un único cliente de larga duración y solo lo reconstruye cuando
+cambian las credenciales (auth.json o NOTEBOOKLM_COOKIES) o se pide explícitamente.
+"""
+import os
+import json
+import time
+import asyncio
+import hashlib
+import threading
+import subprocess
+from pathlib import Path
+from typing import Optional
+
+import httpx
+from notebooklm_mcp.api_client import NotebookLMClient, AuthenticationError
+
+
+DEFAULT_AUTH_FILE = Path.home() / ".notebooklm-mcp" / "auth.json"
+
+# Segundos mínimos entre dos comprobaciones (stat) del archivo de credenciales
+AUTH_CHECK_INTERVAL = float(os.environ.get("AUTH_CHECK_INTERVAL", "2"))
+
+# Re-autenticación automática con notebooklm-mcp-auth --file
+REAUTH_COMMAND = ["notebooklm-mcp-auth", "--file"]
+REAUTH_COOKIES_FILE = Path(os.environ.get(
+    "REAUTH_COOKIES_FILE", str(Path(__file__).parent / "cookies.txt")
+))
+REAUTH_TIMEOUT = float(os.environ.get("REAUTH_TIMEOUT", "60"))
+REAUTH_COOLDOWN = float(os.environ.get("REAUTH_COOLDOWN", "30"))  # Tras un intento fallido
+
+# Sondeo periódico de las credenciales en segundo plano
+CREDENTIAL_PROBE_INTERVAL = float(os.environ.get("CREDENTIAL_PROBE_INTERVAL", "300"))
+# Antigüedad (horas) a partir de la cual se renuevan las cookies de forma preventiva
+CREDENTIAL_MAX_AGE_HOURS = float(os.environ.get("CREDENTIAL_MAX_AGE_HOURS", "96"))
+
+
+def is_auth_failure(error: BaseException) -> bool:
+    """True si la excepción indica credenciales caducadas (RPC 16 o HTTP 401/403)"""
+    if isinstance(error, AuthenticationError):
+        return True
+    return isinstance(error, httpx.HTTPStatusError) and error.response.status_code in (401, 403)
+
+
+def parse_cookie_header(cookie_header: str) -> dict:
+    """Convierte una cabecera 'k1=v1; k2=v2' en un diccionario de cookies"""
+    cookies = {}
+    for item in cookie_header.split(";"):
+        if "=" in item:
+            k, v = item.strip().split("=", 1)
+            cookies[k] = v
+    return cookies
+
+
+class CredentialStore:
+    """
+    Cliente NotebookLM compartido con recarga en caliente.
+
+    En cada acceso se compara una huella barata de las credenciales (hash de la
+    variable de entorno o inode/mtime/tamaño de auth.json, como mucho una vez
+    cada AUTH_CHECK_INTERVAL segundos). El cliente solo se reconstruye si la
+    huella cambia o si se llama a refresh().
+    """
+
+    def __init__(
+        self,
+        env_var: Optional[str] = "NOTEBOOKLM_COOKIES",
+        auth_file: Optional[Path] = DEFAULT_AUTH_FILE,
+        check_interval: float = AUTH_CHECK_INTERVAL,
+        name: str = "default",
+        client_factory=None,
+    ):
+        # env_var o auth_file pueden ser None para cuentas con una sola fuente
+        self.env_var = env_var
+        self.auth_file = Path(auth_file) if auth_file is not None else None
+        self.check_interval = check_interval
+        self.name = name
+        # Construye el cliente con los argumentos de NotebookLMClient; permite
+        # envolverlo (grabación) o sustituirlo (reproducción, pruebas de carga)
+        self.client_factory = client_factory
+
+        self._lock = threading.Lock()
+        self._client: Optional[NotebookLMClient] = None
+        self._fingerprint: Optional[tuple] = None
+        self._failed_fingerprint: Optional[tuple] = None
+        self._last_check = 0.0
+
+        # Estadísticas
+        self.generation = 0          # Se incrementa en cada reconstrucción
+        # Última generación con credenciales nuevas (no una simple recarga de
+        # las mismas): la que puede arreglar un error de autenticación
+        self.renewed_generation = 0
+        self.source: Optional[str] = None
+        self.rebuilds: dict[str, int] = {}
+        self.failures = 0
+        self.checks = 0
+        self.last_error: Optional[str] = None
+        self.last_rebuild_at: Optional[float] = None
+        self.created_at = time.time()
+
+    # ------------------------------------------------------------------
+    # Huella de las credenciales
+    # ------------------------------------------------------------------
+
+    def _fingerprint_now(self) -> Optional[tuple]:
+        """Huella de la fuente activa: variable de entorno o archivo"""
+        cookie_header = os.environ.get(self.env_var, "") if self.env_var else ""
+        if cookie_header:
+            return ("env", hashlib.sha256(cookie_header.encode("utf-8")).hexdigest())
+        if self.auth_file is None:
+            return None
+        try:
+            st = self.auth_file.stat()
+        except OSError:
+            return None
+        return ("file", st.st_ino, st.st_mtime_ns, st.st_size)
+
+    # ------------------------------------------------------------------
+    # Construcción del cliente
+    # ------------------------------------------------------------------
+
+    def _build(self) -> tuple[NotebookLMClient, str]:
+        """Construye un cliente nuevo. Prioridad: variable de entorno, después disco"""
+        factory = self.client_factory or NotebookLMClient
+        cookie_header = os.environ.get(self.env_var, "") if self.env_var else ""
+        if cookie_header:
+            try:
+                return factory(cookies=parse_cookie_header(cookie_header)), "env"
+            except Exception as e:
+                print(f"[ERROR] Error cookies env: {e}")
+
+        if self.auth_file is None:
+            raise ValueError(f"La variable {self.env_var} no esta definida")
+        if not self.auth_file.exists():
+            raise FileNotFoundError(
+                f"No se encontro {self.auth_file}. Usa 'notebooklm-mcp-auth'."
+            )
+
+        with open(self.auth_file, "r") as f:
+            data = json.load(f)
+
+        client = factory(
+            cookies=data.get("cookies", {}),
+            csrf_token=data.get("csrf_token"),
+            session_id=data.get("session_id")
+        )
+        return client, "file"
+
+    def _rebuild(self, fingerprint: Optional[tuple], reason: str) -> bool:
+        """Reconstruye el cliente (llamar con el lock adquirido)"""
+        try:
+            client, source = self._build()
+        except Exception as e:
+            self.failures += 1
+            self.last_error = f"{type(e).__name__}: {e}"
+            self._failed_fingerprint = fingerprint
+            print(f"[ERROR] No se pudo construir el cliente de {self.name} ({reason}): {self.last_error}")
+            return False
+
+        old_client = self._client
+        # El historial local de las conversaciones sigue valiendo con las
+        # credenciales nuevas: sin él los seguimientos perderían el contexto
+        old_conversations = getattr(old_client, "_conversation_cache", None)
+        if old_conversations and isinstance(getattr(client, "_conversation_cache", None), dict):
+            client._conversation_cache.update(old_conversations)
+        renewed = fingerprint != self._fingerprint or reason == "reauth"
+        self._client = client
+        self._fingerprint = fingerprint
+        self._failed_fingerprint = None
+        self.source = source
+        self.generation += 1
+        if renewed:
+            self.renewed_generation = self.generation
+        self.rebuilds[reason] = self.rebuilds.get(reason, 0) + 1
+        self.last_rebuild_at = time.time()
+        self.last_error = None
+        print(f"[AUTH] Cliente reconstruido (cuenta={self.name}, motivo={reason}, fuente={source}, generacion={self.generation})")
+
+        # El cliente anterior puede estar en uso por otra consulta: no se cierra
+        # explícitamente, su conexión se libera cuando deja de estar referenciado.
+        del old_client
+        return True
+
+    # ------------------------------------------------------------------
+    # API pública
+    # ------------------------------------------------------------------
+
+    @property
+    def client(self) -> Optional[NotebookLMClient]:
+        """Cliente actual sin comprobar cambios"""
+        return self._client
+
+    def needs_check(self) -> bool:
+        return self._client is None or time.monotonic() - self._last_check >= self.check_interval
+
+    def get_client(self) -> Optional[NotebookLMClient]:
+        """Devuelve el cliente, reconstruyéndolo solo si las credenciales cambiaron"""
+        if not self.needs_check():
+            return self._client
+
+        with self._lock:
+            if not self.needs_check():
+                return self._client
+            self._last_check = time.monotonic()
+            self.checks += 1
+
+            fingerprint = self._fingerprint_now()
+            if self._client is not None and fingerprint == self._fingerprint:
+                return self._client
+            if fingerprint is not None and fingerprint == self._failed_fingerprint:
+                # Ya falló con estas mismas credenciales: no reintentar hasta que cambien
+                return self._client
+
+            if self._client is None:
+                reason = "initial"
+            elif fingerprint and fingerprint[0] == "env":
+                reason = "env_changed"
+            else:
+                reason = "file_changed"
+            self._rebuild(fingerprint, reason)
+            return self._client
+
+    async def get_client_async(self) -> Optional[NotebookLMClient]:
+        """
+        Igual que get_client(), pero si hay que reconstruir lo hace en un hilo:
+        el constructor de NotebookLMClient puede hacer una petición HTTP.
+        """
+        if not self.needs_check():
+            return self._client
+        return await asyncio.to_thread(self.get_client)
+
+    def refresh(self, reason: str = "manual") -> bool:
+        """Fuerza la reconstrucción del cliente aunque la huella no haya cambiado"""
+        with self._lock:
+            self._last_check = time.monotonic()
+            return self._rebuild(self._fingerprint_now(), reason)
+
+    def stats(self) -> dict:
+        """Estadísticas de reconstrucciones para /stats y /refresh-auth"""
+        uptime_hours = max((time.time() - self.created_at) / 3600, 1e-9)
+        total = sum(self.rebuilds.values())
+        return {
+            "authenticated": self._client is not None,
+            "source": self.source,
+            "auth_file": str(self.auth_file) if self.auth_file is not None else None,
+            "generation": self.generation,
+            "renewed_generation": self.renewed_generation,
+            "rebuilds_total": total,
+            "rebuilds_by_reason": dict(self.rebuilds),
+            "rebuilds_per_hour": round(total / uptime_hours, 3),
+            "last_rebuild_at": self.last_rebuild_at,
+            "checks": self.checks,
+            "failures": self.failures,
+            "last_error": self.last_error,
+        }
+
+
+class ReauthCoordinator:
+    """
+    Re-autenticación compartida: el CLI de auth se ejecuta como subproceso
+    asíncrono una sola vez por caducidad. Las peticiones que fallan mientras
+    tanto esperan al mismo intento y después reintentan con el cliente nuevo.
+    """
+
+    def __init__(
+        self,
+        store: CredentialStore,
+        cookies_file: Optional[Path] = REAUTH_COOKIES_FILE,
+        command: Optional[list] = None,
+        timeout: float = REAUTH_TIMEOUT,
+        cooldown: float = REAUTH_COOLDOWN,
+        shared=None,
+    ):
+        self.store = store
+        # SharedState opcional: con varios workers solo uno ejecuta el CLI y
+        # el cooldown tras un fallo se respeta en todos
+        self.shared = shared
+        # None: la cuenta no admite re-autenticación automática (solo recarga)
+        self.cookies_file = Path(cookies_file) if cookies_file is not None else None
+        self.command = command or REAUTH_COMMAND
+        self.timeout = timeout
+        self.cooldown = cooldown
+        self._task: Optional[asyncio.Task] = None
+        self._last_failure_at = 0.0
+
+        # Métricas
+        self.runs = 0
+        self.outcomes: dict[str, int] = {}
+        self.parked = 0             # Peticiones que esperaron a un intento en curso
+        self.skipped = 0            # Credenciales ya renovadas por otro: solo reintentar
+        self.waited_other_worker = 0  # Re-autenticaciones hechas por otro proceso
+        self.last_duration: Optional[float] = None
+        self.total_duration = 0.0
+        self.max_duration = 0.0
+        self.last_outcome: Optional[str] = None
+        self.last_run_at: Optional[float] = None
+        self.last_success_at: Optional[float] = None
+        self.on_finish = None       # callback(outcome, duración) opcional
+
+    @property
+    def in_progress(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    async def reauth(self, observed_generation: int) -> bool:
+        """
+        Renueva las credenciales si siguen siendo las de `observed_generation`
+        (la generación con la que falló la petición). Devuelve True si hay
+        credenciales más nuevas con las que reintentar.
+
+        Una recarga de las mismas credenciales (la de otra petición tras su
+        error) sube la generación pero no las renueva: no evita el CLI.
+        """
+        if self.store.renewed_generation > observed_generation:
+            self.skipped += 1
+            return True
+
+        if not self.in_progress:
+            if time.monotonic() - self._last_failure_at < self.cooldown or await self._shared_cooldown():
+                print(f"[REAUTH] Cooldown activo. Esperando {self.cooldown}s entre re-autenticaciones.")
+                self._count("cooldown")
+                return False
+            # Durante la consulta del cooldown compartido otra petición pudo
+            # lanzar (o incluso terminar) el intento: no lanzar uno segundo
+            if self.store.renewed_generation > observed_generation:
+                self.skipped += 1
+                return True
+
+        if self.in_progress:
+            self.parked += 1
+        else:
+            self._task = asyncio.ensure_future(self._run())
+
+        # shield: si la petición se cancela, la re-autenticación continúa
+        await asyncio.shield(self._task)
+        return self.store.renewed_generation > observed_generation
+
+    @property
+    def _lease_name(self) -> str:
+        return f"reauth:{self.store.name}"
+
+    async def _shared_cooldown(self) -> bool:
+        """Otro worker falló hace menos de `cooldown` segundos"""
+        if self.shared is None:
+            return False
+        failed_at = await asyncio.to_thread(self.shared.get, f"reauth_failed_at:{self.store.name}")
+        return failed_at is not None and time.time() - failed_at < self.cooldown
+
+    async def _run_exclusive(self) -> str:
+        """Ejecuta el CLI con el lease compartido o espera al worker que lo tiene"""
+        if self.shared is None:
+            return await self._run_auth_cli()
+
+        started_at = time.time()
+        lease_ttl = self.timeout + 30
+        if await asyncio.to_thread(self.shared.try_acquire, self._lease_name, lease_ttl):
+            try:
+                outcome = await self._run_auth_cli()
+                await asyncio.to_thread(
+                    self.shared.set, f"reauth_result:{self.store.name}",
+                    {"outcome": outcome, "at": time.time()}
+                )
+                if outcome != "success":
+                    await asyncio.to_thread(
+                        self.shared.set, f"reauth_failed_at:{self.store.name}", time.time(), self.cooldown
+                    )
+                return outcome
+            finally:
+                await asyncio.to_thread(self.shared.release, self._lease_name)
+
+        # Otro worker está re-autenticando: esperar a que termine y usar su resultado
+        print("[REAUTH] Otro worker esta re-autenticando, esperando su resultado...")
+        self.waited_other_worker += 1
+        deadline = time.monotonic() + lease_ttl
+        while time.monotonic() < deadline:
+            await asyncio.sleep(0.5)
+            if await asyncio.to_thread(self.shared.lease_holder, self._lease_name) is None:
+                break
+        result = await asyncio.to_thread(self.shared.get, f"reauth_result:{self.store.name}")
+        if not result or result.get("at", 0) < started_at:
+            return "other_worker_timeout"
+        return result["outcome"]
+
+    def _count(self, outcome: str) -> None:
+        self.outcomes[outcome] = self.outcomes.get(outcome, 0) + 1
+        self.last_outcome = outcome
+
+    async def _run(self) -> bool:
+        started = time.monotonic()
+        self.runs += 1
+        self.last_run_at = time.time()
+        outcome = await self._run_exclusive()
+        if outcome == "success":
+            if await asyncio.to_thread(self.store.refresh, "reauth"):
+                self.last_success_at = time.time()
+            else:
+                outcome = "reload_failed"
+
+        duration = time.monotonic() - started
+        self.last_duration = duration
+        self.total_duration += duration
+        self.max_duration = max(self.max_duration, duration)
+        self._count(outcome)
+        if outcome != "success":
+            self._last_failure_at = time.monotonic()
+        print(f"[REAUTH] Resultado: {outcome} en {duration:.1f}s")
+        if self.on_finish is not None:
+            self.on_finish(outcome, duration)
+        return outcome == "success"
+
+    async def _run_auth_cli(self) -> str:
+        """Ejecuta notebooklm-mcp-auth --file pasando cookies.txt por stdin"""
+        if self.cookies_file is None:
+            print(f"[REAUTH] La cuenta {self.store.name} no tiene re-autenticacion automatica; renueva sus credenciales manualmente")
+            return "not_configured"
+        if not self.cookies_file.exists():
+            print("[REAUTH] No existe cookies.txt - re-autenticacion automatica no disponible")
+            print("[REAUTH] Para habilitar re-auth automatica:")
+            print("  1. Abre Chrome -> notebooklm.google.com")
+            print("  2. F12 -> Network -> filtrar 'batchexecute'")
+            print("  3. Copia el header 'cookie' y guardalo en cookies.txt")
+            return "no_cookies_file"
+
+        print("[REAUTH] Encontrado cookies.txt, iniciando re-autenticacion...")
+        stdin_data = (str(self.cookies_file) + "\n").encode()
+        try:
+            try:
+                proc = await asyncio.create_subprocess_exec(
+                    *self.command,
+                    stdin=asyncio.subprocess.PIPE,
+                    stdout=asyncio.subprocess.PIPE,
+                    stderr=asyncio.subprocess.PIPE,
+                )
+            except NotImplementedError:
+                # Event loop sin soporte de subprocesos (SelectorEventLoop en Windows)
+                return await asyncio.to_thread(self._run_auth_cli_blocking, stdin_data)
+
+            try:
+                stdout, stderr = await asyncio.wait_for(proc.communicate(stdin_data), self.timeout)
+            except asyncio.TimeoutError:
+                proc.kill()
+                await proc.wait()
+                print("[REAUTH] Timeout - la re-autenticacion tardo demasiado")
+                return "timeout"
+            return self._check_result(proc.returncode, stdout, stderr)
+
+        except FileNotFoundError:
+            print("[REAUTH] Error: notebooklm-mcp-auth no encontrado en PATH")
+            return "command_not_found"
+        except Exception as e:
+            print(f"[REAUTH] Error inesperado: {e}")
+            return "error"
+
+    def _run_auth_cli_blocking(self, stdin_data: bytes) -> str:
+        try:
+            result = subprocess.run(
+                self.command, input=stdin_data, capture_output=True, timeout=self.timeout
+            )
+        except subprocess.TimeoutExpired:
+            print("[REAUTH] Timeout - la re-autenticacion tardo demasiado")
+            return "timeout"
+        return self._check_result(result.returncode, result.stdout, result.stderr)
+
+    @staticmethod
+    def _check_result(returncode: int, stdout: bytes, stderr: bytes) -> str:
+        out = (stdout or b"").decode("utf-8", "replace")
+        err = (stderr or b"").decode("utf-8", "replace")
+        if returncode == 0:
+            print("[REAUTH] Re-autenticacion exitosa!")
+            print(f"[REAUTH] Output: {out[:300] if out else 'OK'}")
+            return "success"
+        print(f"[REAUTH] Fallo con codigo {returncode}")
+        print(f"[REAUTH] STDOUT: {out[:500] if out else 'Vacio'}")
+        print(f"[REAUTH] STDERR: {err[:500] if err else 'Vacio'}")
+        return "exit_code"
+
+    def stats(self) -> dict:
+        return {
+            "in_progress": self.in_progress,
+            "runs": self.runs,
+            "outcomes": dict(self.outcomes),
+            "parked_requests": self.parked,
+            "skipped_already_refreshed": self.skipped,
+            "waited_other_worker": self.waited_other_worker,
+            "last_outcome": self.last_outcome,
+            "last_run_at": self.last_run_at,
+            "last_success_at": self.last_success_at,
+            "last_duration_s": round(self.last_duration, 3) if self.last_duration is not None else None,
+            "avg_duration_s": round(self.total_duration / self.runs, 3) if self.runs else None,
+            "max_duration_s": round(self.max_duration, 3),
+            "cooldown_s": self.cooldown,
+        }
+
+
+class CredentialMonitor:
+    """
+    Tarea en segundo plano que sondea NotebookLM con una llamada barata
+    (list_notebooks) y renueva las credenciales antes de que caduquen, para
+    que las peticiones de los usuarios no esperen a la re-autenticación.
+    """
+
+    def __init__(
+        self,
+        store: CredentialStore,
+        coordinator: ReauthCoordinator,
+        interval: float = CREDENTIAL_PROBE_INTERVAL,
+        max_age_hours: float = CREDENTIAL_MAX_AGE_HOURS,
+        run_probe=None,
+        shared=None,
+    ):
+        self.store = store
+        self.coordinator = coordinator
+        self.interval = interval
+        self.max_age_hours = max_age_hours
+        self.run_probe = run_probe
+        # SharedState opcional: con varios workers solo uno sondea cada intervalo
+        self.shared = shared
+        self._task: Optional[asyncio.Task] = None
+
+        self.probes = 0
+        self.skipped_other_worker = 0
+        self.results: dict[str, int] = {}
+        self.consecutive_failures = 0
+        self.proactive_reauths = 0
+        self.last_probe_at: Optional[float] = None
+        self.last_result: Optional[str] = None
+        self.last_latency: Optional[float] = None
+        self.last_error: Optional[str] = None
+        self.last_token_age: Optional[float] = None
+
+    def token_age_hours(self) -> Optional[float]:
+        """
+        Antigüedad de las cookies según `extracted_at` de auth.json (o desde la
+        última re-autenticación correcta, si es más reciente). None si las
+        credenciales vienen de la variable de entorno.
+        """
+        if self.store.source != "file":
+            return None
+        extracted_at = 0.0
+        try:
+            with open(self.store.auth_file, "r") as f:
+                extracted_at = float(json.load(f).get("extracted_at") or 0)
+        except Exception:
+            pass
+        if self.coordinator.last_success_at:
+            extracted_at = max(extracted_at, self.coordinator.last_success_at)
+        if not extracted_at:
+            return None
+        return (time.time() - extracted_at) / 3600
+
+    async def probe_once(self, run_probe=None) -> str:
+        """
+        Ejecuta un sondeo. `run_probe(fn)` permite ejecutar la llamada en un
+        ejecutor concreto; por defecto se usa el del constructor o, si no hay,
+        asyncio.to_thread.
+        """
+        run_probe = run_probe or self.run_probe
+        self.probes += 1
+        self.last_probe_at = time.time()
+        client = await self.store.get_client_async()
+        if client is None:
+            result = "no_client"
+        else:
+            generation = self.store.generation
+            started = time.monotonic()
+            try:
+                if run_probe is not None:
+                    await run_probe(client.list_notebooks)
+                else:
+                    await asyncio.to_thread(client.list_notebooks)
+                result = "ok"
+                self.last_error = None
+            except Exception as e:
+                self.last_error = f"{type(e).__name__}: {e}"
+                if is_auth_failure(e):
+                    result = "auth_failure"
+                elif hasattr(e, "retry_after"):
+                    result = "busy"  # Ejecutor saturado: no dice nada de las credenciales
+                else:
+                    result = "error"
+            self.last_latency = time.monotonic() - started
+
+            age = await asyncio.to_thread(self.token_age_hours)
+            self.last_token_age = age
+            if result == "auth_failure":
+                print(f"[PROBE] Credenciales caducadas detectadas por el sondeo ({self.store.name}), renovando...")
+                await self.coordinator.reauth(generation)
+            elif result == "ok" and age is not None and age >= self.max_age_hours:
+                print(f"[PROBE] Cookies de {self.store.name} con {age:.1f}h de antiguedad, renovacion preventiva...")
+                self.proactive_reauths += 1
+                await self.coordinator.reauth(generation)
+
+        self.results[result] = self.results.get(result, 0) + 1
+        self.last_result = result
+        if result == "ok":
+            self.consecutive_failures = 0
+        elif result != "busy":
+            self.consecutive_failures += 1
+        return result
+
+    async def _should_probe(self) -> bool:
+        if self.shared is None:
+            return True
+        acquired = await asyncio.to_thread(
+            self.shared.try_acquire, f"probe:{self.store.name}", self.interval * 0.9
+        )
+        if not acquired:
+            self.skipped_other_worker += 1
+        return acquired
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                if await self._should_probe():
+                    await self.probe_once()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"[PROBE] Error inesperado en el sondeo: {e}")
+            await asyncio.sleep(self.interval)
+
+    def start(self) -> None:
+        if self.interval > 0 and (self._task is None or self._task.done()):
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def stats(self) -> dict:
+        age = self.last_token_age
+        return {
+            "enabled": self.interval > 0,
+            "interval_s": self.interval,
+            "max_age_hours": self.max_age_hours,
+            "probes": self.probes,
+            "skipped_other_worker": self.skipped_other_worker,
+            "results": dict(self.results),
+            "last_probe_at": self.last_probe_at,
+            "last_result": self.last_result,
+            "last_latency_s": round(self.last_latency, 3) if self.last_latency is not None else None,
+            "last_error": self.last_error,
+            "consecutive_failures": self.consecutive_failures,
+            "proactive_reauths": self.proactive_reauths,
+            "token_age_hours": round(age, 2) if age is not None else None,
+        }
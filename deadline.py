@@ -0,0 +1,66 @@
+"""
+Plazo total de una consulta
+`QueryRequest.timeout` es el tiempo que tiene la petición completa: la espera
+en cola, cada intento contra NotebookLM, la recarga de credenciales y la
+re-autenticación descuentan del mismo presupuesto. Un intento que ya no
+puede terminar a tiempo no se lanza; la petición acaba con 504 e indica el
+tiempo que quedaba.
+"""
+import os
+import time
+from typing import Optional
+
+
+# ============================================================================
+# Configuración
+# ============================================================================
+
+# Segundos mínimos que debe tener por delante un intento contra NotebookLM
+QUERY_MIN_ATTEMPT_SECONDS = float(os.environ.get("QUERY_MIN_ATTEMPT_SECONDS", "10"))
+# Plazo si la petición no indica timeout, y máximo aceptado
+QUERY_DEFAULT_DEADLINE = float(os.environ.get("QUERY_DEFAULT_DEADLINE", "120"))
+QUERY_MAX_DEADLINE = float(os.environ.get("QUERY_MAX_DEADLINE", "300"))
+
+
+class DeadlineExceeded(Exception):
+    """No queda tiempo para la siguiente fase de la consulta"""
+
+    def __init__(self, phase: str, budget: float, remaining: float):
+        super().__init__(
+            f"Plazo de la consulta agotado antes de {phase}: quedaban {max(remaining, 0):.2f}s de {budget:g}s"
+        )
+        self.phase = phase
+        self.budget = budget
+        self.remaining = max(remaining, 0.0)
+
+
+class Deadline:
+    def __init__(self, budget: float, min_attempt: float = QUERY_MIN_ATTEMPT_SECONDS):
+        self.budget = budget
+        # Con plazos cortos el mínimo no puede dejar sin tiempo al primer intento
+        self.min_attempt = min(min_attempt, budget / 2)
+        self.started = time.monotonic()
+        self.expires_at = self.started + budget
+
+    @classmethod
+    def for_timeout(cls, timeout: Optional[float]) -> "Deadline":
+        budget = QUERY_DEFAULT_DEADLINE if not timeout or timeout <= 0 else float(timeout)
+        return cls(min(budget, QUERY_MAX_DEADLINE))
+
+    def remaining(self) -> float:
+        return max(self.expires_at - time.monotonic(), 0.0)
+
+    def elapsed(self) -> float:
+        return time.monotonic() - self.started
+
+    def require(self, phase: str, needed: Optional[float] = None) -> float:
+        """Segundos restantes, o DeadlineExceeded si no llegan a `needed`"""
+        remaining = self.remaining()
+        needed = self.min_attempt if needed is None else needed
+        if remaining < needed or remaining <= 0:
+            raise DeadlineExceeded(phase, self.budget, remaining)
+        return remaining
+
+    def queue_wait(self, max_wait: float) -> float:
+        """Espera en cola que aún deja tiempo para un intento"""
+        return max(min(max_wait, self.remaining() - self.min_attempt), 0.0)
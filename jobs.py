@@ -0,0 +1,178 @@
+"""
+Trabajos asíncronos (consultas largas)
+El túnel de Cloudflare y los proxies cortan las peticiones que pasan ~100 s
+abiertas, y una consulta a NotebookLM puede tardar más. Con POST /jobs la
+consulta se lanza en segundo plano y se devuelve su id al momento; el
+cliente pregunta por el resultado con GET /jobs/{id}, que puede esperar unos
+segundos (long-poll) sin acercarse al límite del proxy.
+
+Los trabajos viven en el estado compartido (cualquier worker puede responder
+al sondeo) y caducan JOBS_TTL segundos después de terminar. Cada worker
+limita los trabajos en curso que lanza.
+"""
+import os
+import time
+import uuid
+import asyncio
+from typing import Awaitable, Callable, Optional
+
+from shared_state import SharedState
+from upstream import UpstreamBusy
+
+
+# ============================================================================
+# Configuración
+# ============================================================================
+
+# Segundos que se conserva el resultado de un trabajo terminado
+JOBS_TTL = float(os.environ.get("JOBS_TTL", "900"))
+# Trabajos en curso por worker; por encima se responde 429
+JOBS_MAX_RUNNING = int(os.environ.get("JOBS_MAX_RUNNING", "64"))
+# Espera máxima de un long-poll (muy por debajo de los ~100 s del túnel)
+JOBS_MAX_WAIT = float(os.environ.get("JOBS_MAX_WAIT", "25"))
+# Intervalo de sondeo del estado compartido si el trabajo corre en otro worker
+JOBS_POLL_INTERVAL = float(os.environ.get("JOBS_POLL_INTERVAL", "0.5"))
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+FINISHED = (DONE, FAILED)
+
+
+class JobStore:
+    """
+    Trabajo = {id, status, kind, created_at, updated_at, result, error,
+    status_code}. Mientras corre, su clave caduca después del plazo de la
+    consulta más JOBS_TTL: si el worker muere, el trabajo desaparece en vez
+    de quedarse "running" para siempre.
+    """
+
+    def __init__(
+        self,
+        shared: SharedState,
+        ttl: float = JOBS_TTL,
+        max_running: int = JOBS_MAX_RUNNING,
+        max_wait: float = JOBS_MAX_WAIT,
+        poll_interval: float = JOBS_POLL_INTERVAL,
+    ):
+        self.shared = shared
+        self.ttl = ttl
+        self.max_running = max_running
+        self.max_wait = max_wait
+        self.poll_interval = poll_interval
+        # Trabajos lanzados por este worker: id -> (tarea, evento de fin)
+        self._running: dict[str, tuple[asyncio.Task, asyncio.Event]] = {}
+
+        self.submitted = 0
+        self.completed = 0
+        self.failed = 0
+        self.rejected = 0
+
+    @staticmethod
+    def _key(job_id: str) -> str:
+        return f"job:{job_id}"
+
+    async def _save(self, job: dict, ttl: float) -> None:
+        job["updated_at"] = time.time()
+        await asyncio.to_thread(self.shared.set, self._key(job["id"]), job, ttl)
+
+    async def get(self, job_id: str) -> Optional[dict]:
+        return await asyncio.to_thread(self.shared.get, self._key(job_id))
+
+    async def submit(
+        self, kind: str, run: Callable[[str], Awaitable[dict]], budget: float, **fields
+    ) -> dict:
+        """
+        Registra el trabajo y lanza `run(job_id)` en segundo plano. `run`
+        devuelve el resultado; si lanza una excepción con status_code/detail
+        (como HTTPException o UpstreamBusy) se guardan como error del trabajo.
+        `budget` es el plazo de la consulta en segundos.
+        """
+        if len(self._running) >= self.max_running:
+            self.rejected += 1
+            raise UpstreamBusy("Demasiados trabajos en curso", 5)
+
+        now = time.time()
+        job = {
+            "id": uuid.uuid4().hex,
+            "status": QUEUED,
+            "kind": kind,
+            "created_at": now,
+            "updated_at": now,
+            "result": None,
+            "error": None,
+            "status_code": None,
+            **fields,
+        }
+        running_ttl = budget + self.ttl
+        await self._save(job, running_ttl)
+        self.submitted += 1
+
+        done = asyncio.Event()
+
+        async def execute() -> None:
+            try:
+                job["status"] = RUNNING
+                await self._save(job, running_ttl)
+                try:
+                    job["result"] = await run(job["id"])
+                    job["status"] = DONE
+                    self.completed += 1
+                except asyncio.CancelledError:
+                    # Servidor cerrándose: el cliente puede volver a enviarlo
+                    job.update(status=FAILED, status_code=503, error="Trabajo interrumpido al cerrar el servidor")
+                    self.failed += 1
+                    await self._save(job, self.ttl)
+                    raise
+                except Exception as e:
+                    job["status"] = FAILED
+                    job["status_code"] = getattr(e, "status_code", 500)
+                    job["error"] = str(getattr(e, "detail", None) or e)
+                    self.failed += 1
+                    print(f"[JOBS] Trabajo {job['id'][:8]} fallido: {job['error'][:100]}")
+                await self._save(job, self.ttl)
+            finally:
+                self._running.pop(job["id"], None)
+                done.set()
+
+        self._running[job["id"]] = (asyncio.create_task(execute()), done)
+        return dict(job)
+
+    async def wait(self, job_id: str, timeout: float) -> Optional[dict]:
+        """Estado del trabajo, esperando como mucho `timeout` s a que termine"""
+        timeout = min(max(timeout, 0), self.max_wait)
+        local = self._running.get(job_id)
+        if local is not None and timeout > 0:
+            try:
+                await asyncio.wait_for(local[1].wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+            return await self.get(job_id)
+
+        # Trabajo de otro worker (o ya terminado): sondeo del estado compartido
+        deadline = time.monotonic() + timeout
+        while True:
+            job = await self.get(job_id)
+            if job is None or job["status"] in FINISHED or time.monotonic() >= deadline:
+                return job
+            await asyncio.sleep(min(self.poll_interval, max(deadline - time.monotonic(), 0)))
+
+    async def stop(self) -> None:
+        """Cancela los trabajos en curso de este worker (al apagar)"""
+        tasks = [task for task, _ in self._running.values()]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    def stats(self) -> dict:
+        return {
+            "running": len(self._running),
+            "max_running": self.max_running,
+            "ttl_s": self.ttl,
+            "max_wait_s": self.max_wait,
+            "submitted": self.submitted,
+            "completed": self.completed,
+            "failed": self.failed,
+            "rejected": self.rejected,
+        }
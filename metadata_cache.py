@@ -0,0 +1,164 @@
+"""
+Caché stale-while-revalidate para los metadatos de los cuadernos
+Las listas de cuadernos y fuentes casi nunca cambian: se sirven desde memoria
+y, cuando una entrada caduca, se devuelve igualmente mientras se refresca en
+segundo plano. Si el refresco falla se sigue sirviendo el último valor bueno
+y no se vuelve a intentar hasta pasada una espera que se dobla con cada
+fallo (hasta el TTL): con NotebookLM caído la caché no lo sigue llamando.
+"""
+import os
+import time
+import asyncio
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Optional
+
+from singleflight import SingleFlight
+
+
+# ============================================================================
+# Configuración
+# ============================================================================
+
+# Segundos durante los que una entrada se considera fresca
+METADATA_CACHE_TTL = float(os.environ.get("METADATA_CACHE_TTL", "300"))
+METADATA_CACHE_MAX_ENTRIES = int(os.environ.get("METADATA_CACHE_MAX_ENTRIES", "512"))
+# Espera tras el primer refresco fallido; se dobla en cada fallo, hasta el TTL
+METADATA_CACHE_RETRY_BASE = float(os.environ.get("METADATA_CACHE_RETRY_BASE", "5"))
+
+
+class _Entry:
+    __slots__ = ("value", "fetched_at", "last_error", "failures", "retry_at")
+
+    def __init__(self, value: Any):
+        self.value = value
+        self.fetched_at = time.time()
+        self.last_error: Optional[str] = None
+        self.failures = 0           # Refrescos fallidos seguidos
+        self.retry_at = 0.0         # No refrescar antes de este instante
+
+
+class MetadataCache:
+    """
+    get() devuelve (valor, estado, antigüedad_en_segundos). Estados:
+      HIT    entrada fresca
+      MISS   no había entrada: se esperó a NotebookLM
+      STALE  entrada caducada; se está refrescando en segundo plano
+      ERROR  entrada caducada y el último refresco falló (último valor bueno);
+             el siguiente intento espera retry_base·2^(fallos-1) s, hasta el TTL
+    Los refrescos de una misma clave se coalescen. `on_change(key, old, new)`
+    se llama cuando un refresco trae un valor distinto del anterior.
+    """
+
+    def __init__(
+        self,
+        ttl: float = METADATA_CACHE_TTL,
+        max_entries: int = METADATA_CACHE_MAX_ENTRIES,
+        retry_base: float = METADATA_CACHE_RETRY_BASE,
+        on_change: Optional[Callable[[str, Any, Any], Awaitable[None]]] = None,
+    ):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.retry_base = retry_base
+        self.on_change = on_change
+        self._entries: OrderedDict[str, _Entry] = OrderedDict()
+        self._flights = SingleFlight("metadata")
+        self._background: set[asyncio.Task] = set()
+        self._refreshing: set[str] = set()
+
+        self.hits = 0
+        self.misses = 0
+        self.stale_served = 0
+        self.refreshes = 0
+        self.refresh_errors = 0
+        self.refreshes_backed_off = 0  # Refrescos omitidos por la espera tras un fallo
+        self.changes = 0
+
+    async def get(self, key: str, fetch: Callable[[], Awaitable[Any]]) -> tuple[Any, str, float]:
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            value, _ = await self._flights.do(key, lambda: self._fetch(key, fetch))
+            return value, "MISS", 0.0
+
+        self._entries.move_to_end(key)
+        age = time.time() - entry.fetched_at
+        if age < self.ttl:
+            self.hits += 1
+            return entry.value, "HIT", age
+
+        self.stale_served += 1
+        self.refresh_in_background(key, fetch)
+        return entry.value, "ERROR" if entry.last_error else "STALE", age
+
+    def refresh_in_background(self, key: str, fetch: Callable[[], Awaitable[Any]]) -> None:
+        """
+        Lanza el refresco de la clave sin esperarlo (uno a la vez por clave y
+        ninguno mientras dure la espera tras un refresco fallido)
+        """
+        if key in self._refreshing:
+            return
+        entry = self._entries.get(key)
+        if entry is not None and time.time() < entry.retry_at:
+            self.refreshes_backed_off += 1
+            return
+        self._refreshing.add(key)
+
+        async def refresh():
+            try:
+                await self._flights.do(key, lambda: self._fetch(key, fetch))
+            except Exception as e:
+                entry = self._entries.get(key)
+                delay = 0.0
+                if entry is not None:
+                    entry.last_error = f"{type(e).__name__}: {e}"
+                    entry.failures += 1
+                    delay = min(self.retry_base * 2 ** (entry.failures - 1), self.ttl)
+                    entry.retry_at = time.time() + delay
+                print(f"[META] Error refrescando {key}, se mantiene el ultimo valor (reintento en {delay:.0f}s): {e}")
+            finally:
+                self._refreshing.discard(key)
+
+        task = asyncio.create_task(refresh())
+        self._background.add(task)
+        task.add_done_callback(self._background.discard)
+
+    async def _fetch(self, key: str, fetch: Callable[[], Awaitable[Any]]) -> Any:
+        self.refreshes += 1
+        try:
+            value = await fetch()
+        except Exception:
+            self.refresh_errors += 1
+            raise
+        previous = self._entries.get(key)
+        self._entries[key] = _Entry(value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+        if previous is not None and previous.value != value:
+            self.changes += 1
+            if self.on_change is not None:
+                try:
+                    await self.on_change(key, previous.value, value)
+                except Exception as e:
+                    print(f"[META] Error en on_change({key}): {e}")
+        return value
+
+    def invalidate(self, key: Optional[str] = None) -> None:
+        if key is None:
+            self._entries.clear()
+        else:
+            self._entries.pop(key, None)
+
+    def stats(self) -> dict:
+        return {
+            "ttl": self.ttl,
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "stale_served": self.stale_served,
+            "refreshes": self.refreshes,
+            "refresh_errors": self.refresh_errors,
+            "refreshes_backed_off": self.refreshes_backed_off,
+            "changes": self.changes,
+            "refreshing": len(self._refreshing),
+        }
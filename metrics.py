@@ -0,0 +1,140 @@
+"""
+Métricas en formato de texto de Prometheus
+Contadores e histogramas mínimos sin dependencias externas. Se actualizan
+desde el event loop (sin locks) y solo se formatean cuando se pide /metrics.
+"""
+import math
+from bisect import bisect_left
+from typing import Callable, Union
+
+
+# Límites por defecto (segundos) de los histogramas de latencia
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120)
+# Límites (caracteres) del histograma de tamaño de respuesta
+SIZE_BUCKETS = (100, 250, 500, 1000, 2000, 4000, 8000, 16000, 32000)
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+def _labels(names: tuple, values: tuple, extra: str = "") -> str:
+    parts = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _number(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class Counter:
+    def __init__(self, name: str, help: str, labelnames: tuple = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self._values: dict[tuple, float] = {}
+
+    def inc(self, *labelvalues: str, amount: float = 1) -> None:
+        self._values[labelvalues] = self._values.get(labelvalues, 0) + amount
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        for values, total in sorted(self._values.items()):
+            lines.append(f"{self.name}{_labels(self.labelnames, values)} {_number(total)}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name: str, help: str, buckets: tuple = LATENCY_BUCKETS, labelnames: tuple = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self.buckets = tuple(sorted(buckets))
+        # labelvalues -> [cuentas por bucket (no acumuladas) + overflow, suma, total]
+        self._series: dict[tuple, list] = {}
+
+    def observe(self, value: float, *labelvalues: str) -> None:
+        series = self._series.get(labelvalues)
+        if series is None:
+            series = self._series[labelvalues] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+        series[0][bisect_left(self.buckets, value)] += 1
+        series[1] += value
+        series[2] += 1
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for values, (counts, total, count) in sorted(self._series.items()):
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (math.inf,), counts):
+                cumulative += bucket_count
+                le = _labels(self.labelnames, values, f'le="{_number(bound)}"')
+                lines.append(f"{self.name}_bucket{le} {cumulative}")
+            labels = _labels(self.labelnames, values)
+            lines.append(f"{self.name}_sum{labels} {_number(round(total, 6))}")
+            lines.append(f"{self.name}_count{labels} {count}")
+        return lines
+
+
+class CallbackMetric:
+    """
+    Valor leído en el momento del scrape. `fn` devuelve un número o un dict
+    {valores_de_etiquetas: número}.
+    """
+
+    def __init__(self, name: str, help: str, fn: Callable[[], Union[float, dict]],
+                 kind: str = "gauge", labelnames: tuple = ()):
+        self.name = name
+        self.help = help
+        self.fn = fn
+        self.kind = kind
+        self.labelnames = labelnames
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        try:
+            value = self.fn()
+        except Exception:
+            return []
+        if isinstance(value, dict):
+            for values, number in sorted(value.items()):
+                if not isinstance(values, tuple):
+                    values = (values,)
+                lines.append(f"{self.name}{_labels(self.labelnames, values)} {_number(number)}")
+        elif value is not None:
+            lines.append(f"{self.name} {_number(value)}")
+        return lines
+
+
+class Registry:
+    def __init__(self, prefix: str = ""):
+        self.prefix = prefix
+        self._metrics: list = []
+
+    def counter(self, name: str, help: str, labelnames: tuple = ()) -> Counter:
+        metric = Counter(self.prefix + name, help, labelnames)
+        self._metrics.append(metric)
+        return metric
+
+    def histogram(self, name: str, help: str, buckets: tuple = LATENCY_BUCKETS,
+                  labelnames: tuple = ()) -> Histogram:
+        metric = Histogram(self.prefix + name, help, buckets, labelnames)
+        self._metrics.append(metric)
+        return metric
+
+    def callback(self, name: str, help: str, fn: Callable, kind: str = "gauge",
+                 labelnames: tuple = ()) -> CallbackMetric:
+        metric = CallbackMetric(self.prefix + name, help, fn, kind, labelnames)
+        self._metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        lines: list[str] = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
@@ -0,0 +1,31 @@
+"""
+Cuaderno, instrucciones del sistema y preguntas sugeridas del chat
+Los usa app.py y también el servidor, que precalienta la caché de respuestas
+con estas mismas preguntas: la clave de la caché incluye las instrucciones,
+así que deben ser exactamente las que envía el chat.
+"""
+
+# ID del cuaderno (Actualizado para el nuevo contexto si es necesario,
+# por ahora mantenemos el ID pero el usuario indicó que el contenido cambió)
+NOTEBOOK_ID = "0523ea1e-7973-400a-a749-55a805205030"
+
+# Instrucciones del sistema para NotebookLM
+SYSTEM_INSTRUCTIONS = """
+INSTRUCCIONES OBLIGATORIAS:
+- Responde SIEMPRE en castellano (espanol de Espana).
+- Basate UNICAMENTE en la informacion contenida en las fuentes del notebook.
+- NO inventes, supongas ni extrapoles informacion que no este en las fuentes.
+- Si no dispones de la informacion solicitada, responde claramente: "No dispongo de esa informacion en las fuentes disponibles."
+- Cita las fuentes cuando sea posible.
+
+CONSULTA DEL USUARIO:
+"""
+
+# Preguntas de ejemplo de la barra lateral (las más frecuentes)
+SUGGESTED_QUESTIONS = [
+    "¿Cuál es el gasto total en políticas sociales?",
+    "Resume la inversión prevista para Prodetur.",
+    "¿Cuánto aumenta el presupuesto respecto a 2025?",
+    "¿Cuáles son las mayores partidas de subvenciones?",
+    "Desglosa el presupuesto por capítulos.",
+]
@@ -0,0 +1,225 @@
+"""
+Límite de peticiones por cliente
+La API es accesible desde internet a través del túnel: sin límites, un solo
+cliente (o un scraper) puede acaparar la capacidad hacia NotebookLM de la que
+depende toda la Diputación. Cada cliente tiene un token bucket en memoria
+(coste O(1) por petición); los buckets inactivos se descartan, así que la
+memoria queda acotada aunque lleguen muchas IPs distintas.
+
+El cliente es la API key (si está en RATE_LIMIT_API_KEYS) o la IP de origen.
+Detrás del túnel de Cloudflare o de un proxy la IP real llega en
+X-Forwarded-For / CF-Connecting-IP; esas cabeceras solo se creen si la
+conexión viene de un proxy de RATE_LIMIT_TRUSTED_PROXIES (por defecto solo
+la propia máquina, donde corre cloudflared).
+
+Desactivado por defecto: todos los usuarios del chat en Streamlit Cloud
+llegan desde la misma IP, así que antes de activarlo hay que dar al
+frontend una API_KEY incluida en RATE_LIMIT_API_KEYS. Los buckets son de
+cada worker: con N workers un cliente puede hacer hasta N veces su cupo.
+"""
+import os
+import time
+import hashlib
+import ipaddress
+from collections import OrderedDict
+from contextvars import ContextVar
+from typing import Optional
+
+
+# ============================================================================
+# Configuración
+# ============================================================================
+
+RATE_LIMIT_ENABLED = os.environ.get("RATE_LIMIT_ENABLED", "0") != "0"
+# Peticiones por segundo que recupera cada cliente y ráfaga máxima
+RATE_LIMIT_RATE = float(os.environ.get("RATE_LIMIT_RATE", "0.5"))
+RATE_LIMIT_BURST = float(os.environ.get("RATE_LIMIT_BURST", "10"))
+# Claves conocidas (separadas por comas) y cuánto más pueden pedir que una IP
+RATE_LIMIT_API_KEYS = [k.strip() for k in os.environ.get("RATE_LIMIT_API_KEYS", "").split(",") if k.strip()]
+RATE_LIMIT_KEY_MULTIPLIER = float(os.environ.get("RATE_LIMIT_KEY_MULTIPLIER", "10"))
+# Memoria: máximo de buckets y segundos sin uso tras los que se descartan
+RATE_LIMIT_MAX_CLIENTS = int(os.environ.get("RATE_LIMIT_MAX_CLIENTS", "10000"))
+RATE_LIMIT_IDLE_SECONDS = float(os.environ.get("RATE_LIMIT_IDLE_SECONDS", "600"))
+# Proxies (IPs o redes, separadas por comas) cuyas cabeceras de reenvío se creen
+RATE_LIMIT_TRUSTED_PROXIES = os.environ.get("RATE_LIMIT_TRUSTED_PROXIES", "127.0.0.1/8,::1")
+
+# Cliente de la petición en curso: el ejecutor lo usa para repartir la cola
+current_client: ContextVar[Optional[str]] = ContextVar("current_client", default=None)
+
+
+class RateLimited(Exception):
+    """El cliente ha agotado su cupo"""
+
+    def __init__(self, client: str, retry_after: float):
+        super().__init__(f"Demasiadas peticiones; vuelve a intentarlo en {retry_after:g}s")
+        self.client = client
+        self.retry_after = retry_after
+
+
+def _address(address: str):
+    try:
+        return ipaddress.ip_address(address)
+    except ValueError:
+        return None
+
+
+def parse_networks(spec: str) -> list:
+    """Lista "10.0.0.1,172.16.0.0/12,::1" a redes de ipaddress (ignora las no válidas)"""
+    networks = []
+    for item in spec.split(","):
+        item = item.strip()
+        if not item:
+            continue
+        try:
+            networks.append(ipaddress.ip_network(item, strict=False))
+        except ValueError:
+            print(f"[LIMIT] Proxy de confianza no valido ignorado: {item}")
+    return networks
+
+
+def client_address(peer: Optional[str], headers, trusted: list) -> tuple[str, bool]:
+    """
+    IP del cliente y si la conexión viene de la propia máquina sin proxy
+    delante (el frontend o una tarea local), que no se limita.
+
+    X-Forwarded-For se recorre de derecha a izquierda saltando los proxies de
+    confianza: la primera dirección que no lo es la ha añadido un proxy
+    nuestro. Lo que haya más a la izquierda lo pudo escribir el cliente.
+    """
+    def is_trusted(address: str) -> bool:
+        ip = _address(address)
+        return ip is not None and any(ip in network for network in trusted)
+
+    peer = peer or "unknown"
+    if not is_trusted(peer):
+        return peer, False
+    hops = [hop.strip() for hop in headers.get("x-forwarded-for", "").split(",") if hop.strip()]
+    if not hops and headers.get("cf-connecting-ip"):
+        hops = [headers["cf-connecting-ip"].strip()]
+    for hop in reversed(hops):
+        if not is_trusted(hop):
+            return hop, False
+    # Sin cabeceras (o solo proxies nuestros): la conexión es local
+    origin = hops[0] if hops else peer
+    ip = _address(origin)
+    return origin, ip is not None and ip.is_loopback
+
+
+class _Bucket:
+    __slots__ = ("tokens", "updated_at", "capacity", "rate", "requests", "rejected")
+
+    def __init__(self, capacity: float, rate: float, now: float):
+        self.tokens = capacity
+        self.updated_at = now
+        self.capacity = capacity
+        self.rate = rate
+        self.requests = 0
+        self.rejected = 0
+
+
+class RateLimiter:
+    """
+    Token buckets por cliente en un OrderedDict ordenado por último uso: la
+    petición mueve su bucket al final y los inactivos se descartan desde el
+    principio. Un bucket que lleva más de capacity/rate segundos sin uso ya
+    estaría lleno, así que descartarlo no cambia nada.
+    """
+
+    def __init__(
+        self,
+        rate: float = RATE_LIMIT_RATE,
+        burst: float = RATE_LIMIT_BURST,
+        api_keys: Optional[list[str]] = None,
+        key_multiplier: float = RATE_LIMIT_KEY_MULTIPLIER,
+        max_clients: int = RATE_LIMIT_MAX_CLIENTS,
+        idle_seconds: float = RATE_LIMIT_IDLE_SECONDS,
+        enabled: bool = RATE_LIMIT_ENABLED,
+        trusted_proxies: str = RATE_LIMIT_TRUSTED_PROXIES,
+    ):
+        self.rate = rate
+        self.burst = burst
+        self.key_multiplier = key_multiplier
+        self.max_clients = max_clients
+        self.idle_seconds = max(idle_seconds, burst * key_multiplier / rate if rate > 0 else 0)
+        self.enabled = enabled and rate > 0
+        self.trusted_proxies = parse_networks(trusted_proxies)
+        # Las claves se guardan resumidas: no aparecen en /stats ni en los logs
+        self._keys = {self._digest(key) for key in (RATE_LIMIT_API_KEYS if api_keys is None else api_keys)}
+        self._buckets: OrderedDict[str, _Bucket] = OrderedDict()
+
+        # Métricas
+        self.allowed = 0
+        self.rejected = 0
+        self.evicted = 0
+
+    @staticmethod
+    def _digest(api_key: str) -> str:
+        return hashlib.sha256(api_key.encode()).hexdigest()[:12]
+
+    def identify(self, peer: Optional[str], headers, api_key: Optional[str] = None) -> Optional[str]:
+        """Identificador del cliente, o None si no se limita (conexión local directa)"""
+        if api_key:
+            digest = self._digest(api_key)
+            if digest in self._keys:
+                return f"key:{digest}"
+        address, local = client_address(peer, headers, self.trusted_proxies)
+        return None if local else f"ip:{address}"
+
+    def _evict(self, now: float) -> None:
+        while self._buckets:
+            client, bucket = next(iter(self._buckets.items()))
+            if len(self._buckets) <= self.max_clients and now - bucket.updated_at < self.idle_seconds:
+                break
+            del self._buckets[client]
+            self.evicted += 1
+
+    def take(self, client: str, cost: float = 1) -> float:
+        """Consume `cost` fichas; 0 si se admite, si no los segundos hasta poder hacerlo"""
+        if not self.enabled:
+            return 0.0
+        now = time.monotonic()
+        bucket = self._buckets.get(client)
+        if bucket is None:
+            multiplier = self.key_multiplier if client.startswith("key:") else 1
+            bucket = self._buckets[client] = _Bucket(self.burst * multiplier, self.rate * multiplier, now)
+        else:
+            bucket.tokens = min(bucket.capacity, bucket.tokens + (now - bucket.updated_at) * bucket.rate)
+            bucket.updated_at = now
+            self._buckets.move_to_end(client)
+        self._evict(now)
+
+        bucket.requests += 1
+        cost = min(cost, bucket.capacity)
+        if bucket.tokens >= cost:
+            bucket.tokens -= cost
+            self.allowed += 1
+            return 0.0
+        bucket.rejected += 1
+        self.rejected += 1
+        return (cost - bucket.tokens) / bucket.rate
+
+    def client_count(self) -> int:
+        """Clientes con bucket en memoria (tras descartar los inactivos)"""
+        self._evict(time.monotonic())
+        return len(self._buckets)
+
+    def stats(self, top: int = 10) -> dict:
+        self._evict(time.monotonic())
+        busiest = sorted(self._buckets.items(), key=lambda item: item[1].requests, reverse=True)[:top]
+        return {
+            "enabled": self.enabled,
+            "rate_per_s": self.rate,
+            "burst": self.burst,
+            "api_keys": len(self._keys),
+            "trusted_proxies": [str(network) for network in self.trusted_proxies],
+            "clients": len(self._buckets),
+            "max_clients": self.max_clients,
+            "idle_eviction_s": round(self.idle_seconds, 1),
+            "allowed": self.allowed,
+            "rejected": self.rejected,
+            "evicted": self.evicted,
+            "busiest": {
+                client: {"requests": b.requests, "rejected": b.rejected, "tokens": round(b.tokens, 2)}
+                for client, b in busiest
+            },
+        }
@@ -0,0 +1,263 @@
+"""
+Registro estructurado de peticiones
+Las peticiones encolan registros JSONL en memoria y un hilo en segundo plano
+los escribe en disco, con rotación por tamaño y por tiempo. El event loop
+nunca hace E/S de ficheros.
+
+Con varios workers todos escriben en el mismo archivo: cada línea va en una
+sola escritura en modo append (no se mezclan a medias), solo rota quien tiene
+el lease compartido y los demás, al ver que el archivo ya no es el suyo,
+vuelven a abrirlo.
+"""
+import os
+import json
+import time
+import uuid
+import queue
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Optional
+
+from shared_state import SharedState
+
+
+# ============================================================================
+# Configuración
+# ============================================================================
+
+REQUEST_LOG_ENABLED = os.environ.get("REQUEST_LOG_ENABLED", "1") != "0"
+REQUEST_LOG_PATH = os.environ.get(
+    "REQUEST_LOG_PATH", str(Path(__file__).parent / "request_log.jsonl")
+)
+REQUEST_LOG_MAX_BYTES = int(os.environ.get("REQUEST_LOG_MAX_BYTES", str(10 * 1024 * 1024)))
+REQUEST_LOG_ROTATE_SECONDS = float(os.environ.get("REQUEST_LOG_ROTATE_SECONDS", "86400"))
+REQUEST_LOG_BACKUPS = int(os.environ.get("REQUEST_LOG_BACKUPS", "5"))
+# Caracteres máximos de cada campo de texto (pregunta, respuesta, resultado bruto); 0 = omitir
+REQUEST_LOG_MAX_PAYLOAD = int(os.environ.get("REQUEST_LOG_MAX_PAYLOAD", "500"))
+REQUEST_LOG_QUEUE_SIZE = int(os.environ.get("REQUEST_LOG_QUEUE_SIZE", "10000"))
+
+# Lease compartido de la rotación (segundos)
+ROTATE_LEASE_SECONDS = 30
+
+
+# ============================================================================
+# Traza de una petición
+# ============================================================================
+
+class RequestTrace:
+    """Acumula identificador, tiempos por fase y campos de una petición"""
+
+    def __init__(self, kind: str, request_id: Optional[str] = None):
+        self.request_id = request_id or uuid.uuid4().hex[:16]
+        self.kind = kind
+        self.started_at = time.time()
+        self._t0 = time.perf_counter()
+        self.phases: dict[str, float] = {}
+        self.fields: dict = {}
+
+    @contextmanager
+    def phase(self, name: str):
+        """Mide la duración de un bloque (en ms); las repeticiones se suman"""
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = (time.perf_counter() - t0) * 1000
+            self.phases[name] = self.phases.get(name, 0.0) + elapsed
+
+    def add_phase(self, name: str, seconds: float) -> None:
+        self.phases[name] = self.phases.get(name, 0.0) + seconds * 1000
+
+    def set(self, **fields) -> None:
+        self.fields.update(fields)
+
+    def elapsed_ms(self) -> float:
+        return (time.perf_counter() - self._t0) * 1000
+
+    def to_record(self) -> dict:
+        return {
+            "ts": self.started_at,
+            "request_id": self.request_id,
+            "kind": self.kind,
+            "total_ms": round(self.elapsed_ms(), 2),
+            "phases_ms": {k: round(v, 2) for k, v in self.phases.items()},
+            **self.fields,
+        }
+
+
+# ============================================================================
+# Escritor en segundo plano
+# ============================================================================
+
+class RequestLog:
+    """
+    log() nunca bloquea: si la cola está llena el registro se descarta y se
+    contabiliza en `dropped`.
+    """
+
+    def __init__(
+        self,
+        path: str = REQUEST_LOG_PATH,
+        max_bytes: int = REQUEST_LOG_MAX_BYTES,
+        rotate_seconds: float = REQUEST_LOG_ROTATE_SECONDS,
+        backups: int = REQUEST_LOG_BACKUPS,
+        max_payload: int = REQUEST_LOG_MAX_PAYLOAD,
+        queue_size: int = REQUEST_LOG_QUEUE_SIZE,
+        enabled: bool = REQUEST_LOG_ENABLED,
+        shared: Optional[SharedState] = None,
+    ):
+        self.enabled = enabled
+        self.shared = shared
+        self.path = Path(path)
+        self.max_bytes = max_bytes
+        self.rotate_seconds = rotate_seconds
+        self.backups = backups
+        self.max_payload = max_payload
+        self._queue: queue.Queue = queue.Queue(maxsize=queue_size)
+        self._thread: Optional[threading.Thread] = None
+        self._file = None
+        self._opened_at = 0.0
+        self.written = 0
+        self.dropped = 0
+        self.rotations = 0
+        self.errors = 0
+
+    def truncate(self, text) -> Optional[str]:
+        """Recorta un texto al tamaño configurado (None si max_payload es 0)"""
+        if text is None or self.max_payload <= 0:
+            return None
+        text = str(text)
+        if len(text) <= self.max_payload:
+            return text
+        return text[:self.max_payload] + f"...[+{len(text) - self.max_payload}]"
+
+    def log(self, record: dict) -> None:
+        if not self.enabled:
+            return
+        try:
+            self._queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def log_trace(self, trace: RequestTrace) -> None:
+        self.log(trace.to_record())
+
+    # ------------------------------------------------------------------
+    # Hilo escritor
+    # ------------------------------------------------------------------
+
+    def start(self) -> None:
+        if not self.enabled:
+            return
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._run, name="request-log", daemon=True)
+            self._thread.start()
+
+    def stop(self, timeout: float = 5.0) -> None:
+        """Vacía la cola y cierra el archivo"""
+        if self._thread is not None and self._thread.is_alive():
+            self._queue.put(None)
+            self._thread.join(timeout)
+        self._thread = None
+
+    def _run(self) -> None:
+        while True:
+            record = self._queue.get()
+            if record is None:
+                break
+            self._write(record)
+            # Escribir lo que ya esté encolado antes de volver a esperar
+            while True:
+                try:
+                    record = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if record is None:
+                    self._close()
+                    return
+                self._write(record)
+        self._close()
+
+    def _write(self, record: dict) -> None:
+        try:
+            line = (json.dumps(record, ensure_ascii=False, default=str) + "\n").encode("utf-8")
+            self._maybe_rotate(len(line))
+            if self._file is None:
+                self._open()
+            # Sin búfer: la línea entera en una sola escritura O_APPEND
+            self._file.write(line)
+            self.written += 1
+        except Exception as e:
+            self.errors += 1
+            print(f"[LOG] Error escribiendo registro: {e}")
+
+    def _open(self) -> None:
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._file = open(self.path, "ab", buffering=0)
+        self._opened_at = time.time()
+
+    def _close(self) -> None:
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def _rotated_elsewhere(self) -> bool:
+        """True si otro worker ha rotado (o borrado) el archivo que tenemos abierto"""
+        try:
+            return os.stat(self.path).st_ino != os.fstat(self._file.fileno()).st_ino
+        except FileNotFoundError:
+            return True
+
+    def _maybe_rotate(self, incoming: int) -> None:
+        if self._file is None:
+            if not self.path.exists():
+                return
+            self._open()
+        elif self._rotated_elsewhere():
+            self._close()
+            self._open()
+        size = os.fstat(self._file.fileno()).st_size
+        too_big = self.max_bytes > 0 and size + incoming > self.max_bytes
+        too_old = self.rotate_seconds > 0 and time.time() - self._opened_at >= self.rotate_seconds
+        if size == 0 or not (too_big or too_old):
+            return
+
+        if self.shared is None:
+            self._rotate()
+            return
+        if not self.shared.try_acquire("request_log:rotate", ROTATE_LEASE_SECONDS):
+            return  # Otro worker está rotando; se sigue escribiendo en el actual
+        try:
+            if self._rotated_elsewhere():
+                # Ya rotado por otro worker justo antes de tomar el lease
+                self._close()
+                self._open()
+            else:
+                self._rotate()
+        finally:
+            self.shared.release("request_log:rotate")
+
+    def _rotate(self) -> None:
+        self._close()
+        for i in range(self.backups - 1, 0, -1):
+            src = self.path.with_name(f"{self.path.name}.{i}")
+            if src.exists():
+                os.replace(src, self.path.with_name(f"{self.path.name}.{i + 1}"))
+        if self.backups > 0:
+            os.replace(self.path, self.path.with_name(f"{self.path.name}.1"))
+        else:
+            self.path.unlink(missing_ok=True)
+        self.rotations += 1
+        self._open()
+
+    def stats(self) -> dict:
+        return {
+            "enabled": self.enabled,
+            "path": str(self.path),
+            "queued": self._queue.qsize(),
+            "written": self.written,
+            "dropped": self.dropped,
+            "rotations": self.rotations,
+            "errors": self.errors,
+        }
@@ -0,0 +1,163 @@
+"""
+Sesiones de conversación en el servidor
+Una sesión guarda una sola vez las instrucciones del sistema y la asocia a
+la conversación de NotebookLM: el cliente solo envía el turno nuevo. Las
+instrucciones van delante de la primera pregunta y, a partir de ahí, viajan
+en el historial que el cliente NotebookLM reenvía en cada seguimiento.
+Las sesiones viven en el estado compartido (visibles desde todos los
+workers) y caducan tras SESSION_TTL segundos sin uso.
+"""
+import os
+import time
+import uuid
+import asyncio
+import hashlib
+from typing import Optional
+
+from shared_state import SharedState
+
+
+# ============================================================================
+# Configuración
+# ============================================================================
+
+# Segundos sin actividad tras los que se olvida una sesión
+SESSION_TTL = float(os.environ.get("SESSION_TTL", "3600"))
+# Turnos que se conservan en el historial compacto de la sesión
+SESSION_MAX_TURNS = int(os.environ.get("SESSION_MAX_TURNS", "50"))
+# Caracteres de cada respuesta guardados en el historial (0 = solo la pregunta)
+SESSION_MAX_ANSWER_CHARS = int(os.environ.get("SESSION_MAX_ANSWER_CHARS", "2000"))
+SESSION_MAX_PROMPT_CHARS = int(os.environ.get("SESSION_MAX_PROMPT_CHARS", "8000"))
+
+
+def prompt_hash(system_prompt: str) -> str:
+    return hashlib.sha256(system_prompt.encode("utf-8")).hexdigest()[:16]
+
+
+class SessionStore:
+    """
+    Sesión = {id, notebook_id, system_prompt, prompt_hash, conversation_id,
+    turns: [{question, answer, at}], created_at, updated_at}.
+    Cada worker recuerda las conversaciones de las sesiones que ha atendido
+    para liberar su historial en el cliente cuando la sesión caduca.
+    """
+
+    def __init__(
+        self,
+        shared: SharedState,
+        ttl: float = SESSION_TTL,
+        max_turns: int = SESSION_MAX_TURNS,
+        max_answer_chars: int = SESSION_MAX_ANSWER_CHARS,
+    ):
+        self.shared = shared
+        self.ttl = ttl
+        self.max_turns = max_turns
+        self.max_answer_chars = max_answer_chars
+        # session_id -> (conversation_id, caducidad local aproximada)
+        self._local: dict[str, tuple[str, float]] = {}
+        # Lectura y escritura de un turno sin otro turno de este worker en medio
+        self._record_lock = asyncio.Lock()
+
+        self.created = 0
+        self.turns = 0
+        self.expired = 0
+        self.deleted = 0
+
+    @staticmethod
+    def _key(session_id: str) -> str:
+        return f"session:{session_id}"
+
+    async def _save(self, session: dict) -> None:
+        session["updated_at"] = time.time()
+        await asyncio.to_thread(self.shared.set, self._key(session["id"]), session, self.ttl)
+        if session.get("conversation_id"):
+            self._local[session["id"]] = (session["conversation_id"], time.time() + self.ttl)
+
+    async def create(self, notebook_id: str, system_prompt: str = "") -> dict:
+        now = time.time()
+        session = {
+            "id": uuid.uuid4().hex,
+            "notebook_id": notebook_id,
+            "system_prompt": system_prompt,
+            "prompt_hash": prompt_hash(system_prompt) if system_prompt else None,
+            "conversation_id": None,
+            "turns": [],
+            "created_at": now,
+            "updated_at": now,
+        }
+        await self._save(session)
+        self.created += 1
+        return session
+
+    async def get(self, session_id: str) -> Optional[dict]:
+        return await asyncio.to_thread(self.shared.get, self._key(session_id))
+
+    def question_for(self, session: dict, question: str) -> str:
+        """Texto a enviar: las instrucciones solo acompañan al primer turno"""
+        if session.get("conversation_id") or not session.get("system_prompt"):
+            return question
+        return session["system_prompt"] + question
+
+    async def record_turn(self, session: dict, question: str, answer: str,
+                          conversation_id: Optional[str]) -> dict:
+        """
+        Guarda el turno (sin las instrucciones) y renueva la caducidad.
+        `session` se leyó al empezar la consulta: el turno se añade a la
+        versión guardada para no perder los de consultas simultáneas.
+        """
+        async with self._record_lock:
+            current = await self.get(session["id"]) or session
+            # Si otra consulta ya fijó la conversación (dos primeros turnos a la
+            # vez), la sesión se queda con esa
+            if conversation_id and current.get("conversation_id") == session.get("conversation_id"):
+                current["conversation_id"] = conversation_id
+            current["turns"].append({
+                "question": question,
+                "answer": answer[:self.max_answer_chars] if self.max_answer_chars else "",
+                "at": time.time(),
+            })
+            del current["turns"][:-self.max_turns or None]
+            await self._save(current)
+        self.turns += 1
+        session.update(current)
+        return current
+
+    async def delete(self, session_id: str) -> Optional[dict]:
+        session = await self.get(session_id)
+        if session is None:
+            return None
+        await asyncio.to_thread(self.shared.delete, self._key(session_id))
+        self._local.pop(session_id, None)
+        self.deleted += 1
+        return session
+
+    async def sweep(self) -> list[str]:
+        """
+        Conversaciones de sesiones caducadas que atendió este worker, para
+        liberar su historial en los clientes. Si otro worker siguió usando la
+        sesión solo se actualiza la caducidad local.
+        """
+        now = time.time()
+        released = []
+        for session_id, (conversation_id, expires_at) in list(self._local.items()):
+            if expires_at > now:
+                continue
+            session = await self.get(session_id)
+            if session is not None:
+                self._local[session_id] = (session.get("conversation_id") or conversation_id,
+                                           session["updated_at"] + self.ttl)
+                continue
+            del self._local[session_id]
+            released.append(conversation_id)
+        self.expired += len(released)
+        return released
+
+    def stats(self) -> dict:
+        return {
+            "ttl": self.ttl,
+            "tracked_locally": len(self._local),
+            "created": self.created,
+            "turns": self.turns,
+            "expired": self.expired,
+            "deleted": self.deleted,
+        }
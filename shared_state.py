@@ -0,0 +1,207 @@
+"""
+Estado compartido entre procesos worker
+Con `uvicorn --workers N` cada proceso tiene sus propias variables globales.
+Lo que debe coordinarse entre ellos (quién re-autentica, cooldowns, versiones
+de credenciales, purgas de caché, historiales de conversación, contadores de
+uso) se guarda en una base SQLite en modo WAL compartida por todos.
+"""
+import os
+import json
+import time
+import uuid
+import sqlite3
+import threading
+from pathlib import Path
+from typing import Any, Optional
+
+
+# ============================================================================
+# Configuración
+# ============================================================================
+
+# ":memory:" mantiene el estado solo dentro del proceso (un único worker)
+SHARED_STATE_DB = os.environ.get(
+    "SHARED_STATE_DB", str(Path(__file__).parent / "shared_state.sqlite3")
+)
+
+
+class SharedState:
+    """
+    Clave-valor con TTL, contadores atómicos y leases (cerrojos con caducidad).
+    Todas las operaciones son síncronas y cortas; desde el event loop conviene
+    llamarlas con asyncio.to_thread si pueden competir con otros procesos.
+    """
+
+    def __init__(self, db_path: str = SHARED_STATE_DB):
+        self.db_path = db_path
+        # Identifica a este proceso como titular de leases
+        self.owner = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        self._lock = threading.Lock()
+        if db_path != ":memory:":
+            Path(db_path).parent.mkdir(parents=True, exist_ok=True)
+        self._conn = sqlite3.connect(db_path, check_same_thread=False, timeout=10, isolation_level=None)
+        if db_path != ":memory:":
+            self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS kv (
+                key TEXT PRIMARY KEY,
+                value TEXT NOT NULL,
+                expires_at REAL
+            );
+            CREATE TABLE IF NOT EXISTS counters (
+                key TEXT PRIMARY KEY,
+                value REAL NOT NULL,
+                expires_at REAL
+            );
+            CREATE TABLE IF NOT EXISTS leases (
+                name TEXT PRIMARY KEY,
+                owner TEXT NOT NULL,
+                expires_at REAL NOT NULL
+            );
+        """)
+
+    @property
+    def process_local(self) -> bool:
+        return self.db_path == ":memory:"
+
+    # ------------------------------------------------------------------
+    # Clave-valor
+    # ------------------------------------------------------------------
+
+    def get(self, key: str, default: Any = None) -> Any:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value, expires_at FROM kv WHERE key = ?", (key,)
+            ).fetchone()
+        if row is None or (row[1] is not None and row[1] <= time.time()):
+            return default
+        return json.loads(row[0])
+
+    def set(self, key: str, value: Any, ttl: Optional[float] = None) -> None:
+        expires_at = time.time() + ttl if ttl else None
+        payload = json.dumps(value, ensure_ascii=False)
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO kv (key, value, expires_at) VALUES (?, ?, ?) "
+                "ON CONFLICT(key) DO UPDATE SET value = excluded.value, expires_at = excluded.expires_at",
+                (key, payload, expires_at),
+            )
+
+    def items(self, prefix: str) -> dict[str, Any]:
+        """Claves vigentes que empiezan por `prefix`"""
+        pattern = prefix.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT key, value FROM kv WHERE key LIKE ? ESCAPE '\\' "
+                "AND (expires_at IS NULL OR expires_at > ?)",
+                (pattern, time.time()),
+            ).fetchall()
+        return {key: json.loads(value) for key, value in rows}
+
+    def delete(self, key: str) -> bool:
+        with self._lock:
+            return self._conn.execute("DELETE FROM kv WHERE key = ?", (key,)).rowcount > 0
+
+    # ------------------------------------------------------------------
+    # Contadores
+    # ------------------------------------------------------------------
+
+    def incr(self, key: str, amount: float = 1, ttl: Optional[float] = None) -> float:
+        """
+        Suma `amount` y devuelve el nuevo valor. Con ttl el contador vuelve a
+        empezar desde cero cuando caduca (ventanas fijas).
+        """
+        now = time.time()
+        expires_at = now + ttl if ttl else None
+        with self._lock:
+            row = self._conn.execute(
+                "INSERT INTO counters (key, value, expires_at) VALUES (?, ?, ?) "
+                "ON CONFLICT(key) DO UPDATE SET "
+                "  value = CASE WHEN counters.expires_at IS NOT NULL AND counters.expires_at <= ? "
+                "               THEN excluded.value ELSE counters.value + excluded.value END, "
+                "  expires_at = CASE WHEN counters.expires_at IS NOT NULL AND counters.expires_at <= ? "
+                "               THEN excluded.expires_at ELSE counters.expires_at END "
+                "RETURNING value",
+                (key, amount, expires_at, now, now),
+            ).fetchone()
+        return row[0]
+
+    def counter(self, key: str) -> float:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value, expires_at FROM counters WHERE key = ?", (key,)
+            ).fetchone()
+        if row is None or (row[1] is not None and row[1] <= time.time()):
+            return 0
+        return row[0]
+
+    # ------------------------------------------------------------------
+    # Leases
+    # ------------------------------------------------------------------
+
+    def try_acquire(self, name: str, ttl: float) -> bool:
+        """
+        Toma el lease si está libre, caducado o ya es de este proceso.
+        La caducidad evita bloqueos eternos si el titular muere.
+        """
+        now = time.time()
+        with self._lock:
+            cursor = self._conn.execute(
+                "INSERT INTO leases (name, owner, expires_at) VALUES (?, ?, ?) "
+                "ON CONFLICT(name) DO UPDATE SET owner = excluded.owner, expires_at = excluded.expires_at "
+                "WHERE leases.expires_at <= ? OR leases.owner = excluded.owner",
+                (name, self.owner, now + ttl, now),
+            )
+            return cursor.rowcount > 0
+
+    def release(self, name: str) -> None:
+        with self._lock:
+            self._conn.execute(
+                "DELETE FROM leases WHERE name = ? AND owner = ?", (name, self.owner)
+            )
+
+    def lease_holder(self, name: str) -> Optional[str]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT owner, expires_at FROM leases WHERE name = ?", (name,)
+            ).fetchone()
+        if row is None or row[1] <= time.time():
+            return None
+        return row[0]
+
+    # ------------------------------------------------------------------
+    # Mantenimiento
+    # ------------------------------------------------------------------
+
+    def cleanup(self) -> int:
+        """Borra claves, contadores y leases caducados"""
+        now = time.time()
+        with self._lock:
+            removed = self._conn.execute(
+                "DELETE FROM kv WHERE expires_at IS NOT NULL AND expires_at <= ?", (now,)
+            ).rowcount
+            removed += self._conn.execute(
+                "DELETE FROM counters WHERE expires_at IS NOT NULL AND expires_at <= ?", (now,)
+            ).rowcount
+            removed += self._conn.execute(
+                "DELETE FROM leases WHERE expires_at <= ?", (now,)
+            ).rowcount
+        return removed
+
+    def stats(self) -> dict:
+        with self._lock:
+            kv = self._conn.execute("SELECT COUNT(*) FROM kv").fetchone()[0]
+            counters = self._conn.execute("SELECT COUNT(*) FROM counters").fetchone()[0]
+            leases = self._conn.execute(
+                "SELECT name, owner, expires_at FROM leases WHERE expires_at > ?", (time.time(),)
+            ).fetchall()
+        return {
+            "db_path": self.db_path,
+            "process_local": self.process_local,
+            "owner": self.owner,
+            "keys": kv,
+            "counters": counters,
+            "leases": {name: {"owner": owner, "expires_in_s": round(exp - time.time(), 1)}
+                       for name, owner, exp in leases},
+        }
@@ -0,0 +1,72 @@
+"""
+Coalescencia de llamadas idénticas en curso (single-flight)
+Si llegan varias peticiones con la misma clave mientras la primera sigue en
+curso, todas esperan y reciben el resultado de una única llamada.
+"""
+import asyncio
+from typing import Any, Awaitable, Callable
+
+
+class SingleFlight:
+    """
+    La llamada compartida se ejecuta como una tarea independiente de quien la
+    inició: si un cliente se desconecta (cancelación), la tarea sigue en curso
+    para el resto de peticiones que la esperan.
+    """
+
+    def __init__(self, name: str = "singleflight"):
+        self.name = name
+        self._inflight: dict[str, asyncio.Task] = {}
+        self._waiters: dict[str, int] = {}
+        self.leaders = 0          # Llamadas reales lanzadas
+        self.coalesced = 0        # Peticiones que reutilizaron una llamada en curso
+        self.cancelled_waiters = 0
+        self.max_waiters = 0
+
+    async def do(self, key: str, fn: Callable[[], Awaitable[Any]]) -> tuple[Any, bool]:
+        """
+        Ejecuta fn() o se une a la ejecución en curso con la misma clave.
+        Devuelve (resultado, compartido) donde compartido indica que el
+        resultado procede de una llamada iniciada por otra petición.
+        """
+        task = self._inflight.get(key)
+        shared = task is not None
+        if shared:
+            self.coalesced += 1
+        else:
+            task = asyncio.ensure_future(fn())
+            self._inflight[key] = task
+            self._waiters[key] = 0
+            self.leaders += 1
+            task.add_done_callback(lambda t, k=key: self._finish(k, t))
+
+        self._waiters[key] = self._waiters.get(key, 0) + 1
+        self.max_waiters = max(self.max_waiters, self._waiters[key])
+        try:
+            # shield: cancelar a un solicitante no cancela la llamada compartida
+            return await asyncio.shield(task), shared
+        except asyncio.CancelledError:
+            self.cancelled_waiters += 1
+            raise
+        finally:
+            if key in self._waiters and self._inflight.get(key) is task:
+                self._waiters[key] -= 1
+
+    def _finish(self, key: str, task: asyncio.Task) -> None:
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+            self._waiters.pop(key, None)
+        # Marcar la excepción como recuperada aunque todos los solicitantes
+        # se hayan cancelado, para no ensuciar el log de asyncio
+        if not task.cancelled():
+            task.exception()
+
+    def stats(self) -> dict:
+        return {
+            "in_flight": len(self._inflight),
+            "waiting": sum(self._waiters.values()),
+            "upstream_calls": self.leaders,
+            "upstream_calls_saved": self.coalesced,
+            "cancelled_waiters": self.cancelled_waiters,
+            "max_waiters": self.max_waiters,
+        }
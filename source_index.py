@@ -0,0 +1,393 @@
+"""
+Índice local de las fuentes de los cuadernos
+Guarda en disco el texto de las fuentes de un cuaderno (descargado de
+NotebookLM o subido a mano), lo parte en fragmentos y construye un índice
+invertido BM25 en arrays NumPy que se abren con mmap: buscar no carga el
+índice en memoria y cuesta milisegundos. Sirve para /notebook/{id}/search y
+para responder con fragmentos de las fuentes cuando NotebookLM no está
+disponible.
+
+Estructura en SOURCE_INDEX_DIR/<notebook_id>/:
+  documents/<id>.json   texto de cada fuente (origen "notebooklm" o "upload")
+  index-<marca>/        índice construido (arrays .npy, fragmentos y meta.json)
+  CURRENT               nombre del índice vigente (se cambia de forma atómica)
+"""
+import io
+import os
+import json
+import math
+import time
+import shutil
+import hashlib
+import threading
+from pathlib import Path
+from typing import Optional
+
+from semantic_cache import question_terms
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+try:
+    from pypdf import PdfReader
+except ImportError:
+    PdfReader = None
+
+
+# ============================================================================
+# Configuración
+# ============================================================================
+
+SOURCE_INDEX_ENABLED = os.environ.get("SOURCE_INDEX_ENABLED", "1") != "0"
+SOURCE_INDEX_DIR = os.environ.get("SOURCE_INDEX_DIR", str(Path(__file__).parent / "source_index"))
+# Caracteres aproximados de cada fragmento indexado
+SOURCE_INDEX_PASSAGE_CHARS = int(os.environ.get("SOURCE_INDEX_PASSAGE_CHARS", "800"))
+SOURCE_INDEX_MAX_UPLOAD_BYTES = int(os.environ.get("SOURCE_INDEX_MAX_UPLOAD_BYTES", str(20 * 1024 * 1024)))
+# Indexar automáticamente el cuaderno del chat (al arrancar y si cambian sus fuentes)
+SOURCE_INDEX_AUTO = os.environ.get("SOURCE_INDEX_AUTO", "1") != "0"
+# Responder con fragmentos de las fuentes si NotebookLM no está disponible
+SOURCE_INDEX_FALLBACK = os.environ.get("SOURCE_INDEX_FALLBACK", "1") != "0"
+SOURCE_INDEX_FALLBACK_PASSAGES = int(os.environ.get("SOURCE_INDEX_FALLBACK_PASSAGES", "3"))
+
+# Parámetros de BM25
+BM25_K1 = 1.2
+BM25_B = 0.75
+# Longitud máxima de un término en el vocabulario
+_MAX_TERM_CHARS = 32
+
+
+class UnsupportedDocument(ValueError):
+    """El documento subido no se puede convertir a texto"""
+
+
+# ============================================================================
+# Texto
+# ============================================================================
+
+def extract_text(data: bytes, content_type: str = "") -> str:
+    """Texto de un documento subido (PDF si pypdf está instalado, o texto)"""
+    if content_type.startswith("application/pdf") or data[:5] == b"%PDF-":
+        if PdfReader is None:
+            raise UnsupportedDocument("Para subir PDF hay que instalar pypdf")
+        reader = PdfReader(io.BytesIO(data))
+        return "\n\n".join(page.extract_text() or "" for page in reader.pages)
+    try:
+        return data.decode("utf-8")
+    except UnicodeDecodeError:
+        return data.decode("latin-1")
+
+
+def split_passages(text: str, max_chars: int = SOURCE_INDEX_PASSAGE_CHARS) -> list[str]:
+    """
+    Fragmentos de unos max_chars caracteres que respetan los párrafos; un
+    párrafo más largo se corta por frases (o a la fuerza si no hay frases).
+    """
+    pieces = []
+    for paragraph in text.replace("\r\n", "\n").split("\n"):
+        paragraph = " ".join(paragraph.split())
+        while len(paragraph) > max_chars:
+            cut = paragraph.rfind(". ", 0, max_chars)
+            cut = cut + 1 if cut > max_chars // 3 else max_chars
+            pieces.append(paragraph[:cut].strip())
+            paragraph = paragraph[cut:].strip()
+        if paragraph:
+            pieces.append(paragraph)
+
+    passages, current = [], ""
+    for piece in pieces:
+        if current and len(current) + len(piece) + 1 > max_chars:
+            passages.append(current)
+            current = piece
+        else:
+            current = f"{current}\n{piece}" if current else piece
+    if current:
+        passages.append(current)
+    return passages
+
+
+def index_terms(text: str) -> list[str]:
+    """Mismos términos que la caché semántica: sin tildes, plurales ni palabras vacías"""
+    return [term[:_MAX_TERM_CHARS] for term in question_terms(text)]
+
+
+# ============================================================================
+# Índice de un cuaderno (solo lectura, con mmap)
+# ============================================================================
+
+class SourceIndex:
+    """
+    Arrays del índice:
+      terms.npy          vocabulario ordenado (búsqueda binaria)
+      term_offsets.npy   inicio de las postings de cada término (+1 final)
+      post_docs.npy      fragmento de cada posting
+      post_tf.npy        frecuencia del término en ese fragmento
+      doc_len.npy        términos de cada fragmento
+      doc_source.npy     fuente de cada fragmento (posición en meta["sources"])
+      passages.bin       texto UTF-8 de los fragmentos, uno tras otro
+      passage_offsets.npy
+    """
+
+    def __init__(self, path: Path):
+        self.path = path
+        self.meta = json.loads((path / "meta.json").read_text(encoding="utf-8"))
+        load = lambda name: np.load(path / name, mmap_mode="r")
+        self.terms = load("terms.npy")
+        self.term_offsets = load("term_offsets.npy")
+        self.post_docs = load("post_docs.npy")
+        self.post_tf = load("post_tf.npy")
+        self.doc_len = load("doc_len.npy")
+        self.doc_source = load("doc_source.npy")
+        self.passage_offsets = load("passage_offsets.npy")
+        self.passages = np.memmap(path / "passages.bin", dtype=np.uint8, mode="r") \
+            if self.meta["passages"] else np.zeros(0, dtype=np.uint8)
+        avg_len = float(self.meta["avg_len"]) or 1.0
+        # Parte de BM25 que solo depende de la longitud del fragmento
+        self.norm = BM25_K1 * (1 - BM25_B + BM25_B * np.asarray(self.doc_len) / avg_len)
+
+    def _postings(self, term: str) -> Optional[tuple["np.ndarray", "np.ndarray"]]:
+        i = int(np.searchsorted(self.terms, term))
+        if i >= len(self.terms) or self.terms[i] != term:
+            return None
+        start, end = int(self.term_offsets[i]), int(self.term_offsets[i + 1])
+        return self.post_docs[start:end], self.post_tf[start:end]
+
+    def passage(self, doc: int) -> str:
+        start, end = int(self.passage_offsets[doc]), int(self.passage_offsets[doc + 1])
+        return bytes(self.passages[start:end]).decode("utf-8")
+
+    def search(self, query: str, limit: int = 10) -> list[dict]:
+        n = self.meta["passages"]
+        terms = set(index_terms(query))
+        if not n or not terms:
+            return []
+        scores = np.zeros(n, dtype=np.float32)
+        for term in terms:
+            postings = self._postings(term)
+            if postings is None:
+                continue
+            docs, tf = postings
+            idf = math.log(1 + (n - len(docs) + 0.5) / (len(docs) + 0.5))
+            tf = tf.astype(np.float32)
+            scores[docs] += idf * tf * (BM25_K1 + 1) / (tf + self.norm[docs])
+
+        k = min(limit, n)
+        top = np.argpartition(scores, n - k)[n - k:]
+        sources = self.meta["sources"]
+        results = []
+        for doc in top[np.argsort(scores[top])[::-1]]:
+            if scores[doc] <= 0:
+                break
+            source = sources[int(self.doc_source[doc])]
+            results.append({
+                "source_id": source["source_id"],
+                "title": source["title"],
+                "passage": self.passage(int(doc)),
+                "score": round(float(scores[doc]), 4),
+            })
+        return results
+
+
+def build_index(path: Path, documents: list[dict], passage_chars: int = SOURCE_INDEX_PASSAGE_CHARS) -> dict:
+    """Construye el índice de los documentos en `path` (directorio nuevo)"""
+    path.mkdir(parents=True)
+    postings: dict[str, list[tuple[int, int]]] = {}
+    doc_len, doc_source, offsets = [], [], [0]
+    sources = []
+    with open(path / "passages.bin", "wb") as out:
+        for source_pos, document in enumerate(documents):
+            sources.append({"source_id": document["source_id"], "title": document["title"],
+                            "origin": document["origin"], "chars": len(document["text"])})
+            for passage in split_passages(document["text"], passage_chars):
+                doc = len(doc_len)
+                counts: dict[str, int] = {}
+                terms = index_terms(passage)
+                for term in terms:
+                    counts[term] = counts.get(term, 0) + 1
+                for term, tf in counts.items():
+                    postings.setdefault(term, []).append((doc, min(tf, 65535)))
+                doc_len.append(len(terms))
+                doc_source.append(source_pos)
+                encoded = passage.encode("utf-8")
+                out.write(encoded)
+                offsets.append(offsets[-1] + len(encoded))
+
+    vocabulary = sorted(postings)
+    term_offsets = [0]
+    for term in vocabulary:
+        term_offsets.append(term_offsets[-1] + len(postings[term]))
+    flat = [posting for term in vocabulary for posting in postings[term]]
+
+    np.save(path / "terms.npy", np.array(vocabulary, dtype=f"<U{_MAX_TERM_CHARS}"))
+    np.save(path / "term_offsets.npy", np.array(term_offsets, dtype=np.int64))
+    np.save(path / "post_docs.npy", np.array([d for d, _ in flat], dtype=np.int32))
+    np.save(path / "post_tf.npy", np.array([tf for _, tf in flat], dtype=np.uint16))
+    np.save(path / "doc_len.npy", np.array(doc_len, dtype=np.float32))
+    np.save(path / "doc_source.npy", np.array(doc_source, dtype=np.int32))
+    np.save(path / "passage_offsets.npy", np.array(offsets, dtype=np.int64))
+    meta = {
+        "built_at": time.time(),
+        "passages": len(doc_len),
+        "terms": len(vocabulary),
+        "postings": len(flat),
+        "avg_len": sum(doc_len) / len(doc_len) if doc_len else 0.0,
+        "sources": sources,
+    }
+    (path / "meta.json").write_text(json.dumps(meta, ensure_ascii=False), encoding="utf-8")
+    return meta
+
+
+# ============================================================================
+# Biblioteca: documentos e índices de todos los cuadernos
+# ============================================================================
+
+class SourceLibrary:
+    """
+    Documentos e índices por cuaderno. Cada worker abre el índice vigente
+    (CURRENT) y lo vuelve a abrir cuando otro worker publica uno nuevo.
+    """
+
+    def __init__(self, base_dir: str = SOURCE_INDEX_DIR, passage_chars: int = SOURCE_INDEX_PASSAGE_CHARS):
+        if np is None:
+            raise RuntimeError("El índice de fuentes necesita numpy")
+        self.base_dir = Path(base_dir)
+        self.passage_chars = passage_chars
+        self._lock = threading.Lock()
+        self._build_lock = threading.Lock()
+        self._open: dict[str, tuple[str, SourceIndex]] = {}
+
+        self.searches = 0
+        self.builds = 0
+        self._search_seconds = 0.0
+
+    def _dir(self, notebook_id: str) -> Path:
+        # El id viene de la URL: nada de rutas relativas
+        safe = "".join(c for c in notebook_id if c.isalnum() or c in "-_")
+        if not safe:
+            raise ValueError("notebook_id invalido")
+        return self.base_dir / safe
+
+    # ------------------------------------------------------------------
+    # Documentos
+    # ------------------------------------------------------------------
+
+    @staticmethod
+    def _document_file(directory: Path, source_id: str) -> Path:
+        return directory / "documents" / (hashlib.sha256(source_id.encode("utf-8")).hexdigest()[:24] + ".json")
+
+    def save_document(self, notebook_id: str, source_id: str, title: str, text: str, origin: str) -> None:
+        document = {"source_id": source_id, "title": title, "text": text,
+                    "origin": origin, "saved_at": time.time()}
+        target = self._document_file(self._dir(notebook_id), source_id)
+        target.parent.mkdir(parents=True, exist_ok=True)
+        tmp = target.with_suffix(f".tmp{os.getpid()}")
+        tmp.write_text(json.dumps(document, ensure_ascii=False), encoding="utf-8")
+        os.replace(tmp, target)
+
+    def documents(self, notebook_id: str) -> list[dict]:
+        folder = self._dir(notebook_id) / "documents"
+        if not folder.exists():
+            return []
+        documents = []
+        for file in sorted(folder.glob("*.json")):
+            try:
+                documents.append(json.loads(file.read_text(encoding="utf-8")))
+            except (OSError, ValueError) as e:
+                print(f"[SEARCH] Documento ilegible {file.name}: {e}")
+        return documents
+
+    def prune(self, notebook_id: str, source_ids: set[str]) -> int:
+        """Borra las fuentes de NotebookLM que ya no están en el cuaderno"""
+        removed = 0
+        for document in self.documents(notebook_id):
+            if document["origin"] == "notebooklm" and document["source_id"] not in source_ids:
+                self._document_file(self._dir(notebook_id), document["source_id"]).unlink(missing_ok=True)
+                removed += 1
+        return removed
+
+    # ------------------------------------------------------------------
+    # Índice
+    # ------------------------------------------------------------------
+
+    def build(self, notebook_id: str) -> dict:
+        """Reconstruye el índice con los documentos guardados y lo publica"""
+        directory = self._dir(notebook_id)
+        started = time.perf_counter()
+        with self._build_lock:
+            documents = self.documents(notebook_id)
+            stamp = time.time_ns()
+            name = f"index-{stamp}"
+            meta = build_index(directory / name, documents, self.passage_chars)
+            tmp = directory / f"CURRENT.tmp{os.getpid()}"
+            tmp.write_text(name, encoding="utf-8")
+            os.replace(tmp, directory / "CURRENT")
+            self.builds += 1
+        # Índices anteriores (en Windows pueden seguir abiertos: se reintenta
+        # en la siguiente). Los posteriores pueden ser de otro worker.
+        for old in directory.glob("index-*"):
+            if old.name.removeprefix("index-").isdigit() and int(old.name.removeprefix("index-")) < stamp:
+                shutil.rmtree(old, ignore_errors=True)
+        elapsed = time.perf_counter() - started
+        print(f"[SEARCH] Indice de {notebook_id[:8]}: {len(documents)} fuentes, "
+              f"{meta['passages']} fragmentos en {elapsed:.2f}s")
+        return {key: meta[key] for key in ("built_at", "passages", "terms", "postings")} | {
+            "sources": len(documents), "build_s": round(elapsed, 3)
+        }
+
+    def index(self, notebook_id: str) -> Optional[SourceIndex]:
+        """Índice vigente del cuaderno (None si no se ha construido)"""
+        try:
+            directory = self._dir(notebook_id)
+        except ValueError:
+            return None
+        with self._lock:
+            opened = self._open.get(notebook_id)
+            error = None
+            # Otro worker puede publicar un índice y borrar el que acabamos de
+            # leer en CURRENT antes de abrirlo: se vuelve a leer CURRENT
+            for _ in range(3):
+                try:
+                    name = (directory / "CURRENT").read_text(encoding="utf-8").strip()
+                except OSError:
+                    return None
+                if opened is not None and opened[0] == name:
+                    return opened[1]
+                try:
+                    index = SourceIndex(directory / name)
+                except (OSError, ValueError) as e:
+                    error = e
+                    continue
+                self._open[notebook_id] = (name, index)
+                return index
+            print(f"[SEARCH] No se pudo abrir el indice de {notebook_id[:8]}: {error}")
+            # El índice anterior (ya abierto con mmap) sigue siendo válido
+            return opened[1] if opened is not None else None
+
+    def search(self, notebook_id: str, query: str, limit: int = 10) -> list[dict]:
+        index = self.index(notebook_id)
+        if index is None:
+            return []
+        started = time.perf_counter()
+        results = index.search(query, limit)
+        self.searches += 1
+        self._search_seconds += time.perf_counter() - started
+        return results
+
+    def info(self, notebook_id: str) -> Optional[dict]:
+        index = self.index(notebook_id)
+        if index is None:
+            return None
+        return {key: index.meta[key] for key in ("built_at", "passages", "terms", "postings")} | {
+            "sources": index.meta["sources"]
+        }
+
+    def stats(self) -> dict:
+        return {
+            "directory": str(self.base_dir),
+            "open_indexes": len(self._open),
+            "builds": self.builds,
+            "searches": self.searches,
+            "avg_search_ms": round(self._search_seconds / self.searches * 1000, 3) if self.searches else 0.0,
+            "pdf_support": PdfReader is not None,
+        }
@@ -0,0 +1,21 @@
+"""
+Configuración común de las pruebas
+Los módulos del puente viven en la raíz del repositorio (no es un paquete):
+se añade al sys.path para importarlos igual que hace api_server.py.
+"""
+import sys
+from pathlib import Path
+
+import pytest
+
+ROOT = Path(__file__).resolve().parent.parent
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+from shared_state import SharedState  # noqa: E402
+
+
+@pytest.fixture
+def shared(tmp_path):
+    """Estado compartido en un fichero temporal (WAL, como en producción)"""
+    return SharedState(str(tmp_path / "shared_state.sqlite3"))
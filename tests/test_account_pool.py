@@ -0,0 +1,134 @@
+"""Pool de cuentas: reparto por carga, conversaciones fijadas y failover"""
+import asyncio
+
+import pytest
+
+import account_pool
+from account_pool import Account, ClientPool
+
+
+class FakeClient:
+    def __init__(self):
+        self._conversation_cache = {}
+
+
+class FakeStore:
+    """Lo mínimo de CredentialStore que usa el pool"""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.client = FakeClient()
+        self.generation = 0
+
+
+class FakeCoordinator:
+    def __init__(self):
+        self.calls = []
+
+    async def reauth(self, generation: int) -> bool:
+        self.calls.append(generation)
+        return True
+
+
+def make_pool(*names: str, cooldown: float = 60) -> ClientPool:
+    return ClientPool([Account(FakeStore(name), FakeCoordinator(), None) for name in names], cooldown=cooldown)
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [500.0]
+    monkeypatch.setattr(account_pool.time, "monotonic", lambda: now[0])
+    return now
+
+
+def test_concurrent_queries_spread_over_accounts():
+    pool = make_pool("a", "b", "c")
+    peak = {}
+
+    async def query():
+        account = pool.pick()
+        with pool.use(account):
+            peak[account.name] = max(peak.get(account.name, 0), account.in_flight)
+            await asyncio.sleep(0.01)
+
+    async def main():
+        await asyncio.gather(*(query() for _ in range(30)))
+
+    asyncio.run(main())
+    assert peak == {"a": 10, "b": 10, "c": 10}
+    assert [account.in_flight for account in pool.accounts] == [0, 0, 0]
+    assert [account.requests for account in pool.accounts] == [10, 10, 10]
+
+
+def test_follow_ups_stay_on_the_pinned_account():
+    pool = make_pool("a", "b")
+    b = pool.get("b")
+    pool.pin("conv-1", b)
+    with pool.use(b):
+        assert pool.pick("conv-1") is b
+    assert pool.pick("conv-1", exclude={"b"}).name == "a"
+
+
+def test_auth_failure_moves_work_until_cooldown_or_renewal(clock):
+    pool = make_pool("a", "b", cooldown=60)
+    a = pool.get("a")
+    pool.pin("conv-1", a)
+    pool.mark_auth_failure(a, generation=0)
+
+    assert not a.healthy
+    assert pool.pick("conv-1").name == "b"
+    assert pool.has_alternative({"b"}) is False
+
+    clock[0] += 60
+    assert a.healthy
+
+    pool.mark_auth_failure(a, generation=0)
+    a.store.generation = 1  # credenciales renovadas antes del cooldown
+    assert a.healthy
+
+
+def test_unhealthy_accounts_are_still_tried_when_none_is_healthy(clock):
+    pool = make_pool("a", "b")
+    for account in pool.accounts:
+        pool.mark_auth_failure(account, generation=0)
+    assert pool.pick() is not None
+    pool.get("a").store.client = None
+    assert pool.pick(exclude={"b"}) is None
+
+
+def test_adopted_conversation_keeps_its_history():
+    pool = make_pool("a", "b")
+    a, b = pool.accounts
+    a.store.client._conversation_cache["conv-1"] = [("pregunta", "respuesta")]
+    pool.pin("conv-1", a)
+
+    pool.adopt_conversation("conv-1", b)
+    assert b.store.client._conversation_cache["conv-1"] == [("pregunta", "respuesta")]
+    assert pool.account_for("conv-1") is b
+    assert pool.conversations_moved == 1
+
+
+def test_pins_are_bounded():
+    pool = ClientPool([Account(FakeStore("a"), FakeCoordinator(), None)], max_pins=3)
+    for i in range(5):
+        pool.pin(f"conv-{i}", pool.primary)
+    assert pool.account_for("conv-0") is None
+    assert pool.account_for("conv-4") is pool.primary
+
+
+def test_background_reauth_does_not_block_the_query():
+    pool = make_pool("a")
+
+    async def main():
+        pool.reauth_in_background(pool.primary, 3)
+        assert pool.primary.coordinator.calls == []
+        await asyncio.sleep(0)
+        await asyncio.sleep(0)
+
+    asyncio.run(main())
+    assert pool.primary.coordinator.calls == [3]
+
+
+def test_pool_needs_an_account():
+    with pytest.raises(ValueError):
+        ClientPool([])
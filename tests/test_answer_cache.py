@@ -0,0 +1,60 @@
+"""Caché de respuestas: claves, niveles y caducidad"""
+import asyncio
+
+import answer_cache
+from answer_cache import AnswerCache, MemoryTier, cache_key
+
+
+def make_cache(tmp_path, **kwargs) -> AnswerCache:
+    options = dict(ttl=60, max_entries=100, max_bytes=1 << 20, db_path=str(tmp_path / "cache.sqlite3"))
+    options.update(kwargs)
+    return AnswerCache(**options)
+
+
+def test_key_ignores_accents_case_spacing_and_final_punctuation():
+    assert cache_key("nb", "¿Cuál es el  presupuesto?") == cache_key("nb", "cual es el presupuesto")
+    assert cache_key("nb", "presupuesto") != cache_key("otro", "presupuesto")
+
+
+def test_memory_tier_is_bounded_by_entries_and_bytes():
+    tier = MemoryTier(max_entries=2, max_bytes=10_000)
+    for key in "abc":
+        tier.put(key, {"answer": key}, expires_at=float("inf"))
+    assert tier.get("a") is None and tier.get("c") is not None
+    assert tier.evictions == 1
+
+    tier = MemoryTier(max_entries=100, max_bytes=1000)
+    for key in "abcd":
+        tier.put(key, {"answer": "x" * 300}, expires_at=float("inf"))
+    assert tier.stats()["bytes"] <= 1000
+    # Una entrada mayor que todo el presupuesto no se guarda
+    tier.put("grande", {"answer": "x" * 2000}, expires_at=float("inf"))
+    assert tier.get("grande") is None
+
+
+def test_disk_tier_serves_and_promotes_to_memory(tmp_path):
+    async def main():
+        cache = make_cache(tmp_path)
+        await cache.put("nb", "pregunta", "respuesta")
+        # Otro worker con la memoria vacía lee del disco compartido
+        other = make_cache(tmp_path)
+        first = await other.get("nb", "Pregunta?")
+        second = await other.get("nb", "pregunta")
+        return first, second
+
+    (entry, tier), (_, again) = asyncio.run(main())
+    assert entry["answer"] == "respuesta" and tier == "disk"
+    assert again == "memory"
+
+
+def test_expired_entries_are_misses(tmp_path, monkeypatch):
+    async def main():
+        cache = make_cache(tmp_path, ttl=10)
+        await cache.put("nb", "pregunta", "respuesta")
+        now = answer_cache.time.time()
+        monkeypatch.setattr(answer_cache.time, "time", lambda: now + 11)
+        return await cache.get("nb", "pregunta"), cache
+
+    (entry, tier), cache = asyncio.run(main())
+    assert entry is None and tier is None
+    assert cache.misses == 1
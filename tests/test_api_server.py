@@ -0,0 +1,189 @@
+"""Endpoints del puente (sin NotebookLM: solo lo que no llama a upstream)"""
+import asyncio
+import importlib
+import json
+import os
+
+import pytest
+from fastapi.testclient import TestClient
+
+from deadline import Deadline, DeadlineExceeded
+from upstream import UpstreamBusy, UpstreamExecutor
+
+
+@pytest.fixture(scope="module")
+def server(tmp_path_factory):
+    # Las rutas de estado se leen al importar: apuntarlas a un directorio temporal
+    tmp = tmp_path_factory.mktemp("api")
+    env = {
+        "SHARED_STATE_DB": str(tmp / "shared_state.sqlite3"),
+        "ANSWER_CACHE_DB": str(tmp / "answer_cache.sqlite3"),
+        "REQUEST_LOG_PATH": str(tmp / "request_log.jsonl"),
+        "SOURCE_INDEX_DIR": str(tmp / "source_index"),
+        "SOURCE_INDEX_AUTO": "0",
+        "CACHE_WARMER_ENABLED": "0",
+    }
+    saved = {key: os.environ.get(key) for key in env}
+    os.environ.update(env)
+    try:
+        yield importlib.import_module("api_server")
+    finally:
+        for key, value in saved.items():
+            if value is None:
+                os.environ.pop(key, None)
+            else:
+                os.environ[key] = value
+
+
+@pytest.fixture
+def client(server):
+    return TestClient(server.app)
+
+
+@pytest.fixture
+def admin_token(server, monkeypatch):
+    monkeypatch.setattr(server, "ADMIN_TOKEN", "secreto")
+    return {"X-Admin-Token": "secreto"}
+
+
+def test_admin_endpoints_closed_without_token(server, client, monkeypatch):
+    monkeypatch.setattr(server, "ADMIN_TOKEN", "")
+    assert client.get("/cache").status_code == 403
+    assert client.delete("/cache").status_code == 403
+    assert client.delete("/cache", headers={"X-Admin-Token": ""}).status_code == 403
+
+
+def test_admin_endpoints_require_matching_token(client, admin_token):
+    assert client.get("/cache").status_code == 403
+    assert client.delete("/cache", headers={"X-Admin-Token": "otro"}).status_code == 403
+    assert client.get("/cache", headers=admin_token).status_code == 200
+    assert client.delete("/cache", headers=admin_token).status_code == 200
+
+
+def test_source_upload_closed_without_token(server, client, monkeypatch):
+    monkeypatch.setattr(server, "ADMIN_TOKEN", "")
+    response = client.post("/notebook/nb/sources/upload?title=x", content=b"texto")
+    assert response.status_code == 403
+    assert client.post("/notebook/nb/sources/index").status_code == 403
+
+
+def test_source_upload_rejects_declared_oversize(server, client, admin_token, monkeypatch):
+    monkeypatch.setattr(server, "SOURCE_INDEX_MAX_UPLOAD_BYTES", 10)
+    response = client.post(
+        "/notebook/nb/sources/upload?title=x",
+        content=b"a" * 11,
+        headers={**admin_token, "Content-Type": "text/plain"},
+    )
+    assert response.status_code == 413
+
+
+def test_source_upload_stops_reading_chunked_oversize(server, client, admin_token, monkeypatch):
+    # Sin Content-Length (chunked): el límite se aplica mientras se lee
+    monkeypatch.setattr(server, "SOURCE_INDEX_MAX_UPLOAD_BYTES", 10)
+
+    def body():
+        for _ in range(100):
+            yield b"a" * 4
+
+    response = client.post(
+        "/notebook/nb/sources/upload?title=x",
+        content=body(),
+        headers={**admin_token, "Content-Type": "text/plain"},
+    )
+    assert response.status_code == 413
+
+
+def test_source_upload_indexes_text(server, client, admin_token):
+    response = client.post(
+        "/notebook/nb/sources/upload?title=presupuesto",
+        content="El presupuesto de carreteras es de tres millones".encode(),
+        headers={**admin_token, "Content-Type": "text/plain"},
+    )
+    assert response.status_code == 200
+    assert response.json()["title"] == "presupuesto"
+
+
+def test_metrics_exposes_limiter_clients(client):
+    lines = client.get("/metrics").text.splitlines()
+    assert any(line.startswith("notebooklm_rate_limit_clients ") for line in lines)
+
+
+def test_queue_wait_within_query_deadline(server, monkeypatch):
+    """Si la cola agota el plazo de la consulta el error es DeadlineExceeded, no 429"""
+    executor = UpstreamExecutor(max_workers=1, max_queue=10, max_wait=30, aging=0, interactive_reserve=0)
+    monkeypatch.setattr(server, "upstream_executor", executor)
+
+    async def main():
+        busy = await executor.acquire("nb", 1)
+        try:
+            deadline = Deadline(0.3, min_attempt=0.1)
+            started = asyncio.get_running_loop().time()
+            with pytest.raises(DeadlineExceeded):
+                async with server.deadline_slot("nb", deadline, "upstream_attempt_1"):
+                    pass
+            # Esperó lo que dejaba el plazo menos el mínimo de un intento, no max_wait
+            return asyncio.get_running_loop().time() - started
+        finally:
+            executor.release(busy)
+
+    waited = asyncio.run(main())
+    assert 0.15 <= waited < 0.3
+    assert executor.stats()["active"] == 0
+
+
+@pytest.fixture
+def fake_answers(server, monkeypatch):
+    """answer_query falso que anota el paralelismo alcanzado"""
+    state = {"active": 0, "peak": 0, "busy_once": set()}
+
+    async def ensure_clients():
+        return True
+
+    async def answer_query(request, trace):
+        if request.question in state["busy_once"]:
+            state["busy_once"].discard(request.question)
+            raise UpstreamBusy("Ejecutor saturado", 0)
+        state["active"] += 1
+        state["peak"] = max(state["peak"], state["active"])
+        try:
+            await asyncio.sleep(0.02)
+        finally:
+            state["active"] -= 1
+        if request.question == "falla":
+            raise server.HTTPException(status_code=404, detail="Cuaderno no encontrado")
+        return server.QueryResponse(success=True, answer=request.question.upper())
+
+    monkeypatch.setattr(server.client_pool, "ensure_clients", ensure_clients)
+    monkeypatch.setattr(server, "answer_query", answer_query)
+    monkeypatch.setattr(server, "BATCH_MAX_CONCURRENCY", 3)
+    return state
+
+
+def test_batch_keeps_order_and_bounds_concurrency(client, fake_answers):
+    questions = [f"pregunta {i}" for i in range(10)] + ["falla"]
+    fake_answers["busy_once"].add("pregunta 3")
+    response = client.post("/query/batch", json={"notebook_id": "nb", "questions": questions, "concurrency": 50})
+
+    body = response.json()
+    assert response.status_code == 200
+    assert [item["question"] for item in body["results"]] == questions
+    assert body["results"][3]["answer"] == "PREGUNTA 3"  # reintentada tras el 429
+    assert body["results"][-1]["status"] == 404
+    assert body["succeeded"] == 10 and body["failed"] == 1
+    assert fake_answers["peak"] == 3
+
+
+def test_batch_stream_sends_results_then_summary(client, fake_answers):
+    questions = ["a", "b", "c"]
+    response = client.post("/query/batch", json={"notebook_id": "nb", "questions": questions, "stream": True})
+
+    lines = [json.loads(line) for line in response.text.splitlines()]
+    assert [line["type"] for line in lines] == ["result"] * 3 + ["summary"]
+    assert [line["answer"] for line in lines[:3]] == ["A", "B", "C"]
+    assert lines[-1]["succeeded"] == 3
+
+
+def test_batch_rejects_empty_and_oversized(server, client, fake_answers, monkeypatch):
+    monkeypatch.setattr(server, "BATCH_MAX_QUESTIONS", 2)
+    assert client.post("/query/batch", json={"notebook_id": "nb", "questions": []}).status_code == 400
+    assert client.post("/query/batch", json={"notebook_id": "nb", "questions": ["a"] * 3}).status_code == 400
@@ -0,0 +1,91 @@
+"""Frontend: sesión HTTP compartida y /health en segundo plano (AppTest de Streamlit)"""
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+import pytest
+import streamlit as st
+from streamlit.testing.v1 import AppTest
+
+APP = str(Path(__file__).resolve().parent.parent / "app.py")
+
+
+@pytest.fixture
+def api():
+    """API falsa: /health responde con las respuestas de `health` (la última se repite)"""
+    state = {"health": [(200, {"status": "ok", "authenticated": True})], "delay": 0.0, "hits": 0}
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            state["hits"] += 1
+            time.sleep(state["delay"])
+            status, body = state["health"].pop(0) if len(state["health"]) > 1 else state["health"][0]
+            payload = json.dumps(body).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(payload)))
+            if status == 503:
+                self.send_header("Retry-After", "0")
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    state["url"] = f"http://127.0.0.1:{server.server_port}"
+    # La sesión y el monitor son recursos cacheados del proceso
+    st.cache_resource.clear()
+    yield state
+    server.shutdown()
+    st.cache_resource.clear()
+
+
+def make_app(api) -> AppTest:
+    app = AppTest.from_file(APP, default_timeout=10)
+    app.secrets["API_BASE_URL"] = api["url"]
+    app.secrets["HEALTH_CHECK_INTERVAL"] = "60"
+    app.secrets["HTTP_BACKOFF"] = "0"
+    return app
+
+
+def sidebar_status(app: AppTest) -> str:
+    return " ".join(m.value for m in app.sidebar.markdown if "font-size: 0.9rem" in m.value)
+
+
+def wait_for(condition, timeout: float = 5) -> None:
+    deadline = time.monotonic() + timeout
+    while not condition() and time.monotonic() < deadline:
+        time.sleep(0.05)
+
+
+def test_reruns_do_not_wait_for_the_health_check(api):
+    api["delay"] = 1.0
+    app = make_app(api)
+    app.run()
+    assert "Comprobando conexión" in sidebar_status(app)
+
+    started = time.monotonic()
+    for _ in range(3):
+        app.run()
+    assert time.monotonic() - started < 1.0
+    # Un solo monitor para todas las ejecuciones del script
+    assert api["hits"] == 1
+
+    time.sleep(1.2)
+    app.run()
+    assert "Sistema en Línea" in sidebar_status(app)
+
+
+def test_busy_api_is_retried_on_the_shared_session(api):
+    api["health"] = [(503, {"detail": "ocupado"}), (200, {"status": "degraded", "authenticated": True})]
+    app = make_app(api)
+    app.run()
+    wait_for(lambda: api["hits"] >= 2)
+    time.sleep(0.1)
+    app.run()
+    assert "Servicio Limitado" in sidebar_status(app)
+    assert api["hits"] == 2
@@ -0,0 +1,40 @@
+"""Prueba de carga con el NotebookLM falso: caducidades bajo concurrencia"""
+import json
+import subprocess
+import sys
+from pathlib import Path
+
+import pytest
+
+ROOT = Path(__file__).resolve().parent.parent
+
+
+def bench(tmp_path, *options: str) -> tuple[int, dict]:
+    # En un proceso aparte: el benchmark prepara el entorno antes de importar api_server
+    report = tmp_path / "informe.json"
+    completed = subprocess.run(
+        [sys.executable, str(ROOT / "benchmark.py"), "--json", str(report), *options],
+        cwd=tmp_path, capture_output=True, text=True, timeout=120,
+    )
+    assert report.exists(), completed.stdout + completed.stderr
+    return completed.returncode, json.loads(report.read_text())
+
+
+@pytest.mark.parametrize("endpoint", ["query", "stream"])
+def test_session_expiries_under_load_cost_one_reauth_each(tmp_path, endpoint):
+    code, report = bench(
+        tmp_path, "--endpoint", endpoint, "--requests", "80", "--concurrency", "16",
+        "--latency", "fixed:0.02", "--auth-expiry-every", "0.4", "--reauth-latency", "0.05",
+        "--max-error-rate", "0",
+    )
+    assert code == 0, report
+    assert report["statuses"] == {"200": 80}
+    assert report["upstream"]["session_expiries"] >= 1
+    # Todas las peticiones que ven la misma caducidad esperan a una sola re-autenticación
+    assert report["reauth"]["runs"] <= report["upstream"]["session_expiries"]
+
+
+def test_thresholds_fail_the_run(tmp_path):
+    code, report = bench(tmp_path, "--requests", "10", "--latency", "fixed:0.01", "--min-rps", "1000000")
+    assert code == 1
+    assert report["requests"] == 10
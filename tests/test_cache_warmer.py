@@ -0,0 +1,72 @@
+"""Precalentamiento: de una en una, solo con el pool libre y un worker por ronda"""
+import asyncio
+
+from cache_warmer import CacheWarmer
+from shared_state import SharedState
+
+QUESTIONS = ["¿Qué es?", "¿Cuánto cuesta?", "¿Quién lo aprueba?"]
+
+
+def make_warmer(outcomes=None, idle=lambda: True, **kwargs):
+    state = {"active": 0, "peak": 0, "asked": []}
+
+    async def warm(notebook_id, question):
+        state["active"] += 1
+        state["peak"] = max(state["peak"], state["active"])
+        state["asked"].append(question)
+        await asyncio.sleep(0.01)
+        state["active"] -= 1
+        outcome = (outcomes or {}).get(question, "warmed")
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome
+
+    options = dict(interval=3600, startup_delay=0, idle_wait=0)
+    options.update(kwargs)
+    return CacheWarmer("nb", QUESTIONS, warm, idle, **options), state
+
+
+def test_round_asks_one_question_at_a_time():
+    warmer, state = make_warmer({"¿Cuánto cuesta?": "fresh", "¿Quién lo aprueba?": RuntimeError("caido")})
+    asyncio.run(warmer.run_round("manual"))
+    assert state["asked"] == QUESTIONS and state["peak"] == 1
+    assert warmer.results == {"warmed": 1, "fresh": 1, "error": 1}
+    assert warmer.rounds == 1 and warmer.last_round_reason == "manual"
+
+
+def test_busy_pool_skips_questions_instead_of_competing():
+    warmer, state = make_warmer(idle=lambda: False)
+    asyncio.run(warmer.run_round("scheduled"))
+    assert state["asked"] == []
+    assert warmer.results == {"busy": 3}
+
+
+def test_one_worker_per_scheduled_round(shared):
+    warmers = [make_warmer(shared=SharedState(shared.db_path)) for _ in range(3)]
+
+    async def main():
+        await asyncio.gather(*(warmer.run_round("scheduled") for warmer, _ in warmers))
+
+    asyncio.run(main())
+    assert sum(len(state["asked"]) for _, state in warmers) == len(QUESTIONS)
+    assert sum(warmer.skipped_rounds for warmer, _ in warmers) == 2
+
+
+def test_trigger_starts_a_round_before_the_interval():
+    before = []
+
+    async def before_round():
+        before.append(1)
+
+    warmer, state = make_warmer(before_round=before_round)
+
+    async def main():
+        warmer.start()
+        await asyncio.sleep(0.1)  # ronda de arranque
+        warmer.trigger("sources_changed")
+        await asyncio.sleep(0.1)
+        await warmer.stop()
+
+    asyncio.run(main())
+    assert warmer.rounds == 2 and len(before) == 2
+    assert warmer.last_round_reason == "sources_changed"
@@ -0,0 +1,145 @@
+"""Circuit breaker: apertura, semiabierto con una sola prueba y cierre"""
+
+import httpx
+import pytest
+
+import circuit_breaker
+from circuit_breaker import CLOSED, HALF_OPEN, OPEN, CircuitBreaker, CircuitOpen
+
+
+def upstream_error(status: int = 503) -> httpx.HTTPStatusError:
+    request = httpx.Request("POST", "https://notebooklm.google.com/")
+    return httpx.HTTPStatusError("error", request=request, response=httpx.Response(status, request=request))
+
+
+def fail(breaker: CircuitBreaker, exc: Exception = None) -> None:
+    with pytest.raises(type(exc) if exc else httpx.HTTPStatusError):
+        with breaker.guard():
+            raise exc or upstream_error()
+
+
+def succeed(breaker: CircuitBreaker) -> None:
+    with breaker.guard():
+        pass
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(circuit_breaker.time, "monotonic", lambda: now[0])
+    return now
+
+
+def make_breaker(**kwargs) -> CircuitBreaker:
+    options = dict(min_calls=4, failure_rate=0.5, open_seconds=10, max_open_seconds=40, enabled=True)
+    options.update(kwargs)
+    return CircuitBreaker(**options)
+
+
+def test_opens_on_failure_rate_after_min_calls(clock):
+    breaker = make_breaker()
+    succeed(breaker)
+    fail(breaker)
+    fail(breaker)
+    assert breaker.state == CLOSED  # 3 llamadas < min_calls
+    fail(breaker)
+    assert breaker.state == OPEN
+
+    with pytest.raises(CircuitOpen) as raised:
+        succeed(breaker)
+    assert raised.value.status_code == 503
+    assert breaker.rejected == 1
+
+
+def test_auth_errors_do_not_count(clock):
+    breaker = make_breaker()
+    for _ in range(10):
+        fail(breaker, upstream_error(401))
+        fail(breaker, ValueError("sin sesion"))
+    assert breaker.state == CLOSED
+    assert breaker.stats()["window_calls"] == 0
+
+
+def test_half_open_admits_a_single_probe(clock):
+    breaker = make_breaker()
+    for _ in range(4):
+        fail(breaker)
+    clock[0] += 10
+    assert breaker.state == HALF_OPEN
+
+    # Mientras la prueba está en curso el resto se rechaza al momento
+    with breaker.guard():
+        for _ in range(5):
+            with pytest.raises(CircuitOpen):
+                succeed(breaker)
+    assert breaker.state == CLOSED
+    assert breaker.rejected == 5
+
+
+def test_failed_probe_reopens_with_doubled_period(clock):
+    breaker = make_breaker()
+    for _ in range(4):
+        fail(breaker)
+    clock[0] += 10
+    fail(breaker)
+    assert breaker.state == OPEN
+    assert breaker.retry_after() == 20
+
+    clock[0] += 19
+    assert breaker.state == OPEN
+    clock[0] += 1
+    assert breaker.state == HALF_OPEN
+
+
+def test_probe_without_verdict_frees_the_slot(clock):
+    breaker = make_breaker()
+    for _ in range(4):
+        fail(breaker)
+    clock[0] += 10
+    fail(breaker, upstream_error(401))
+    assert breaker.state == HALF_OPEN
+    succeed(breaker)
+    assert breaker.state == CLOSED
+
+
+def test_stale_probe_from_previous_phase_is_ignored(clock):
+    breaker = make_breaker(half_open_probes=2)
+    for _ in range(4):
+        fail(breaker)
+    clock[0] += 10
+
+    slow_probe = breaker.guard()
+    slow_probe.__enter__()
+    fail(breaker)  # la otra prueba falla y reabre
+    assert breaker.state == OPEN
+    clock[0] += 20
+    assert breaker.state == HALF_OPEN
+
+    # La prueba de la fase anterior termina bien: no cierra ni libera plazas
+    slow_probe.__exit__(None, None, None)
+    assert breaker.state == HALF_OPEN
+    assert breaker._probes == 0
+
+
+def test_slow_calls_open_the_circuit(clock):
+    breaker = make_breaker(slow_call_seconds=5, slow_call_rate=0.75)
+    for _ in range(4):
+        with breaker.guard():
+            clock[0] += 6
+    assert breaker.state == OPEN
+
+
+def test_streaming_latency_is_not_tracked(clock):
+    breaker = make_breaker(slow_call_seconds=5, slow_call_rate=0.75)
+    for _ in range(4):
+        with breaker.guard(track_latency=False):
+            clock[0] += 6
+    assert breaker.state == CLOSED
+
+
+def test_disabled_breaker_never_rejects():
+    breaker = make_breaker(enabled=False)
+    for _ in range(10):
+        fail(breaker)
+    succeed(breaker)
+    assert breaker.opened == 0
@@ -0,0 +1,104 @@
+"""Sondeo de credenciales: renovación antes de que falle una consulta de usuario"""
+import asyncio
+import json
+import time
+
+import httpx
+
+from credentials import CredentialMonitor
+from shared_state import SharedState
+
+
+class FakeClient:
+    def __init__(self, error=None):
+        self.error = error
+        self.calls = 0
+
+    def list_notebooks(self):
+        self.calls += 1
+        if self.error is not None:
+            raise self.error
+        return []
+
+
+class FakeStore:
+    def __init__(self, client, source="env", auth_file=None):
+        self.name = "test"
+        self.client = client
+        self.generation = 4
+        self.source = source
+        self.auth_file = auth_file
+
+    async def get_client_async(self):
+        return self.client
+
+
+class FakeCoordinator:
+    def __init__(self):
+        self.calls = []
+        self.last_success_at = None
+
+    async def reauth(self, generation):
+        self.calls.append(generation)
+        return True
+
+
+def expired() -> httpx.HTTPStatusError:
+    request = httpx.Request("POST", "https://notebooklm.google.com/")
+    return httpx.HTTPStatusError("401", request=request, response=httpx.Response(401, request=request))
+
+
+def test_auth_failure_triggers_reauth_for_the_probed_generation():
+    coordinator = FakeCoordinator()
+    monitor = CredentialMonitor(FakeStore(FakeClient(expired())), coordinator, interval=60)
+    assert asyncio.run(monitor.probe_once()) == "auth_failure"
+    assert coordinator.calls == [4]
+    assert monitor.consecutive_failures == 1
+
+
+def test_old_cookies_are_renewed_proactively(tmp_path):
+    auth = tmp_path / "auth.json"
+    auth.write_text(json.dumps({"cookies": {}, "extracted_at": time.time() - 30 * 3600}))
+    coordinator = FakeCoordinator()
+    monitor = CredentialMonitor(FakeStore(FakeClient(), source="file", auth_file=auth), coordinator,
+                                interval=60, max_age_hours=24)
+    assert asyncio.run(monitor.probe_once()) == "ok"
+    assert coordinator.calls == [4]
+    assert monitor.proactive_reauths == 1
+
+    # Tras una re-autenticación correcta la antigüedad cuenta desde ella
+    coordinator.last_success_at = time.time()
+    assert asyncio.run(monitor.probe_once()) == "ok"
+    assert monitor.proactive_reauths == 1
+
+
+def test_busy_executor_is_not_a_credential_failure():
+    class Busy(Exception):
+        retry_after = 1
+
+    async def run_probe(fn):
+        raise Busy()
+
+    coordinator = FakeCoordinator()
+    monitor = CredentialMonitor(FakeStore(FakeClient()), coordinator, interval=60, run_probe=run_probe)
+    assert asyncio.run(monitor.probe_once()) == "busy"
+    assert coordinator.calls == [] and monitor.consecutive_failures == 0
+
+
+def test_only_one_worker_probes_per_interval(shared):
+    clients = [FakeClient() for _ in range(3)]
+    monitors = [
+        CredentialMonitor(FakeStore(client), FakeCoordinator(), interval=60, shared=SharedState(shared.db_path))
+        for client in clients
+    ]
+
+    async def main():
+        for monitor in monitors:
+            monitor.start()
+        await asyncio.sleep(0.2)
+        for monitor in monitors:
+            await monitor.stop()
+
+    asyncio.run(main())
+    assert sum(client.calls for client in clients) == 1
+    assert sum(monitor.skipped_other_worker for monitor in monitors) == 2
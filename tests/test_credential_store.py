@@ -0,0 +1,131 @@
+"""Almacén de credenciales: un cliente de larga vida que se recarga al cambiar"""
+import json
+import os
+import threading
+import time
+
+import pytest
+
+from credentials import CredentialStore
+
+
+class FakeClient:
+    def __init__(self, cookies, csrf_token=None, session_id=None):
+        self.cookies = cookies
+        self._conversation_cache = {}
+
+
+@pytest.fixture
+def builds(monkeypatch):
+    made = []
+
+    def factory(**kwargs):
+        if kwargs["cookies"].get("SID") == "rota":
+            raise ValueError("credenciales no validas")
+        time.sleep(0.01)  # el constructor real hace una petición HTTP
+        client = FakeClient(**kwargs)
+        made.append(client)
+        return client
+
+    monkeypatch.delenv("TEST_COOKIES", raising=False)
+    return made, factory
+
+
+def write_auth(path, sid: str) -> None:
+    path.write_text(json.dumps({"cookies": {"SID": sid}}))
+    # Otra huella aunque el tamaño coincida y el mtime no avance
+    stat = path.stat()
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000))
+
+
+def make_store(tmp_path, factory, **kwargs) -> CredentialStore:
+    return CredentialStore(env_var="TEST_COOKIES", auth_file=tmp_path / "auth.json",
+                           check_interval=0, client_factory=factory, **kwargs)
+
+
+def test_concurrent_first_access_builds_one_client(tmp_path, builds):
+    made, factory = builds
+    write_auth(tmp_path / "auth.json", "uno")
+    store = make_store(tmp_path, factory)
+    clients = []
+
+    def get():
+        clients.append(store.get_client())
+
+    threads = [threading.Thread(target=get) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(made) == 1
+    assert all(client is made[0] for client in clients)
+    assert store.rebuilds == {"initial": 1}
+
+
+def test_client_is_reused_until_the_file_changes(tmp_path, builds):
+    made, factory = builds
+    auth = tmp_path / "auth.json"
+    write_auth(auth, "uno")
+    store = make_store(tmp_path, factory)
+    first = store.get_client()
+    first._conversation_cache["conv-1"] = ["turno"]
+    assert store.get_client() is first
+
+    write_auth(auth, "dos")
+    second = store.get_client()
+    assert second is not first and second.cookies == {"SID": "dos"}
+    assert store.generation == 2 and store.rebuilds["file_changed"] == 1
+    # Los seguimientos conservan su contexto con el cliente nuevo
+    assert second._conversation_cache == {"conv-1": ["turno"]}
+
+
+def test_env_var_takes_priority(tmp_path, builds, monkeypatch):
+    made, factory = builds
+    write_auth(tmp_path / "auth.json", "archivo")
+    monkeypatch.setenv("TEST_COOKIES", "SID=entorno")
+    store = make_store(tmp_path, factory)
+    assert store.get_client().cookies == {"SID": "entorno"}
+    assert store.source == "env"
+
+
+def test_broken_credentials_are_not_retried_until_they_change(tmp_path, builds):
+    made, factory = builds
+    auth = tmp_path / "auth.json"
+    write_auth(auth, "uno")
+    store = make_store(tmp_path, factory)
+    good = store.get_client()
+
+    write_auth(auth, "rota")
+    assert store.get_client() is good  # se sigue con el cliente anterior
+    assert store.get_client() is good
+    assert store.failures == 1
+
+    write_auth(auth, "tres")
+    assert store.get_client().cookies == {"SID": "tres"}
+
+
+def test_check_interval_limits_fingerprint_checks(tmp_path, builds):
+    made, factory = builds
+    write_auth(tmp_path / "auth.json", "uno")
+    store = make_store(tmp_path, factory)
+    store.check_interval = 60
+    store.get_client()
+    for _ in range(100):
+        store.get_client()
+    assert store.checks == 1
+
+
+def test_reload_of_same_credentials_is_not_a_renewal(tmp_path, builds):
+    _, factory = builds
+    write_auth(tmp_path / "auth.json", "uno")
+    store = make_store(tmp_path, factory)
+    store.get_client()
+    assert store.renewed_generation == store.generation == 1
+
+    # Recarga tras un error con el mismo auth.json: nueva generación, mismas credenciales
+    store.refresh("auth_error")
+    assert store.generation == 2
+    assert store.renewed_generation == 1
+
+    store.refresh("reauth")
+    assert store.renewed_generation == 3
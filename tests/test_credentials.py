@@ -0,0 +1,115 @@
+"""Re-autenticación: un solo intento del CLI por caducidad"""
+import asyncio
+
+from credentials import ReauthCoordinator
+
+
+class FakeStore:
+    """Lo mínimo de CredentialStore que usa el coordinador"""
+
+    def __init__(self):
+        self.name = "test"
+        self.generation = 0
+        self.renewed_generation = 0
+
+    def refresh(self, reason: str = "manual") -> bool:
+        self.generation += 1
+        # Como la recarga tras un error: mismas credenciales salvo con el CLI
+        if reason == "reauth":
+            self.renewed_generation = self.generation
+        return True
+
+
+def make_coordinator(store, shared=None, outcome="success", delay=0.05):
+    coordinator = ReauthCoordinator(store, cookies_file=None, cooldown=60, shared=shared)
+    calls = []
+
+    async def fake_cli() -> str:
+        calls.append(1)
+        await asyncio.sleep(delay)
+        return outcome
+
+    coordinator._run_auth_cli = fake_cli
+    return coordinator, calls
+
+
+def test_concurrent_reauth_runs_cli_once():
+    store = FakeStore()
+    coordinator, calls = make_coordinator(store)
+
+    async def main():
+        return await asyncio.gather(*(coordinator.reauth(0) for _ in range(20)))
+
+    results = asyncio.run(main())
+    assert all(results)
+    assert len(calls) == 1
+    assert coordinator.runs == 1
+    assert store.generation == 1
+    assert coordinator.outcomes == {"success": 1}
+    assert coordinator.parked == 19
+
+
+def test_concurrent_reauth_with_shared_state_runs_cli_once(shared):
+    # La consulta del cooldown compartido es un await: nadie debe colarse ahí
+    store = FakeStore()
+    coordinator, calls = make_coordinator(store, shared=shared)
+
+    async def main():
+        return await asyncio.gather(*(coordinator.reauth(0) for _ in range(20)))
+
+    results = asyncio.run(main())
+    assert all(results)
+    assert len(calls) == 1
+    assert store.generation == 1
+    assert coordinator.outcomes == {"success": 1}
+
+
+def test_stale_generation_only_retries():
+    store = FakeStore()
+    store.generation = store.renewed_generation = 3
+    coordinator, calls = make_coordinator(store)
+
+    assert asyncio.run(coordinator.reauth(2)) is True
+    assert calls == []
+    assert coordinator.skipped == 1
+
+
+def test_reload_of_same_credentials_does_not_skip_reauth():
+    # Otra petición recargó del disco las mismas credenciales caducadas tras
+    # fallar esta: la generación subió, pero reintentar sin el CLI fallaría
+    store = FakeStore()
+    store.refresh("auth_error")
+    coordinator, calls = make_coordinator(store)
+
+    assert asyncio.run(coordinator.reauth(0)) is True
+    assert len(calls) == 1
+    assert coordinator.skipped == 0
+    assert store.renewed_generation == store.generation == 2
+
+
+def test_failure_starts_cooldown():
+    store = FakeStore()
+    coordinator, calls = make_coordinator(store, outcome="timeout")
+
+    async def main():
+        first = await asyncio.gather(*(coordinator.reauth(0) for _ in range(5)))
+        second = await coordinator.reauth(0)
+        return first, second
+
+    first, second = asyncio.run(main())
+    assert first == [False] * 5
+    assert second is False
+    assert len(calls) == 1
+    assert coordinator.outcomes == {"timeout": 1, "cooldown": 1}
+
+
+def test_shared_cooldown_blocks_other_workers(shared):
+    store = FakeStore()
+    failing, _ = make_coordinator(store, shared=shared, outcome="timeout")
+    asyncio.run(failing.reauth(0))
+
+    # Otro worker (otro coordinador sobre el mismo estado) respeta el cooldown
+    other, calls = make_coordinator(FakeStore(), shared=shared)
+    assert asyncio.run(other.reauth(0)) is False
+    assert calls == []
+    assert other.outcomes == {"cooldown": 1}
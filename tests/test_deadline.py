@@ -0,0 +1,57 @@
+"""Plazo total de una consulta compartido entre fases e intentos"""
+import pytest
+
+import deadline as deadline_module
+from deadline import Deadline, DeadlineExceeded
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [50.0]
+    monkeypatch.setattr(deadline_module.time, "monotonic", lambda: now[0])
+    return now
+
+
+def test_for_timeout_uses_default_and_clamps(monkeypatch):
+    monkeypatch.setattr(deadline_module, "QUERY_DEFAULT_DEADLINE", 120)
+    monkeypatch.setattr(deadline_module, "QUERY_MAX_DEADLINE", 300)
+    assert Deadline.for_timeout(None).budget == 120
+    assert Deadline.for_timeout(0).budget == 120
+    assert Deadline.for_timeout(45).budget == 45
+    assert Deadline.for_timeout(10_000).budget == 300
+
+
+def test_phases_share_one_budget(clock):
+    deadline = Deadline(60, min_attempt=10)
+    clock[0] += 20  # espera en cola
+    assert deadline.require("upstream_attempt_1") == 40
+    clock[0] += 35  # el primer intento falla tarde
+    with pytest.raises(DeadlineExceeded) as raised:
+        deadline.require("upstream_attempt_2")
+    assert raised.value.phase == "upstream_attempt_2"
+    assert raised.value.remaining == 5
+    # Una fase corta todavía cabe
+    assert deadline.require("credential_reload", needed=1) == 5
+
+
+def test_min_attempt_is_capped_for_short_budgets(clock):
+    deadline = Deadline(4, min_attempt=10)
+    assert deadline.min_attempt == 2
+    assert deadline.require("upstream_attempt_1") == 4
+
+
+def test_queue_wait_leaves_room_for_an_attempt(clock):
+    deadline = Deadline(60, min_attempt=10)
+    assert deadline.queue_wait(30) == 30
+    clock[0] += 35
+    assert deadline.queue_wait(30) == 15
+    clock[0] += 20
+    assert deadline.queue_wait(30) == 0
+
+
+def test_expired_deadline_reports_zero_remaining(clock):
+    deadline = Deadline(5, min_attempt=1)
+    clock[0] += 10
+    assert deadline.remaining() == 0
+    with pytest.raises(DeadlineExceeded, match="quedaban 0.00s de 5s"):
+        deadline.require("reauth", needed=0)
@@ -0,0 +1,116 @@
+"""Trabajos asíncronos: ciclo de vida, long-poll, límite y apagado"""
+import asyncio
+
+import pytest
+
+from jobs import DONE, FAILED, JobStore
+from upstream import UpstreamBusy
+
+
+class Refused(Exception):
+    status_code = 404
+    detail = "Cuaderno no encontrado"
+
+
+def test_job_runs_in_background_and_wait_returns_result(shared):
+    store = JobStore(shared, ttl=60, max_wait=2)
+    release = asyncio.Event()
+
+    async def run(job_id):
+        await release.wait()
+        return {"answer": job_id[:8]}
+
+    async def main():
+        job = await store.submit("query", run, budget=10, notebook_id="nb")
+        assert job["status"] == "queued" and job["notebook_id"] == "nb"
+
+        # Long-poll corto: el trabajo sigue en curso
+        pending = await store.wait(job["id"], 0.05)
+        assert pending["status"] in ("queued", "running")
+
+        asyncio.get_running_loop().call_later(0.05, release.set)
+        finished = await store.wait(job["id"], 2)
+        return job, finished
+
+    job, finished = asyncio.run(main())
+    assert finished["status"] == DONE
+    assert finished["result"] == {"answer": job["id"][:8]}
+    assert store.stats()["running"] == 0 and store.completed == 1
+
+
+def test_failure_keeps_status_code_and_detail(shared):
+    store = JobStore(shared, ttl=60)
+
+    async def run(job_id):
+        raise Refused()
+
+    async def main():
+        job = await store.submit("query", run, budget=10)
+        return await store.wait(job["id"], 1)
+
+    failed = asyncio.run(main())
+    assert failed["status"] == FAILED
+    assert failed["status_code"] == 404
+    assert failed["error"] == "Cuaderno no encontrado"
+
+
+def test_max_running_rejects_with_upstream_busy(shared):
+    store = JobStore(shared, ttl=60, max_running=2)
+    release = asyncio.Event()
+
+    async def run(job_id):
+        await release.wait()
+        return {}
+
+    async def main():
+        await store.submit("query", run, budget=10)
+        await store.submit("query", run, budget=10)
+        with pytest.raises(UpstreamBusy):
+            await store.submit("query", run, budget=10)
+        release.set()
+        await asyncio.sleep(0.1)
+        # Al terminar se liberan las plazas
+        await store.submit("query", run, budget=10)
+        await asyncio.sleep(0.1)
+
+    asyncio.run(main())
+    assert store.rejected == 1 and store.submitted == 3
+
+
+def test_other_worker_polls_shared_state(shared):
+    """Un segundo JobStore (otro worker) ve el resultado por el estado compartido"""
+    owner = JobStore(shared, ttl=60)
+    other = JobStore(shared, ttl=60, max_wait=2, poll_interval=0.02)
+
+    async def run(job_id):
+        await asyncio.sleep(0.1)
+        return {"answer": "ok"}
+
+    async def main():
+        job = await owner.submit("query", run, budget=10)
+        return await other.wait(job["id"], 2)
+
+    finished = asyncio.run(main())
+    assert finished["status"] == DONE and finished["result"] == {"answer": "ok"}
+
+
+def test_stop_marks_running_jobs_as_interrupted(shared):
+    store = JobStore(shared, ttl=60)
+
+    async def run(job_id):
+        await asyncio.sleep(60)
+
+    async def main():
+        job = await store.submit("query", run, budget=10)
+        await asyncio.sleep(0.05)
+        await store.stop()
+        return await store.get(job["id"])
+
+    stopped = asyncio.run(main())
+    assert stopped["status"] == FAILED and stopped["status_code"] == 503
+    assert store.stats()["running"] == 0
+
+
+def test_unknown_job_is_none(shared):
+    store = JobStore(shared)
+    assert asyncio.run(store.wait("no-existe", 0)) is None
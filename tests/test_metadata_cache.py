@@ -0,0 +1,118 @@
+"""Caché stale-while-revalidate de metadatos"""
+import asyncio
+
+import metadata_cache
+from metadata_cache import MetadataCache
+
+
+class Upstream:
+    def __init__(self):
+        self.calls = 0
+        self.fail = False
+
+    async def fetch(self):
+        self.calls += 1
+        await asyncio.sleep(0.01)
+        if self.fail:
+            raise RuntimeError("NotebookLM caido")
+        return {"version": self.calls}
+
+
+async def drain(cache):
+    await asyncio.gather(*cache._background, return_exceptions=True)
+
+
+def expire(cache, key):
+    cache._entries[key].fetched_at -= cache.ttl + 1
+
+
+def test_concurrent_misses_share_one_fetch():
+    cache = MetadataCache(ttl=60)
+    upstream = Upstream()
+
+    async def main():
+        return await asyncio.gather(*(cache.get("notebooks", upstream.fetch) for _ in range(10)))
+
+    results = asyncio.run(main())
+    assert upstream.calls == 1
+    assert {status for _, status, _ in results} == {"MISS"}
+
+
+def test_stale_entry_is_served_while_refreshing():
+    cache = MetadataCache(ttl=60)
+    upstream = Upstream()
+
+    async def main():
+        await cache.get("notebooks", upstream.fetch)
+        expire(cache, "notebooks")
+        stale = [await cache.get("notebooks", upstream.fetch) for _ in range(5)]
+        await drain(cache)
+        fresh = await cache.get("notebooks", upstream.fetch)
+        return stale, fresh
+
+    stale, fresh = asyncio.run(main())
+    assert [status for _, status, _ in stale] == ["STALE"] * 5
+    assert stale[0][0] == {"version": 1}
+    assert upstream.calls == 2          # Un único refresco para las 5 peticiones
+    assert fresh[:2] == ({"version": 2}, "HIT")
+
+
+def test_failed_refresh_backs_off_exponentially():
+    cache = MetadataCache(ttl=60, retry_base=5)
+    upstream = Upstream()
+
+    async def main():
+        await cache.get("notebooks", upstream.fetch)
+        expire(cache, "notebooks")
+        upstream.fail = True
+
+        await cache.get("notebooks", upstream.fetch)
+        await drain(cache)
+        entry = cache._entries["notebooks"]
+
+        # Durante la espera nadie vuelve a llamar a NotebookLM
+        for _ in range(20):
+            value, status, _ = await cache.get("notebooks", upstream.fetch)
+            assert (value, status) == ({"version": 1}, "ERROR")
+        await drain(cache)
+        calls_during_backoff = upstream.calls
+
+        # Pasada la espera se reintenta una vez y la siguiente se dobla
+        entry.retry_at = 0
+        await cache.get("notebooks", upstream.fetch)
+        await drain(cache)
+        return calls_during_backoff, entry
+
+    calls_during_backoff, entry = asyncio.run(main())
+    assert calls_during_backoff == 2
+    assert upstream.calls == 3
+    assert cache.refreshes_backed_off == 20
+    assert entry.failures == 2
+
+
+def test_backoff_is_capped_at_ttl_and_reset_on_success(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(metadata_cache.time, "time", lambda: now[0])
+    cache = MetadataCache(ttl=30, retry_base=5)
+    upstream = Upstream()
+
+    async def main():
+        await cache.get("notebooks", upstream.fetch)
+        now[0] += 31
+        upstream.fail = True
+        delays = []
+        for _ in range(5):
+            cache.refresh_in_background("notebooks", upstream.fetch)
+            await drain(cache)
+            delays.append(cache._entries["notebooks"].retry_at - now[0])
+            now[0] += delays[-1]
+        upstream.fail = False
+        cache.refresh_in_background("notebooks", upstream.fetch)
+        await drain(cache)
+        return delays
+
+    delays = asyncio.run(main())
+    assert delays == [5, 10, 20, 30, 30]
+    entry = cache._entries["notebooks"]
+    assert entry.failures == 0 and entry.retry_at == 0
+    assert entry.value == {"version": 7}
@@ -0,0 +1,27 @@
+"""Formato Prometheus de /metrics"""
+from metrics import Registry
+from rate_limit import RateLimiter
+
+
+def test_histogram_buckets_are_cumulative():
+    registry = Registry("t_")
+    histogram = registry.histogram("latency_seconds", "Latencia", buckets=(0.1, 1), labelnames=("phase",))
+    for value in (0.05, 0.5, 0.5, 3):
+        histogram.observe(value, "upstream")
+
+    lines = registry.render().splitlines()
+    assert 't_latency_seconds_bucket{phase="upstream",le="0.1"} 1' in lines
+    assert 't_latency_seconds_bucket{phase="upstream",le="1"} 3' in lines
+    assert 't_latency_seconds_bucket{phase="upstream",le="+Inf"} 4' in lines
+    assert 't_latency_seconds_count{phase="upstream"} 4' in lines
+
+
+def test_callback_reads_public_limiter_count():
+    limiter = RateLimiter(rate=1, burst=1, enabled=True)
+    registry = Registry("t_")
+    registry.callback("rate_limit_clients", "Clientes", limiter.client_count)
+    limiter.take("ip:10.0.0.1")
+    limiter.take("ip:10.0.0.2")
+
+    assert "t_rate_limit_clients 2" in registry.render().splitlines()
+    assert limiter.client_count() == limiter.stats()["clients"] == 2
@@ -0,0 +1,85 @@
+"""Límite por cliente: token bucket, claves y proxies de confianza"""
+import pytest
+
+import rate_limit
+from rate_limit import RateLimiter, client_address, parse_networks
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr(rate_limit.time, "monotonic", lambda: now[0])
+    return now
+
+
+def make_limiter(**kwargs) -> RateLimiter:
+    options = dict(rate=1, burst=3, api_keys=["secreta"], key_multiplier=10, enabled=True)
+    options.update(kwargs)
+    return RateLimiter(**options)
+
+
+def test_burst_then_refill(clock):
+    limiter = make_limiter()
+    assert [limiter.take("ip:1.2.3.4") for _ in range(3)] == [0, 0, 0]
+    assert limiter.take("ip:1.2.3.4") == pytest.approx(1.0)
+    clock[0] += 1
+    assert limiter.take("ip:1.2.3.4") == 0
+    assert limiter.rejected == 1 and limiter.allowed == 4
+
+
+def test_clients_are_independent_and_keys_get_more(clock):
+    limiter = make_limiter()
+    for _ in range(3):
+        limiter.take("ip:1.1.1.1")
+    assert limiter.take("ip:1.1.1.1") > 0
+    assert limiter.take("ip:2.2.2.2") == 0
+
+    client = limiter.identify("8.8.8.8", {}, api_key="secreta")
+    assert client.startswith("key:") and "secreta" not in client
+    assert all(limiter.take(client) == 0 for _ in range(30))
+    assert limiter.take(client) > 0
+
+
+def test_unknown_key_falls_back_to_ip():
+    limiter = make_limiter()
+    assert limiter.identify("8.8.8.8", {}, api_key="otra") == "ip:8.8.8.8"
+
+
+def test_idle_buckets_are_evicted(clock):
+    limiter = make_limiter(max_clients=2, idle_seconds=30)
+    for ip in ("1.1.1.1", "2.2.2.2", "3.3.3.3"):
+        limiter.take(f"ip:{ip}")
+    # Por encima de max_clients se descarta el de uso más antiguo
+    assert limiter.client_count() == 2
+    clock[0] += limiter.idle_seconds
+    assert limiter.client_count() == 0
+    assert limiter.evicted == 3
+
+
+def test_disabled_limiter_admits_everything():
+    limiter = make_limiter(enabled=False)
+    assert all(limiter.take("ip:1.1.1.1") == 0 for _ in range(100))
+
+
+TRUSTED = parse_networks("127.0.0.1/8,::1,10.0.0.0/8")
+
+
+def test_untrusted_peer_headers_are_ignored():
+    headers = {"x-forwarded-for": "127.0.0.1"}
+    assert client_address("203.0.113.9", headers, TRUSTED) == ("203.0.113.9", False)
+
+
+def test_forwarded_for_skips_trusted_hops_from_the_right():
+    # El cliente escribió 1.1.1.1; 198.51.100.7 lo añadió nuestro proxy
+    headers = {"x-forwarded-for": "1.1.1.1, 198.51.100.7, 10.0.0.5"}
+    assert client_address("127.0.0.1", headers, TRUSTED) == ("198.51.100.7", False)
+
+
+def test_cloudflare_header_and_local_connections():
+    assert client_address("127.0.0.1", {"cf-connecting-ip": "198.51.100.7"}, TRUSTED) == ("198.51.100.7", False)
+    assert client_address("127.0.0.1", {}, TRUSTED) == ("127.0.0.1", True)
+    assert make_limiter().identify("127.0.0.1", {}) is None
+
+
+def test_invalid_proxy_entries_are_ignored():
+    assert [str(n) for n in parse_networks("10.0.0.1, basura,,::1")] == ["10.0.0.1/32", "::1/128"]
@@ -0,0 +1,85 @@
+"""Registro de peticiones: escritura en segundo plano, descarte y rotación"""
+import json
+import time
+
+from request_log import RequestLog, RequestTrace
+from shared_state import SharedState
+
+
+def read_lines(path) -> list[dict]:
+    return [json.loads(line) for line in path.read_text(encoding="utf-8").splitlines()]
+
+
+def test_records_are_written_by_the_background_thread(tmp_path):
+    path = tmp_path / "log.jsonl"
+    log = RequestLog(path=str(path), enabled=True)
+    log.start()
+    trace = RequestTrace("query")
+    with trace.phase("upstream"):
+        time.sleep(0.01)
+    trace.set(notebook_id="nb", question=log.truncate("¿Qué tal?"))
+    log.log_trace(trace)
+    for i in range(20):
+        log.log({"i": i})
+    log.stop()
+
+    records = read_lines(path)
+    assert len(records) == 21 and log.written == 21
+    assert records[0]["kind"] == "query" and records[0]["question"] == "¿Qué tal?"
+    assert records[0]["phases_ms"]["upstream"] >= 10
+    assert [r["i"] for r in records[1:]] == list(range(20))
+
+
+def test_log_never_blocks_when_the_queue_is_full(tmp_path):
+    log = RequestLog(path=str(tmp_path / "log.jsonl"), queue_size=3, enabled=True)
+    # Sin hilo escritor la cola no se vacía
+    started = time.perf_counter()
+    for i in range(10):
+        log.log({"i": i})
+    assert time.perf_counter() - started < 0.1
+    assert log.dropped == 7
+
+
+def test_truncate_marks_the_cut():
+    log = RequestLog(max_payload=5, enabled=False)
+    assert log.truncate("abcdefgh") == "abcde...[+3]"
+    assert log.truncate("abc") == "abc"
+    assert RequestLog(max_payload=0, enabled=False).truncate("abc") is None
+
+
+def test_size_rotation_keeps_backups(tmp_path):
+    path = tmp_path / "log.jsonl"
+    log = RequestLog(path=str(path), max_bytes=200, backups=2, enabled=True)
+    log.start()
+    for i in range(30):
+        log.log({"i": i, "relleno": "x" * 40})
+    log.stop()
+
+    assert log.rotations > 2 and log.errors == 0
+    assert sorted(p.name for p in tmp_path.iterdir()) == ["log.jsonl", "log.jsonl.1", "log.jsonl.2"]
+    assert all(p.stat().st_size <= 200 for p in tmp_path.iterdir())
+    # Lo más reciente queda en el archivo actual
+    assert read_lines(path)[-1]["i"] == 29
+
+
+def test_workers_share_the_file_across_rotations(tmp_path, shared):
+    """Varios workers escriben en el mismo archivo sin perder ni partir líneas"""
+    path = tmp_path / "log.jsonl"
+    logs = [
+        RequestLog(path=str(path), max_bytes=2000, backups=50, enabled=True, shared=SharedState(shared.db_path))
+        for _ in range(3)
+    ]
+    for log in logs:
+        log.start()
+    for i in range(100):
+        for n, log in enumerate(logs):
+            log.log({"worker": n, "i": i, "relleno": "x" * 30})
+    for log in logs:
+        log.stop()
+
+    files = [path] + sorted(tmp_path.glob("log.jsonl.*"))
+    records = [record for f in files for record in read_lines(f)]
+    assert len(records) == 300
+    assert {(r["worker"], r["i"]) for r in records} == {(n, i) for n in range(3) for i in range(100)}
+    assert sum(log.rotations for log in logs) >= 1
+    assert sum(log.errors for log in logs) == 0
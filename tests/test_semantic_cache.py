@@ -0,0 +1,129 @@
+"""Caché semántica: equivalencias, desalojo global, poda y uso desde varios hilos"""
+import threading
+
+import pytest
+
+np = pytest.importorskip("numpy")
+
+from semantic_cache import SemanticIndex  # noqa: E402
+
+TOPICS = [
+    "políticas sociales", "carreteras", "empleo", "personal", "cultura", "deportes", "medio ambiente",
+    "igualdad", "juventud", "turismo", "agricultura", "vivienda", "educación", "bomberos", "residuos",
+]
+
+
+def filled_index(**kwargs) -> SemanticIndex:
+    index = SemanticIndex(**kwargs)
+    for i, topic in enumerate(TOPICS):
+        index.add("nb", f"¿Cuánto se gasta en {topic}?", f"gasto:{i}")
+        index.add("nb", f"¿Qué subvenciones hay para {topic}?", f"ayudas:{i}")
+    return index
+
+
+def test_paraphrase_is_found():
+    index = filled_index()
+    key, similarity = index.lookup("nb", "cuánto gasta en las carreteras")
+    assert key == "gasto:1"
+    assert similarity >= index.threshold
+
+
+def test_other_topic_or_figures_do_not_match():
+    index = filled_index()
+    assert index.lookup("nb", "¿Cuánto se gasta en sanidad?")[0] is None
+    index.add("nb", "¿Cuánto se gasta en cultura en 2025?", "cultura:2025")
+    assert index.lookup("nb", "¿Cuánto se gasta en cultura en 2024?")[0] is None
+
+
+def test_prompt_is_ignored_for_similarity():
+    index = SemanticIndex()
+    index.register_prompt("INSTRUCCIONES LARGAS. ")
+    index.add("nb", "INSTRUCCIONES LARGAS. ¿Cuánto se gasta en carreteras?", "k")
+    assert index.lookup("nb", "INSTRUCCIONES LARGAS. cuánto gasta en las carreteras")[0] == "k"
+    # Sin las instrucciones es otro índice
+    assert index.lookup("nb", "cuánto gasta en las carreteras")[0] is None
+
+
+def test_lookup_only_scores_rows_sharing_a_rare_word():
+    index = filled_index()
+    partition = index._partitions[("nb", "")]
+    _, terms = index.embed("cuánto gasta en las carreteras")
+    rows = partition.candidates(terms)
+    assert rows is not None
+    assert sorted(partition.keys[row] for row in rows) == ["ayudas:1", "gasto:1"]
+    _, terms = index.embed("¿quién es el presidente?")
+    assert len(partition.candidates(terms)) == 0
+
+
+def test_vectors_match_after_reweight():
+    index = filled_index()
+    partition = index._partitions[("nb", "")]
+    partition.reweight()
+    # Recalculadas desde las frecuencias dispersas, las filas siguen siendo
+    # unitarias y la búsqueda da lo mismo
+    norms = np.linalg.norm(partition.vectors[:partition.size], axis=1)
+    assert np.allclose(norms, 1, atol=1e-5)
+    assert index.lookup("nb", "cuánto gasta en las carreteras")[0] == "gasto:1"
+
+
+def test_eviction_is_global_and_least_recently_used():
+    index = SemanticIndex(max_entries=3)
+    index.add("a", "¿Cuánto se gasta en carreteras?", "a1")
+    index.add("b", "¿Cuánto se gasta en cultura?", "b1")
+    assert index.lookup("a", "cuanto gasta en carreteras")[0] == "a1"  # a1 pasa a ser la más reciente
+    index.add("c", "¿Cuánto se gasta en empleo?", "c1")
+    index.add("c", "¿Cuánto se gasta en turismo?", "c2")
+
+    assert index.stats()["entries"] == 3
+    assert index.evictions == 1
+    assert index.lookup("b", "cuanto gasta en cultura")[0] is None
+    assert ("b", "") not in index._partitions
+    assert index.lookup("a", "cuanto gasta en carreteras")[0] == "a1"
+
+
+def test_discard_and_compact_keep_the_index_consistent():
+    index = SemanticIndex()
+    for i in range(300):
+        index.add("nb", f"¿Cuánto se gasta en la partida {i} de {TOPICS[i % len(TOPICS)]}?", f"k{i}")
+    for i in range(0, 300, 3):
+        index.discard("nb", f"¿Cuánto se gasta en la partida {i} de {TOPICS[i % len(TOPICS)]}?", f"k{i}")
+    for i in range(1, 300, 3):
+        index.discard("nb", f"¿Cuánto se gasta en la partida {i} de {TOPICS[i % len(TOPICS)]}?", f"k{i}")
+
+    partition = index._partitions[("nb", "")]
+    assert partition.alive == 100
+    assert partition.size - partition.alive <= max(64, partition.alive)   # se ha compactado
+    assert all(row in partition.rows.values() for rows in partition.postings.values() for row in rows)
+    assert index.lookup("nb", "cuanto se gasta en la partida 2 de empleo")[0] == "k2"
+
+
+def test_concurrent_adds_and_lookups_from_threads():
+    # api_server llama al índice con asyncio.to_thread: add() recalcula los
+    # IDF mientras otros hilos buscan
+    index = SemanticIndex()
+    errors = []
+
+    def writer(start):
+        try:
+            for i in range(start, start + 400):
+                index.add("nb", f"¿Cuánto se gasta en el programa {i} de {TOPICS[i % len(TOPICS)]}?", f"k{i}")
+        except Exception as e:  # pragma: no cover - solo si hay carrera
+            errors.append(e)
+
+    def reader():
+        try:
+            for i in range(400):
+                index.lookup("nb", f"gasto del programa {i} de {TOPICS[i % len(TOPICS)]}")
+        except Exception as e:  # pragma: no cover
+            errors.append(e)
+
+    threads = [threading.Thread(target=writer, args=(n * 400,)) for n in range(3)]
+    threads += [threading.Thread(target=reader) for _ in range(3)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert errors == []
+    assert index.stats()["entries"] == 1200
+    assert index.lookup("nb", "cuanto se gasta en el programa 5 de deportes")[0] == "k5"
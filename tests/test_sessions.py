@@ -0,0 +1,79 @@
+"""Sesiones: instrucciones una sola vez, turnos simultáneos y caducidad"""
+import asyncio
+
+import sessions
+from sessions import SessionStore
+from shared_state import SharedState
+
+
+def test_system_prompt_only_goes_with_the_first_turn(shared):
+    store = SessionStore(shared)
+
+    async def main():
+        session = await store.create("nb", "Responde en una frase. ")
+        first = store.question_for(session, "¿Qué es?")
+        await store.record_turn(session, "¿Qué es?", "Un cuaderno.", "conv-1")
+        # Otro worker carga la sesión del estado compartido
+        loaded = await SessionStore(SharedState(shared.db_path)).get(session["id"])
+        return first, store.question_for(loaded, "¿Y luego?"), loaded
+
+    first, follow_up, loaded = asyncio.run(main())
+    assert first == "Responde en una frase. ¿Qué es?"
+    assert follow_up == "¿Y luego?"
+    assert loaded["conversation_id"] == "conv-1"
+    assert loaded["turns"][0]["question"] == "¿Qué es?"
+
+
+def test_concurrent_turns_are_all_recorded(shared):
+    store = SessionStore(shared)
+
+    async def main():
+        session = await store.create("nb")
+        # Cada consulta leyó la sesión al empezar, antes de que terminara ninguna
+        copies = [await store.get(session["id"]) for _ in range(5)]
+        await asyncio.gather(*(
+            store.record_turn(copy, f"pregunta {i}", "respuesta", f"conv-{i}")
+            for i, copy in enumerate(copies)
+        ))
+        return await store.get(session["id"])
+
+    stored = asyncio.run(main())
+    assert sorted(turn["question"] for turn in stored["turns"]) == [f"pregunta {i}" for i in range(5)]
+    # La primera conversación fijada se conserva
+    assert stored["conversation_id"] == "conv-0"
+
+
+def test_history_is_trimmed(shared):
+    store = SessionStore(shared, max_turns=3, max_answer_chars=4)
+
+    async def main():
+        session = await store.create("nb")
+        for i in range(5):
+            await store.record_turn(session, f"p{i}", "respuesta larga", "conv")
+        return await store.get(session["id"])
+
+    stored = asyncio.run(main())
+    assert [turn["question"] for turn in stored["turns"]] == ["p2", "p3", "p4"]
+    assert stored["turns"][0]["answer"] == "resp"
+
+
+def test_sweep_releases_only_sessions_expired_everywhere(shared, monkeypatch):
+    store = SessionStore(shared, ttl=60)
+    other = SessionStore(SharedState(shared.db_path), ttl=60)
+    now = [1000.0]
+    monkeypatch.setattr(sessions.time, "time", lambda: now[0])
+
+    async def main():
+        idle = await store.create("nb")
+        await store.record_turn(idle, "p", "r", "conv-idle")
+        active = await store.create("nb")
+        await store.record_turn(active, "p", "r", "conv-active")
+
+        # Otro worker sigue usando una de ellas
+        now[0] += 50
+        await other.record_turn(await other.get(active["id"]), "p2", "r", None)
+        now[0] += 20
+        return await store.sweep()
+
+    assert asyncio.run(main()) == ["conv-idle"]
+    assert store.stats()["tracked_locally"] == 1
@@ -0,0 +1,120 @@
+"""Estado compartido entre workers: TTL, contadores, leases y purgas de caché"""
+import asyncio
+import threading
+
+import pytest
+
+import answer_cache
+import shared_state
+from answer_cache import AnswerCache
+from shared_state import SharedState
+
+
+def worker(shared: SharedState) -> SharedState:
+    """Otra conexión al mismo fichero, como la de otro proceso worker"""
+    return SharedState(shared.db_path)
+
+
+def test_values_expire_and_items_filter_by_prefix(shared, monkeypatch):
+    shared.set("job:a", {"status": "done"}, ttl=10)
+    shared.set("job:b", [1, 2])
+    shared.set("otro", 1)
+    assert worker(shared).items("job:") == {"job:a": {"status": "done"}, "job:b": [1, 2]}
+
+    now = shared_state.time.time()
+    monkeypatch.setattr(shared_state.time, "time", lambda: now + 11)
+    assert shared.get("job:a") is None
+    assert shared.cleanup() == 1
+
+
+def test_incr_is_atomic_across_connections(shared):
+    workers = [worker(shared) for _ in range(4)]
+
+    def bump(state):
+        for _ in range(50):
+            state.incr("peticiones")
+
+    threads = [threading.Thread(target=bump, args=(state,)) for state in workers]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert shared.counter("peticiones") == 200
+
+
+def test_lease_has_a_single_holder_until_released_or_expired(shared, monkeypatch):
+    other = worker(shared)
+    assert shared.try_acquire("reauth", ttl=30)
+    assert shared.try_acquire("reauth", ttl=30)  # renovación del propio titular
+    assert not other.try_acquire("reauth", ttl=30)
+    assert other.lease_holder("reauth") == shared.owner
+
+    shared.release("reauth")
+    assert other.try_acquire("reauth", ttl=30)
+    assert not shared.try_acquire("reauth", ttl=30)
+
+    # Si el titular muere, el lease caduca
+    now = shared_state.time.time()
+    monkeypatch.setattr(shared_state.time, "time", lambda: now + 31)
+    assert shared.try_acquire("reauth", ttl=30)
+
+
+def test_lease_race_has_one_winner(shared):
+    workers = [worker(shared) for _ in range(8)]
+    barrier = threading.Barrier(len(workers))
+    winners = []
+
+    def race(state):
+        barrier.wait()
+        if state.try_acquire("warmer", ttl=30):
+            winners.append(state.owner)
+
+    threads = [threading.Thread(target=race, args=(state,)) for state in workers]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(winners) == 1
+
+
+def make_cache(tmp_path, **kwargs) -> AnswerCache:
+    options = dict(ttl=60, max_entries=100, max_bytes=1 << 20, db_path=str(tmp_path / "cache.sqlite3"))
+    options.update(kwargs)
+    return AnswerCache(**options)
+
+
+@pytest.fixture
+def no_sync_delay(monkeypatch):
+    monkeypatch.setattr(answer_cache, "ANSWER_CACHE_SYNC_INTERVAL", 0)
+
+
+def test_purge_reaches_other_workers_memory(tmp_path, shared, no_sync_delay):
+    """La purga de un worker vacía también la memoria de los demás"""
+    async def main():
+        worker_a = make_cache(tmp_path, shared=shared)
+        worker_b = make_cache(tmp_path, shared=worker(shared))
+        await worker_a.put("nb", "pregunta", "antigua")
+        await worker_a.put("otro", "pregunta", "se queda")
+        assert (await worker_b.get("nb", "pregunta"))[1] == "disk"
+        assert (await worker_b.get("nb", "pregunta"))[1] == "memory"
+
+        await worker_a.purge("nb")
+        return await worker_b.get("nb", "pregunta"), await worker_b.get("otro", "pregunta")
+
+    (purged, _), (kept, _) = asyncio.run(main())
+    assert purged is None
+    assert kept["answer"] == "se queda"
+
+
+def test_purge_generations_are_not_reapplied(tmp_path, shared, no_sync_delay):
+    """Una purga ya aplicada no vuelve a vaciar entradas guardadas después"""
+    async def main():
+        worker_a = make_cache(tmp_path, shared=shared)
+        worker_b = make_cache(tmp_path, shared=worker(shared), db_path=None)
+        await worker_a.purge()
+        await worker_b.get("nb", "pregunta")
+        await worker_b.put("nb", "pregunta", "nueva")
+        return await worker_b.get("nb", "pregunta")
+
+    entry, tier = asyncio.run(main())
+    assert entry["answer"] == "nueva" and tier == "memory"
@@ -0,0 +1,86 @@
+"""Single-flight: una sola llamada por clave en curso"""
+import asyncio
+
+import pytest
+
+from singleflight import SingleFlight
+
+
+def test_concurrent_calls_share_one_execution():
+    flights = SingleFlight()
+    calls = []
+
+    async def fetch():
+        calls.append(1)
+        await asyncio.sleep(0.05)
+        return "respuesta"
+
+    async def main():
+        return await asyncio.gather(*(flights.do("k", fetch) for _ in range(10)))
+
+    results = asyncio.run(main())
+    assert len(calls) == 1
+    assert [value for value, _ in results] == ["respuesta"] * 10
+    assert sum(shared for _, shared in results) == 9
+    assert flights.stats()["in_flight"] == 0
+
+
+def test_different_keys_run_separately():
+    flights = SingleFlight()
+    calls = []
+
+    async def fetch(key):
+        calls.append(key)
+        await asyncio.sleep(0.01)
+        return key
+
+    async def main():
+        return await asyncio.gather(*(flights.do(k, lambda k=k: fetch(k)) for k in "abcab"))
+
+    results = asyncio.run(main())
+    assert sorted(calls) == ["a", "b", "c"]
+    assert [value for value, _ in results] == list("abcab")
+
+
+def test_errors_reach_every_waiter_and_are_not_cached():
+    flights = SingleFlight()
+    calls = []
+
+    async def failing():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        raise RuntimeError("upstream")
+
+    async def main():
+        results = await asyncio.gather(*(flights.do("k", failing) for _ in range(5)), return_exceptions=True)
+        # Terminada la llamada, la siguiente vuelve a intentarlo
+        with pytest.raises(RuntimeError):
+            await flights.do("k", failing)
+        return results
+
+    results = asyncio.run(main())
+    assert all(isinstance(r, RuntimeError) for r in results)
+    assert len(calls) == 2
+
+
+def test_cancelled_waiter_does_not_cancel_the_shared_call():
+    flights = SingleFlight()
+    finished = []
+
+    async def fetch():
+        await asyncio.sleep(0.05)
+        finished.append(1)
+        return "ok"
+
+    async def main():
+        first = asyncio.create_task(flights.do("k", fetch))
+        second = asyncio.create_task(flights.do("k", fetch))
+        await asyncio.sleep(0.01)
+        first.cancel()
+        return await second, first
+
+    (value, shared), first = asyncio.run(main())
+    assert first.cancelled()
+    assert value == "ok" and shared
+    assert finished == [1]
+    assert flights.cancelled_waiters == 1
@@ -0,0 +1,91 @@
+"""Índice local de fuentes: BM25, publicación entre workers y reconstrucción en caliente"""
+import threading
+
+import pytest
+
+from source_index import SourceLibrary, extract_text, split_passages
+
+
+def add_sources(library: SourceLibrary, notebook_id: str = "nb") -> None:
+    library.save_document(notebook_id, "s1", "Presupuestos",
+                          "El presupuesto de carreteras asciende a doce millones.\n\n"
+                          "La partida de cultura crece un cinco por ciento.", "notebooklm")
+    library.save_document(notebook_id, "s2", "Empleo",
+                          "El plan de empleo local financia contratos en municipios pequeños.", "upload")
+
+
+def test_search_ranks_matching_passages(tmp_path):
+    library = SourceLibrary(str(tmp_path), passage_chars=60)
+    add_sources(library)
+    library.build("nb")
+
+    results = library.search("nb", "¿Cuánto dinero hay para las carreteras?")
+    assert results[0]["source_id"] == "s1"
+    assert "carreteras" in results[0]["passage"]
+    assert library.search("nb", "empleo en los municipios")[0]["title"] == "Empleo"
+    assert library.search("nb", "astronautas") == []
+    assert library.search("otro", "carreteras") == []
+
+
+def test_other_worker_opens_the_new_index(tmp_path):
+    writer = SourceLibrary(str(tmp_path))
+    reader = SourceLibrary(str(tmp_path))
+    add_sources(writer)
+    writer.build("nb")
+    assert reader.search("nb", "turismo") == []
+
+    writer.save_document("nb", "s3", "Turismo", "La red de albergues recibe turismo rural.", "upload")
+    writer.build("nb")
+    assert reader.search("nb", "turismo")[0]["source_id"] == "s3"
+    # Solo queda el índice vigente
+    assert len(list((tmp_path / "nb").glob("index-*"))) == 1
+
+
+def test_searches_keep_working_during_rebuilds(tmp_path):
+    writer = SourceLibrary(str(tmp_path))
+    reader = SourceLibrary(str(tmp_path))
+    add_sources(writer)
+    writer.build("nb")
+    errors, stop = [], threading.Event()
+
+    def search():
+        while not stop.is_set():
+            try:
+                assert reader.search("nb", "carreteras")[0]["source_id"] == "s1"
+            except Exception as e:
+                errors.append(e)
+                return
+
+    threads = [threading.Thread(target=search) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    try:
+        for _ in range(10):
+            writer.build("nb")
+    finally:
+        stop.set()
+        for thread in threads:
+            thread.join()
+    assert errors == []
+
+
+def test_prune_only_removes_missing_notebooklm_sources(tmp_path):
+    library = SourceLibrary(str(tmp_path))
+    add_sources(library)
+    assert library.prune("nb", set()) == 1
+    assert [d["source_id"] for d in library.documents("nb")] == ["s2"]
+
+
+def test_notebook_id_cannot_escape_the_directory(tmp_path):
+    library = SourceLibrary(str(tmp_path / "indices"))
+    assert library._dir("../../etc") == tmp_path / "indices" / "etc"
+    with pytest.raises(ValueError):
+        library._dir("../..")
+
+
+def test_passages_respect_the_size_limit():
+    text = "Primera frase corta. " * 30 + "\n" + "x" * 500
+    passages = split_passages(text, max_chars=100)
+    assert all(len(p) <= 100 for p in passages)
+    assert "".join(passages).replace("\n", "").replace(" ", "") == text.replace("\n", "").replace(" ", "")
+    assert extract_text("año".encode("latin-1")) == "año"
@@ -0,0 +1,129 @@
+"""Ejecutor de NotebookLM: límites, cola acotada y devolución de plazas"""
+import asyncio
+
+import pytest
+
+import upstream
+from upstream import UpstreamBusy, UpstreamExecutor
+
+
+def make_executor(**kwargs) -> UpstreamExecutor:
+    kwargs.setdefault("interactive_reserve", 0)
+    kwargs.setdefault("aging", 0)
+    return UpstreamExecutor(**kwargs)
+
+
+def test_concurrency_never_exceeds_limits():
+    executor = make_executor(max_workers=3, max_per_notebook=2, max_queue=100, max_wait=5)
+    active = {"total": 0, "peak": 0, "a": 0, "peak_a": 0}
+
+    async def call(notebook_id):
+        async with executor.slot(notebook_id):
+            active["total"] += 1
+            active[notebook_id] = active.get(notebook_id, 0) + 1
+            active["peak"] = max(active["peak"], active["total"])
+            active["peak_a"] = max(active["peak_a"], active["a"])
+            await asyncio.sleep(0.01)
+            active["total"] -= 1
+            active[notebook_id] -= 1
+
+    async def main():
+        await asyncio.gather(*(call("a" if i % 2 else "b") for i in range(30)))
+
+    asyncio.run(main())
+    assert active["peak"] == 3
+    assert active["peak_a"] == 2
+    stats = executor.stats()
+    assert stats["active"] == 0 and stats["queue_depth"] == 0
+    assert stats["completed"] == 30
+
+
+def test_full_queue_rejects_with_retry_after():
+    executor = make_executor(max_workers=1, max_queue=2, max_wait=5)
+
+    async def main():
+        held = await executor.acquire()
+        queued = [asyncio.create_task(executor.acquire()) for _ in range(2)]
+        await asyncio.sleep(0)
+        with pytest.raises(UpstreamBusy) as busy:
+            await executor.acquire()
+        executor.release(held)
+        for task in queued:
+            executor.release(await task)
+        return busy.value
+
+    error = asyncio.run(main())
+    assert error.status_code == 429 and error.retry_after >= 1
+    assert executor.rejected_queue_full == 1
+    assert executor.stats()["active"] == 0
+
+
+def test_wait_timeout_rejects_and_frees_nothing():
+    executor = make_executor(max_workers=1, max_queue=10, max_wait=0.05)
+
+    async def main():
+        held = await executor.acquire()
+        with pytest.raises(UpstreamBusy):
+            await executor.acquire()
+        executor.release(held)
+
+    asyncio.run(main())
+    assert executor.rejected_timeout == 1
+    assert executor.stats()["active"] == 0
+
+
+def test_slot_granted_as_the_wait_times_out_is_returned(monkeypatch):
+    # En Python 3.12+ wait_for puede lanzar TimeoutError con el futuro ya
+    # resuelto (plaza concedida): la plaza no debe perderse
+    executor = make_executor(max_workers=1, max_queue=10, max_wait=5)
+    real_wait_for = asyncio.wait_for
+
+    async def grant_then_timeout(future, timeout):
+        await future
+        raise asyncio.TimeoutError
+
+    async def main():
+        held = await executor.acquire()
+        monkeypatch.setattr(upstream.asyncio, "wait_for", grant_then_timeout)
+        waiting = asyncio.create_task(executor.acquire())
+        await asyncio.sleep(0)
+        executor.release(held)          # Concede la plaza al que espera...
+        with pytest.raises(UpstreamBusy):
+            await waiting               # ...que a la vez agota su espera
+        monkeypatch.setattr(upstream.asyncio, "wait_for", real_wait_for)
+        # La plaza se devolvió: se puede volver a ocupar sin esperar
+        executor.release(await executor.acquire(max_wait=0.1))
+
+    asyncio.run(main())
+    assert executor.stats()["active"] == 0
+
+
+def test_cancelled_waiter_leaks_no_slot():
+    executor = make_executor(max_workers=1, max_queue=10, max_wait=5)
+
+    async def use_slot():
+        async with executor.slot():
+            await asyncio.sleep(0.01)
+
+    async def main():
+        held = await executor.acquire()
+        waiters = [asyncio.create_task(use_slot()) for _ in range(5)]
+        await asyncio.sleep(0)
+        executor.release(held)          # Concedida al primero...
+        for task in waiters:
+            task.cancel()               # ...que se cancela en el mismo ciclo
+        await asyncio.gather(*waiters, return_exceptions=True)
+
+    asyncio.run(main())
+    stats = executor.stats()
+    assert stats["active"] == 0 and stats["queue_depth"] == 0
+
+
+def test_run_executes_in_the_pool():
+    executor = make_executor(max_workers=2)
+
+    async def main():
+        return await asyncio.gather(*(executor.run(pow, 2, i, notebook_id="nb") for i in range(6)))
+
+    assert asyncio.run(main()) == [1, 2, 4, 8, 16, 32]
+    executor.shutdown()
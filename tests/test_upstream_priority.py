@@ -0,0 +1,139 @@
+"""Planificación por prioridad: orden, plazas reservadas, envejecimiento y desplazamiento"""
+import asyncio
+
+import pytest
+
+from upstream import UpstreamBusy, UpstreamExecutor
+
+
+async def queue_and_release(executor, requests):
+    """Ocupa el pool, encola `requests` [(nombre, prioridad, cliente)] y devuelve el orden de concesión"""
+    held = [await executor.acquire() for _ in range(executor.max_workers)]
+    order = []
+
+    async def request(name, priority, client):
+        slot = await executor.acquire(priority=priority, client=client)
+        order.append(name)
+        await asyncio.sleep(0)
+        executor.release(slot)
+
+    tasks = []
+    for name, priority, client in requests:
+        tasks.append(asyncio.create_task(request(name, priority, client)))
+        await asyncio.sleep(0)
+    for slot in held:
+        executor.release(slot)
+    await asyncio.gather(*tasks)
+    return order
+
+
+def test_higher_class_goes_first():
+    executor = UpstreamExecutor(max_workers=1, max_queue=10, aging=0, interactive_reserve=0)
+    order = asyncio.run(queue_and_release(executor, [
+        ("bg", "background", None), ("bulk", "bulk", None), ("chat", "interactive", None),
+    ]))
+    assert order == ["chat", "bulk", "bg"]
+
+
+def test_reserved_slot_is_only_for_interactive():
+    executor = UpstreamExecutor(max_workers=2, max_queue=10, aging=0, interactive_reserve=1)
+
+    async def main():
+        bulk = await executor.acquire(priority="bulk")
+        # La segunda plaza está reservada: el lote espera y el chat entra
+        with pytest.raises(UpstreamBusy):
+            await executor.acquire(priority="bulk", max_wait=0.05)
+        chat = await executor.acquire(priority="interactive", max_wait=0.05)
+        executor.release(chat)
+        executor.release(bulk)
+
+    asyncio.run(main())
+    assert executor.stats()["active"] == 0
+
+
+def test_aging_promotes_by_whole_classes():
+    executor = UpstreamExecutor(max_workers=1, aging=10)
+
+    class Waiter:
+        rank = 2
+        enqueued_at = 100.0
+
+    assert executor._effective_rank(Waiter, 109.9) == 2
+    assert executor._effective_rank(Waiter, 110.0) == 1
+    assert executor._effective_rank(Waiter, 125.0) == 0
+    assert isinstance(executor._effective_rank(Waiter, 125.0), int)
+
+
+def test_aged_background_request_overtakes_new_chat():
+    executor = UpstreamExecutor(max_workers=1, max_queue=10, aging=10, interactive_reserve=0)
+
+    async def main():
+        held = await executor.acquire()
+        order = []
+
+        async def request(name, priority):
+            slot = await executor.acquire(priority=priority)
+            order.append(name)
+            executor.release(slot)
+
+        old = asyncio.create_task(request("old-bg", "background"))
+        await asyncio.sleep(0)
+        executor._waiters[0].enqueued_at -= 25      # 25 s en cola: ya cuenta como interactiva
+        new = asyncio.create_task(request("chat", "interactive"))
+        await asyncio.sleep(0)
+        executor.release(held)
+        await asyncio.gather(old, new)
+        return order
+
+    assert asyncio.run(main()) == ["old-bg", "chat"]
+
+
+def test_full_queue_preempts_lowest_priority_for_chat():
+    executor = UpstreamExecutor(max_workers=1, max_queue=2, aging=0, interactive_reserve=0)
+
+    async def main():
+        held = await executor.acquire()
+        bulk = asyncio.create_task(executor.acquire(priority="bulk"))
+        background = asyncio.create_task(executor.acquire(priority="background"))
+        await asyncio.sleep(0)
+        chat = asyncio.create_task(executor.acquire(priority="interactive"))
+        await asyncio.sleep(0)
+        with pytest.raises(UpstreamBusy):
+            await background                 # Desplazada
+        # Otra de fondo no desplaza a nadie: se rechaza
+        with pytest.raises(UpstreamBusy):
+            await executor.acquire(priority="background")
+        executor.release(held)
+        executor.release(await chat)
+        executor.release(await bulk)
+
+    asyncio.run(main())
+    stats = executor.stats()
+    assert stats["by_priority"]["background"]["preempted"] == 1
+    assert stats["active"] == 0
+
+
+def test_same_class_prefers_client_with_fewer_calls():
+    executor = UpstreamExecutor(max_workers=2, max_queue=10, aging=0, interactive_reserve=0)
+
+    async def main():
+        busy = await executor.acquire(client="a")       # "a" ya tiene una llamada
+        other = await executor.acquire(client="c")
+        order = []
+
+        async def request(name, client):
+            slot = await executor.acquire(client=client)
+            order.append(name)
+            executor.release(slot)
+
+        first = asyncio.create_task(request("a2", "a"))
+        await asyncio.sleep(0)
+        second = asyncio.create_task(request("b1", "b"))
+        await asyncio.sleep(0)
+        executor.release(other)
+        await asyncio.sleep(0)
+        executor.release(busy)
+        await asyncio.gather(first, second)
+        return order
+
+    assert asyncio.run(main()) == ["b1", "a2"]
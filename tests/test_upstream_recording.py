@@ -0,0 +1,111 @@
+"""Grabación y reproducción del tráfico con NotebookLM"""
+import threading
+import time
+
+import httpx
+import pytest
+from notebooklm_mcp.api_client import AuthenticationError, Notebook
+
+from upstream_recording import Recorder, RecordingClient, ReplayArchive, ReplayClient
+
+
+class FakeClient:
+    """Cliente real de mentira: responde según la pregunta"""
+
+    def query(self, notebook_id, query_text, source_ids=None, conversation_id=None, timeout=120):
+        if query_text == "caducada":
+            raise AuthenticationError("RPC 16")
+        if query_text == "rota":
+            request = httpx.Request("POST", "https://notebooklm.google.com/")
+            raise httpx.HTTPStatusError("500", request=request, response=httpx.Response(500, request=request))
+        time.sleep(0.01)
+        return {"answer": f"R: {query_text}", "conversation_id": conversation_id or f"conv-{query_text}"}
+
+    def list_notebooks(self):
+        return [Notebook(id="nb", title="Presupuesto", source_count=1, sources=[{"id": "s1"}],
+                         is_owned=True, is_shared=False, created_at=None, modified_at=None)]
+
+
+def record(tmp_path, calls) -> str:
+    path = str(tmp_path / "grabacion.jsonl.gz")
+    recorder = Recorder(path)
+    client = RecordingClient(FakeClient(), recorder)
+    for question, conversation_id in calls:
+        try:
+            client.query("nb", question, conversation_id=conversation_id)
+        except Exception:
+            pass
+    client.list_notebooks()
+    recorder.close()
+    return path
+
+
+def test_concurrent_calls_are_recorded_as_whole_lines(tmp_path):
+    path = str(tmp_path / "grabacion.jsonl.gz")
+    recorder = Recorder(path)
+    client = RecordingClient(FakeClient(), recorder)
+    threads = [
+        threading.Thread(target=lambda n=n: [client.query("nb", f"p{n}-{i}") for i in range(10)])
+        for n in range(8)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    recorder.close()
+
+    archive = ReplayArchive(path)
+    assert archive.loaded == 80 and recorder.records == 80
+    assert sorted(archive.questions()) == sorted(f"p{n}-{i}" for n in range(8) for i in range(10))
+
+
+def test_replay_matches_exact_question_then_any(tmp_path):
+    path = record(tmp_path, [("hola", None), ("hola", "conv-x"), ("adios", None)])
+    client = ReplayClient(ReplayArchive(path), speed=0)
+
+    assert client.query("nb", "hola", conversation_id="conv-x")["conversation_id"] == "conv-x"
+    assert client.query("nb", "adios", conversation_id="conv-nueva")["answer"] == "R: adios"
+    assert client.query("nb", "nunca grabada")["answer"].startswith("R: ")
+    assert client.archive.served == {"exact": 1, "question": 1, "any": 1, "missing": 0}
+    # El historial local se reconstruye como con el cliente real
+    assert client.get_conversation_history("conv-x")[0]["query"] == "hola"
+
+    notebooks = client.list_notebooks()
+    assert isinstance(notebooks[0], Notebook) and notebooks[0].title == "Presupuesto"
+
+
+def test_recorded_errors_are_raised_again(tmp_path):
+    path = record(tmp_path, [("caducada", None), ("rota", None)])
+    client = ReplayClient(ReplayArchive(path), speed=0)
+    with pytest.raises(AuthenticationError):
+        client.query("nb", "caducada")
+    with pytest.raises(httpx.HTTPStatusError) as raised:
+        client.query("nb", "rota")
+    assert raised.value.response.status_code == 500
+
+
+def test_errors_can_be_left_out_of_the_replay(tmp_path):
+    path = record(tmp_path, [("caducada", None), ("hola", None)])
+    client = ReplayClient(ReplayArchive(path, replay_errors=False), speed=0)
+    assert client.query("nb", "caducada")["answer"] == "R: hola"
+
+
+def test_replay_keeps_recorded_timing_and_stops_on_disconnect(tmp_path):
+    path = str(tmp_path / "grabacion.jsonl")
+    recorder = Recorder(path)
+    recorder.write({"v": 1, "method": "query", "duration": 0.4, "first_answer_s": 0.1,
+                    "params": {"notebook_id": "nb", "query_text": "lenta", "conversation_id": None},
+                    "result": {"answer": "tarde", "conversation_id": "c"}, "error": None})
+    recorder.close()
+    archive = ReplayArchive(path)
+
+    started = time.monotonic()
+    events = list(ReplayClient(archive, speed=2).query_stream("nb", "lenta"))
+    assert 0.15 <= time.monotonic() - started < 0.4
+    assert events[0] == ("answer", "tarde") and events[-1][0] == "done"
+
+    stop = threading.Event()
+    stop.set()
+    started = time.monotonic()
+    list(ReplayClient(archive, speed=1).query_stream("nb", "lenta", stop_event=stop))
+    assert time.monotonic() - started < 0.1
@@ -0,0 +1,92 @@
+"""Consulta en streaming: texto incremental, parada y errores de autenticación"""
+import json
+import threading
+
+import httpx
+import pytest
+from notebooklm_mcp.api_client import AuthenticationError
+
+from upstream_stream import stream_query
+
+
+class FakeClient:
+    """Los métodos internos de NotebookLMClient que usa el streaming"""
+
+    BASE_URL = "https://notebooklm.google.com"
+    QUERY_ENDPOINT = "/query"
+
+    def __init__(self, lines, status=200):
+        self.lines = lines
+        self.status = status
+        self.csrf_token = "csrf"
+        self._session_id = None
+        self._reqid_counter = 0
+        self._conversation_cache = {}
+        self.requests = []
+
+    def _get_client(self):
+        def handler(request):
+            self.requests.append(request)
+            body = "\n".join([")]}'"] + [json.dumps(line) for line in self.lines]) + "\n"
+            return httpx.Response(self.status, content=body.encode())
+
+        return httpx.Client(transport=httpx.MockTransport(handler))
+
+    def get_notebook(self, notebook_id):
+        return {"sources": ["s1"]}
+
+    def _extract_source_ids_from_notebook(self, notebook_data):
+        return notebook_data["sources"]
+
+    def _build_conversation_history(self, conversation_id):
+        return self._conversation_cache.get(conversation_id)
+
+    def _extract_answer_from_chunk(self, line):
+        kind, text = json.loads(line)
+        return text, kind == "answer"
+
+    def _cache_conversation_turn(self, conversation_id, query_text, answer_text):
+        self._conversation_cache.setdefault(conversation_id, []).append((query_text, answer_text))
+
+
+def test_answer_grows_and_ends_with_the_query_result():
+    client = FakeClient([["thinking", "pensando"], ["answer", "Hola"], ["answer", "Hola mundo"], ["answer", "Hola"]])
+    events = list(stream_query(client, "nb", "¿Qué tal?"))
+
+    assert events[:-1] == [("answer", "Hola"), ("answer", "Hola mundo")]
+    kind, result = events[-1]
+    assert kind == "done"
+    assert result["answer"] == "Hola mundo" and result["is_follow_up"] is False
+    assert client._conversation_cache[result["conversation_id"]] == [("¿Qué tal?", "Hola mundo")]
+
+
+def test_thinking_is_the_answer_when_nothing_else_arrives():
+    client = FakeClient([["thinking", "solo pensamiento"]])
+    events = list(stream_query(client, "nb", "pregunta"))
+    assert events[0] == ("answer", "solo pensamiento")
+    assert events[-1][1]["answer"] == "solo pensamiento"
+
+
+def test_stop_event_ends_the_stream_without_caching():
+    client = FakeClient([["answer", "a"], ["answer", "ab"], ["answer", "abc"]])
+    stop = threading.Event()
+    events = []
+    for event in stream_query(client, "nb", "pregunta", stop_event=stop):
+        events.append(event)
+        stop.set()
+    assert events == [("answer", "a")]
+    assert client._conversation_cache == {}
+
+
+def test_expired_credentials_raise_authentication_error():
+    with pytest.raises(AuthenticationError):
+        list(stream_query(FakeClient([], status=401), "nb", "pregunta"))
+
+
+def test_clients_without_streaming_fall_back_to_query():
+    class PlainClient:
+        def query(self, notebook_id, query_text, conversation_id=None, timeout=None):
+            return {"answer": "completa", "conversation_id": "conv-1"}
+
+    events = list(stream_query(PlainClient(), "nb", "pregunta"))
+    assert events == [("answer", "completa"), ("done", {"answer": "completa", "conversation_id": "conv-1"})]
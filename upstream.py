@@ -0,0 +1,387 @@
+"""
+Ejecutor acotado para las llamadas a NotebookLM
+Todas las llamadas bloqueantes al upstream pasan por un pool de hilos propio
+con límite global y por cuaderno. Las peticiones que no caben esperan en una
+cola acotada; si la cola está llena o la espera es demasiado larga se
+rechazan enseguida (429 + Retry-After) en lugar de acumularse.
+
+La cola respeta clases de prioridad: el chat (interactive) pasa por delante
+de los lotes (bulk) y de las tareas de fondo (background), que además no
+pueden ocupar las plazas reservadas al chat. Una petición sube una clase por
+cada UPSTREAM_PRIORITY_AGING segundos de espera, así que nada espera para
+siempre. Con la cola llena, una petición interactiva desplaza a la de menor
+prioridad en lugar de ser rechazada. Dentro de una misma clase pasa antes el
+cliente con menos llamadas en curso, para que nadie acapare el pool.
+"""
+import os
+import math
+import time
+import asyncio
+import functools
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from typing import Optional
+
+
+# ============================================================================
+# Configuración
+# ============================================================================
+
+UPSTREAM_MAX_WORKERS = int(os.environ.get("UPSTREAM_MAX_WORKERS", "8"))
+UPSTREAM_MAX_PER_NOTEBOOK = int(os.environ.get("UPSTREAM_MAX_PER_NOTEBOOK", "4"))
+UPSTREAM_MAX_QUEUE = int(os.environ.get("UPSTREAM_MAX_QUEUE", "32"))
+UPSTREAM_MAX_WAIT = float(os.environ.get("UPSTREAM_MAX_WAIT", "20"))
+
+# Clases de prioridad, de mayor a menor
+PRIORITIES = ("interactive", "bulk", "background")
+DEFAULT_PRIORITY = "interactive"
+# Segundos de espera que suben una petición una clase (0 = sin envejecimiento)
+UPSTREAM_PRIORITY_AGING = float(os.environ.get("UPSTREAM_PRIORITY_AGING", "10"))
+# Plazas del pool que solo puede ocupar el tráfico interactivo
+UPSTREAM_INTERACTIVE_RESERVE = int(os.environ.get("UPSTREAM_INTERACTIVE_RESERVE", "1"))
+
+
+class UpstreamBusy(Exception):
+    """No hay capacidad para atender la llamada a tiempo"""
+
+    status_code = 429
+
+    def __init__(self, message: str, retry_after: float):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+def priority_rank(priority: Optional[str]) -> int:
+    """Posición de la clase (0 = la más prioritaria); ValueError si no existe"""
+    if priority is None:
+        priority = DEFAULT_PRIORITY
+    try:
+        return PRIORITIES.index(priority)
+    except ValueError:
+        raise ValueError(f"Prioridad desconocida: {priority!r} (validas: {', '.join(PRIORITIES)})")
+
+
+class _Waiter:
+    __slots__ = ("future", "notebook_id", "rank", "client", "enqueued_at")
+
+    def __init__(self, future: asyncio.Future, notebook_id: Optional[str], rank: int, client: Optional[str]):
+        self.future = future
+        self.notebook_id = notebook_id
+        self.rank = rank
+        self.client = client
+        self.enqueued_at = time.monotonic()
+
+
+class Slot:
+    """Plaza concedida por el ejecutor; `waited` son los segundos en cola"""
+
+    __slots__ = ("notebook_id", "waited", "rank", "client", "granted_at")
+
+    def __init__(self, notebook_id: Optional[str], waited: float, rank: int = 0, client: Optional[str] = None):
+        self.notebook_id = notebook_id
+        self.waited = waited
+        self.rank = rank
+        self.client = client
+        self.granted_at = time.monotonic()
+
+
+class _ClassStats:
+    """Contadores y latencias de una clase de prioridad"""
+
+    def __init__(self):
+        self.active = 0
+        self.admitted = 0
+        self.completed = 0
+        self.rejected = 0
+        self.preempted = 0
+        self.wait_samples: deque[float] = deque(maxlen=1000)
+        self.hold_samples: deque[float] = deque(maxlen=1000)
+
+    def to_dict(self, queued: int) -> dict:
+        waits = sorted(self.wait_samples)
+        holds = sorted(self.hold_samples)
+        return {
+            "queued": queued,
+            "active": self.active,
+            "admitted": self.admitted,
+            "completed": self.completed,
+            "rejected": self.rejected,
+            "preempted": self.preempted,
+            "wait_avg_s": round(sum(waits) / len(waits), 4) if waits else 0.0,
+            "wait_p95_s": round(_p95(waits), 4),
+            "call_avg_s": round(sum(holds) / len(holds), 3) if holds else 0.0,
+            "call_p95_s": round(_p95(holds), 3),
+        }
+
+
+def _p95(samples: list[float]) -> float:
+    return samples[min(int(len(samples) * 0.95), len(samples) - 1)] if samples else 0.0
+
+
+class UpstreamExecutor:
+    """
+    Control de admisión en el event loop + pool de hilos dedicado.
+    Las plazas se conceden por prioridad (con envejecimiento) y, dentro de la
+    misma, en orden de llegada; una petición bloqueada por el límite de su
+    cuaderno no impide que avancen las de otros cuadernos.
+    """
+
+    def __init__(
+        self,
+        max_workers: int = UPSTREAM_MAX_WORKERS,
+        max_per_notebook: int = UPSTREAM_MAX_PER_NOTEBOOK,
+        max_queue: int = UPSTREAM_MAX_QUEUE,
+        max_wait: float = UPSTREAM_MAX_WAIT,
+        aging: float = UPSTREAM_PRIORITY_AGING,
+        interactive_reserve: int = UPSTREAM_INTERACTIVE_RESERVE,
+    ):
+        self.max_workers = max_workers
+        self.max_per_notebook = max_per_notebook
+        self.max_queue = max_queue
+        self.max_wait = max_wait
+        self.aging = aging
+        # Al menos una plaza queda siempre para las clases no interactivas
+        self.interactive_reserve = max(min(interactive_reserve, max_workers - 1), 0)
+        self.pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="upstream")
+
+        self._active = 0
+        self._active_by_notebook: dict[str, int] = {}
+        self._active_by_client: dict[str, int] = {}
+        self._waiters: list[_Waiter] = []
+        self._classes = [_ClassStats() for _ in PRIORITIES]
+
+        # Métricas
+        self.admitted = 0
+        self.completed = 0
+        self.rejected_queue_full = 0
+        self.rejected_timeout = 0
+        self.max_queue_depth = 0
+        self._wait_samples: deque[float] = deque(maxlen=1000)
+        self._avg_duration = 5.0  # Media móvil de la duración de una llamada (s)
+
+    # ------------------------------------------------------------------
+    # Admisión
+    # ------------------------------------------------------------------
+
+    def _has_capacity(self, notebook_id: Optional[str], rank: int = 0) -> bool:
+        limit = self.max_workers if rank == 0 else self.max_workers - self.interactive_reserve
+        if self._active >= limit:
+            return False
+        if notebook_id is None:
+            return True
+        return self._active_by_notebook.get(notebook_id, 0) < self.max_per_notebook
+
+    def _take(self, notebook_id: Optional[str], rank: int = 0, client: Optional[str] = None) -> None:
+        self._active += 1
+        self.admitted += 1
+        self._classes[rank].active += 1
+        self._classes[rank].admitted += 1
+        if client is not None:
+            self._active_by_client[client] = self._active_by_client.get(client, 0) + 1
+        if notebook_id is not None:
+            self._active_by_notebook[notebook_id] = self._active_by_notebook.get(notebook_id, 0) + 1
+
+    def _give_back(self, notebook_id: Optional[str], rank: int = 0, client: Optional[str] = None) -> None:
+        self._active -= 1
+        self._classes[rank].active -= 1
+        if client is not None:
+            remaining = self._active_by_client.get(client, 1) - 1
+            if remaining > 0:
+                self._active_by_client[client] = remaining
+            else:
+                self._active_by_client.pop(client, None)
+        if notebook_id is not None:
+            remaining = self._active_by_notebook.get(notebook_id, 1) - 1
+            if remaining > 0:
+                self._active_by_notebook[notebook_id] = remaining
+            else:
+                self._active_by_notebook.pop(notebook_id, None)
+        self._grant_waiters()
+
+    def _effective_rank(self, waiter: _Waiter, now: float) -> int:
+        """Clase de la petición menos una por cada `aging` segundos completos en cola"""
+        if self.aging <= 0:
+            return waiter.rank
+        return waiter.rank - math.floor((now - waiter.enqueued_at) / self.aging)
+
+    def _queue_key(self, waiter: _Waiter, now: float) -> tuple:
+        """Clase efectiva, llamadas en curso del mismo cliente y orden de llegada"""
+        in_flight = self._active_by_client.get(waiter.client, 0) if waiter.client is not None else 0
+        return self._effective_rank(waiter, now), in_flight, waiter.enqueued_at
+
+    def _queue_order(self) -> list[tuple[int, _Waiter]]:
+        now = time.monotonic()
+        ranked = sorted(self._waiters, key=lambda w: self._queue_key(w, now))
+        return [(self._effective_rank(w, now), w) for w in ranked]
+
+    def _grant_waiters(self) -> None:
+        """Concede plazas libres a los primeros de la cola (por prioridad) que puedan usarlas"""
+        if not self._waiters:
+            return
+        pending = []
+        for effective, waiter in self._queue_order():
+            if waiter.future.done():
+                continue  # Cancelado, caducado o desplazado
+            # Una petición que ha envejecido hasta la clase interactiva puede
+            # usar también las plazas reservadas
+            capacity_rank = 0 if effective <= 0 else waiter.rank
+            if self._active < self.max_workers and self._has_capacity(waiter.notebook_id, capacity_rank):
+                self._take(waiter.notebook_id, waiter.rank, waiter.client)
+                waiter.future.set_result(True)
+            else:
+                pending.append(waiter)
+        self._waiters = pending
+
+    def _preempt(self, rank: int) -> bool:
+        """Con la cola llena, expulsa a la petición de menor prioridad (si la hay) que `rank`"""
+        now = time.monotonic()
+        candidates = [w for w in self._waiters if w.rank > rank and not w.future.done()]
+        if not candidates:
+            return False
+        victim = max(candidates, key=lambda w: self._queue_key(w, now))
+        self._waiters.remove(victim)
+        self._classes[victim.rank].preempted += 1
+        victim.future.set_exception(UpstreamBusy(
+            "Desplazada de la cola de NotebookLM por una peticion prioritaria", self.retry_after()
+        ))
+        return True
+
+    def retry_after(self) -> float:
+        """Estimación de los segundos hasta que haya capacidad libre"""
+        depth = len(self._waiters) + 1
+        estimate = self._avg_duration * depth / max(self.max_workers, 1)
+        return float(min(max(math.ceil(estimate), 1), 120))
+
+    def _return_granted(self, waiter: _Waiter) -> None:
+        """Devuelve la plaza de un waiter que se rinde si ya se le había concedido"""
+        future = waiter.future
+        if future.done() and not future.cancelled() and future.exception() is None:
+            self._give_back(waiter.notebook_id, waiter.rank, waiter.client)
+
+    async def acquire(
+        self, notebook_id: Optional[str] = None, max_wait: Optional[float] = None,
+        priority: Optional[str] = None, client: Optional[str] = None
+    ) -> Slot:
+        """Espera una plaza (como mucho max_wait segundos) o lanza UpstreamBusy"""
+        rank = priority_rank(priority)
+        stats = self._classes[rank]
+        if not self._waiters and self._has_capacity(notebook_id, rank):
+            self._take(notebook_id, rank, client)
+            self._wait_samples.append(0.0)
+            stats.wait_samples.append(0.0)
+            return Slot(notebook_id, 0.0, rank, client)
+
+        if len(self._waiters) >= self.max_queue and not self._preempt(rank):
+            self.rejected_queue_full += 1
+            stats.rejected += 1
+            raise UpstreamBusy("Cola de NotebookLM llena", self.retry_after())
+
+        max_wait = self.max_wait if max_wait is None else max_wait
+        waiter = _Waiter(asyncio.get_running_loop().create_future(), notebook_id, rank, client)
+        self._waiters.append(waiter)
+        self.max_queue_depth = max(self.max_queue_depth, len(self._waiters))
+        # Si la plaza libre solo estaba bloqueada por otro cuaderno, concederla ya
+        self._grant_waiters()
+
+        try:
+            await asyncio.wait_for(waiter.future, timeout=max(max_wait, 0))
+        except asyncio.TimeoutError:
+            # En Python 3.12+ wait_for puede agotar el tiempo con la plaza ya concedida
+            self._return_granted(waiter)
+            self.rejected_timeout += 1
+            stats.rejected += 1
+            raise UpstreamBusy(
+                f"Tiempo de espera en cola agotado ({max_wait:g}s)", self.retry_after()
+            )
+        except asyncio.CancelledError:
+            # La plaza pudo concederse justo antes de la cancelación
+            self._return_granted(waiter)
+            raise
+        finally:
+            if waiter in self._waiters:
+                self._waiters.remove(waiter)
+
+        waited = time.monotonic() - waiter.enqueued_at
+        self._wait_samples.append(waited)
+        stats.wait_samples.append(waited)
+        return Slot(notebook_id, waited, rank, client)
+
+    def release(self, slot: Slot) -> None:
+        self.completed += 1
+        stats = self._classes[slot.rank]
+        stats.completed += 1
+        stats.hold_samples.append(time.monotonic() - slot.granted_at)
+        self._give_back(slot.notebook_id, slot.rank, slot.client)
+
+    @asynccontextmanager
+    async def slot(
+        self, notebook_id: Optional[str] = None, max_wait: Optional[float] = None,
+        priority: Optional[str] = None, client: Optional[str] = None
+    ):
+        """Reserva una plaza durante el bloque"""
+        granted = await self.acquire(notebook_id, max_wait, priority, client)
+        try:
+            yield granted
+        finally:
+            self.release(granted)
+
+    # ------------------------------------------------------------------
+    # Ejecución
+    # ------------------------------------------------------------------
+
+    async def call(self, fn, *args, **kwargs):
+        """Ejecuta fn en el pool (quien llama ya debe tener una plaza)"""
+        loop = asyncio.get_running_loop()
+        started = time.monotonic()
+        try:
+            return await loop.run_in_executor(self.pool, functools.partial(fn, *args, **kwargs))
+        finally:
+            duration = time.monotonic() - started
+            self._avg_duration = 0.8 * self._avg_duration + 0.2 * duration
+
+    async def run(
+        self, fn, *args, notebook_id: Optional[str] = None, max_wait: Optional[float] = None,
+        priority: Optional[str] = None, **kwargs
+    ):
+        """Admisión + ejecución en el pool"""
+        async with self.slot(notebook_id, max_wait, priority):
+            return await self.call(fn, *args, **kwargs)
+
+    def shutdown(self) -> None:
+        self.pool.shutdown(wait=False, cancel_futures=True)
+
+    # ------------------------------------------------------------------
+    # Métricas
+    # ------------------------------------------------------------------
+
+    def stats(self) -> dict:
+        samples = sorted(self._wait_samples)
+        p95 = _p95(samples)
+        queued = [0] * len(PRIORITIES)
+        for waiter in self._waiters:
+            queued[waiter.rank] += 1
+        return {
+            "max_workers": self.max_workers,
+            "max_per_notebook": self.max_per_notebook,
+            "max_queue": self.max_queue,
+            "max_wait_s": self.max_wait,
+            "active": self._active,
+            "active_by_notebook": dict(self._active_by_notebook),
+            "active_clients": len(self._active_by_client),
+            "queue_depth": len(self._waiters),
+            "max_queue_depth": self.max_queue_depth,
+            "admitted": self.admitted,
+            "completed": self.completed,
+            "rejected_queue_full": self.rejected_queue_full,
+            "rejected_timeout": self.rejected_timeout,
+            "wait_avg_s": round(sum(samples) / len(samples), 4) if samples else 0.0,
+            "wait_p95_s": round(p95, 4),
+            "wait_max_s": round(samples[-1], 4) if samples else 0.0,
+            "avg_call_duration_s": round(self._avg_duration, 3),
+            "priority_aging_s": self.aging,
+            "interactive_reserve": self.interactive_reserve,
+            "by_priority": {
+                name: self._classes[rank].to_dict(queued[rank]) for rank, name in enumerate(PRIORITIES)
+            },
+        }
@@ -0,0 +1,356 @@
+"""
+Grabación y reproducción del tráfico con NotebookLM
+UPSTREAM_MODE=record envuelve el cliente real y guarda cada llamada
+(parámetros, resultado bruto o error y tiempos) en un JSONL comprimido.
+UPSTREAM_MODE=replay sustituye el cliente por uno que responde desde esa
+grabación, con los tiempos grabados o acelerados, sin red ni credenciales.
+Permite perfilar el puente con tráfico real de producción.
+"""
+import os
+import gzip
+import json
+import time
+import threading
+import dataclasses
+from collections import deque
+from pathlib import Path
+from typing import Any, Iterator, Optional
+
+import httpx
+from notebooklm_mcp.api_client import AuthenticationError, ConversationTurn, Notebook, NotebookLMClient
+
+from upstream_stream import stream_query
+
+
+# ============================================================================
+# Configuración
+# ============================================================================
+
+# live (por defecto), record o replay
+UPSTREAM_MODE = os.environ.get("UPSTREAM_MODE", "live").lower()
+UPSTREAM_RECORDING_PATH = os.environ.get(
+    "UPSTREAM_RECORDING_PATH", str(Path(__file__).parent / "upstream_recording.jsonl.gz")
+)
+# 1 = tiempos grabados, 10 = diez veces más rápido, 0 = sin esperas
+UPSTREAM_REPLAY_SPEED = float(os.environ.get("UPSTREAM_REPLAY_SPEED", "1"))
+# 0: los errores grabados (caducidades, HTTP 500...) se sustituyen por la siguiente respuesta válida
+UPSTREAM_REPLAY_ERRORS = os.environ.get("UPSTREAM_REPLAY_ERRORS", "1") != "0"
+
+RECORD_VERSION = 1
+
+
+def _open(path: str, mode: str):
+    if path.endswith(".gz"):
+        return gzip.open(path, mode + "t", encoding="utf-8")
+    return open(path, mode, encoding="utf-8")
+
+
+def _encode(value: Any) -> Any:
+    """Resultado del cliente a JSON (los Notebook son dataclasses)"""
+    if dataclasses.is_dataclass(value) and not isinstance(value, type):
+        return {"__notebook__": dataclasses.asdict(value)}
+    if isinstance(value, list):
+        return [_encode(v) for v in value]
+    return value
+
+
+def _decode(value: Any) -> Any:
+    if isinstance(value, dict) and "__notebook__" in value:
+        return Notebook(**value["__notebook__"])
+    if isinstance(value, list):
+        return [_decode(v) for v in value]
+    return value
+
+
+def _describe_error(error: BaseException) -> dict:
+    status = error.response.status_code if isinstance(error, httpx.HTTPStatusError) else None
+    return {"type": type(error).__name__, "message": str(error), "status": status}
+
+
+def _raise_recorded(error: dict) -> None:
+    if error["type"] == "AuthenticationError":
+        raise AuthenticationError(error["message"])
+    if error.get("status"):
+        request = httpx.Request("POST", "https://notebooklm.google.com/")
+        response = httpx.Response(error["status"], request=request)
+        raise httpx.HTTPStatusError(error["message"], request=request, response=response)
+    raise RuntimeError(f"{error['type']}: {error['message']}")
+
+
+# ============================================================================
+# Grabación
+# ============================================================================
+
+class Recorder:
+    """Añade registros a la grabación; se llama desde los hilos del ejecutor"""
+
+    def __init__(self, path: str = UPSTREAM_RECORDING_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        # En modo "a" cada arranque añade un miembro gzip nuevo (sigue siendo válido)
+        self._file = _open(path, "a")
+        self.records = 0
+        self.errors = 0
+
+    def write(self, record: dict) -> None:
+        line = json.dumps(record, ensure_ascii=False, default=str)
+        with self._lock:
+            if self._file is None:
+                return
+            self._file.write(line + "\n")
+            # Sin perder lo grabado si el proceso muere
+            self._file.flush()
+            self.records += 1
+            if record.get("error"):
+                self.errors += 1
+
+    def close(self) -> None:
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+    def stats(self) -> dict:
+        return {"path": self.path, "records": self.records, "errors": self.errors}
+
+
+class RecordingClient:
+    """Cliente real con las llamadas a NotebookLM grabadas; el resto se delega"""
+
+    def __init__(self, client: NotebookLMClient, recorder: Recorder):
+        self.client = client
+        self.recorder = recorder
+
+    def __getattr__(self, name: str):
+        return getattr(self.client, name)
+
+    def _record(self, method: str, params: dict, started: float, result: Any = None,
+                error: Optional[BaseException] = None, **extra) -> None:
+        self.recorder.write({
+            "v": RECORD_VERSION,
+            "at": time.time(),
+            "method": method,
+            "params": params,
+            "duration": round(time.perf_counter() - started, 4),
+            "result": None if error else _encode(result),
+            "error": _describe_error(error) if error else None,
+            **extra,
+        })
+
+    def _call(self, method: str, params: dict, fn, *args, **kwargs):
+        started = time.perf_counter()
+        try:
+            result = fn(*args, **kwargs)
+        except Exception as e:
+            self._record(method, params, started, error=e)
+            raise
+        self._record(method, params, started, result)
+        return result
+
+    def query(self, notebook_id: str, query_text: str, source_ids=None, conversation_id=None, timeout=120):
+        params = {"notebook_id": notebook_id, "query_text": query_text, "conversation_id": conversation_id}
+        return self._call("query", params, self.client.query, notebook_id=notebook_id, query_text=query_text,
+                          source_ids=source_ids, conversation_id=conversation_id, timeout=timeout)
+
+    def list_notebooks(self):
+        return self._call("list_notebooks", {}, self.client.list_notebooks)
+
+    def get_notebook(self, notebook_id: str):
+        return self._call("get_notebook", {"notebook_id": notebook_id}, self.client.get_notebook, notebook_id)
+
+    def query_stream(self, notebook_id: str, query_text: str, conversation_id=None, timeout=120.0,
+                     stop_event=None) -> Iterator[tuple[str, object]]:
+        """Streaming real con la misma grabación que query() y el tiempo hasta el primer trozo"""
+        params = {"notebook_id": notebook_id, "query_text": query_text, "conversation_id": conversation_id}
+        started = time.perf_counter()
+        first_answer = None
+        try:
+            for kind, payload in stream_query(self.client, notebook_id, query_text, conversation_id,
+                                              timeout, stop_event):
+                if kind == "answer" and first_answer is None:
+                    first_answer = round(time.perf_counter() - started, 4)
+                elif kind == "done":
+                    self._record("query", params, started, payload, streamed=True, first_answer_s=first_answer)
+                yield kind, payload
+        except Exception as e:
+            self._record("query", params, started, error=e, streamed=True, first_answer_s=first_answer)
+            raise
+
+
+# ============================================================================
+# Reproducción
+# ============================================================================
+
+class ReplayArchive:
+    """
+    Registros grabados, buscados por este orden:
+      1. misma llamada (método, cuaderno, pregunta y conversación)
+      2. misma pregunta en cualquier conversación
+      3. siguiente registro del método (para cargas con preguntas nuevas)
+    Las coincidencias repetidas se sirven en rueda.
+    """
+
+    def __init__(self, path: str = UPSTREAM_RECORDING_PATH, replay_errors: bool = UPSTREAM_REPLAY_ERRORS):
+        self.path = path
+        self._lock = threading.Lock()
+        self._exact: dict[tuple, deque] = {}
+        self._by_question: dict[tuple, deque] = {}
+        self._by_method: dict[str, deque] = {}
+        self.loaded = 0
+        self.served = {"exact": 0, "question": 0, "any": 0, "missing": 0}
+
+        with _open(path, "r") as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                record = json.loads(line)
+                if record.get("error") and not replay_errors:
+                    continue
+                params = record.get("params", {})
+                method = record["method"]
+                question = (method, params.get("notebook_id"), params.get("query_text"))
+                self._exact.setdefault(question + (params.get("conversation_id"),), deque()).append(record)
+                self._by_question.setdefault(question, deque()).append(record)
+                self._by_method.setdefault(method, deque()).append(record)
+                self.loaded += 1
+        print(f"[REPLAY] {self.loaded} llamadas cargadas de {path}")
+
+    def questions(self) -> list[str]:
+        """Preguntas de primer turno grabadas (para generar carga)"""
+        return [r["params"]["query_text"] for r in self._by_method.get("query", [])
+                if not r["params"].get("conversation_id")]
+
+    def find(self, method: str, params: dict) -> Optional[dict]:
+        question = (method, params.get("notebook_id"), params.get("query_text"))
+        candidates = (
+            ("exact", self._exact.get(question + (params.get("conversation_id"),))),
+            ("question", self._by_question.get(question)),
+            ("any", self._by_method.get(method)),
+        )
+        with self._lock:
+            for match, records in candidates:
+                if records:
+                    records.rotate(-1)
+                    self.served[match] += 1
+                    return records[-1]
+            self.served["missing"] += 1
+        return None
+
+    def stats(self) -> dict:
+        return {"path": self.path, "loaded": self.loaded, "served": dict(self.served)}
+
+
+class ReplayClient:
+    """Responde como NotebookLMClient a partir de la grabación"""
+
+    def __init__(self, archive: ReplayArchive, speed: float = UPSTREAM_REPLAY_SPEED, cookies=None, **_):
+        self.archive = archive
+        self.speed = speed
+        self.cookies = cookies or {}
+        self._conversation_cache: dict[str, list[ConversationTurn]] = {}
+
+    def _wait(self, seconds: Optional[float], stop_event: Optional[threading.Event] = None) -> None:
+        if not seconds or self.speed <= 0:
+            return
+        if stop_event is not None:
+            stop_event.wait(seconds / self.speed)
+        else:
+            time.sleep(seconds / self.speed)
+
+    def _replay(self, method: str, params: dict, stop_event=None) -> tuple[dict, Any]:
+        record = self.archive.find(method, params)
+        if record is None:
+            raise RuntimeError(f"No hay grabaciones de {method} para reproducir")
+        self._wait(record.get("duration"), stop_event)
+        if record.get("error"):
+            _raise_recorded(record["error"])
+        return record, _decode(record["result"])
+
+    def _remember(self, result: Any, query_text: str) -> None:
+        if isinstance(result, dict) and result.get("conversation_id"):
+            self._cache_conversation_turn(result["conversation_id"], query_text, result.get("answer") or "")
+
+    def query(self, notebook_id: str, query_text: str, source_ids=None, conversation_id=None, timeout=120):
+        params = {"notebook_id": notebook_id, "query_text": query_text, "conversation_id": conversation_id}
+        _, result = self._replay("query", params)
+        self._remember(result, query_text)
+        return result
+
+    def query_stream(self, notebook_id: str, query_text: str, conversation_id=None, timeout=120.0,
+                     stop_event=None) -> Iterator[tuple[str, object]]:
+        params = {"notebook_id": notebook_id, "query_text": query_text, "conversation_id": conversation_id}
+        record = self.archive.find("query", params)
+        if record is None:
+            raise RuntimeError("No hay grabaciones de query para reproducir")
+        duration = record.get("duration") or 0.0
+        first = record.get("first_answer_s")
+        if first is not None:
+            # El primer trozo llega cuando llegó en la grabación y el resto al final
+            self._wait(first, stop_event)
+            duration -= first
+        self._wait(duration, stop_event)
+        if record.get("error"):
+            _raise_recorded(record["error"])
+        result = _decode(record["result"])
+        answer = (result or {}).get("answer") if isinstance(result, dict) else None
+        if answer:
+            yield "answer", answer
+        self._remember(result, query_text)
+        yield "done", result
+
+    def list_notebooks(self):
+        if not self.archive._by_method.get("list_notebooks"):
+            return []
+        return self._replay("list_notebooks", {})[1]
+
+    def get_notebook(self, notebook_id: str):
+        return self._replay("get_notebook", {"notebook_id": notebook_id})[1]
+
+    def _cache_conversation_turn(self, conversation_id: str, query: str, answer: str) -> None:
+        turns = self._conversation_cache.setdefault(conversation_id, [])
+        turns.append(ConversationTurn(query=query, answer=answer, turn_number=len(turns) + 1))
+
+    def get_conversation_history(self, conversation_id: str):
+        return [{"turn": t.turn_number, "query": t.query, "answer": t.answer}
+                for t in self._conversation_cache.get(conversation_id, [])]
+
+    def clear_conversation(self, conversation_id: str) -> bool:
+        return self._conversation_cache.pop(conversation_id, None) is not None
+
+
+# ============================================================================
+# Selección del modo
+# ============================================================================
+
+class UpstreamRecording:
+    """`factory` es None en modo live; en los otros construye los clientes"""
+
+    def __init__(self, mode: str = UPSTREAM_MODE, path: str = UPSTREAM_RECORDING_PATH,
+                 speed: float = UPSTREAM_REPLAY_SPEED):
+        if mode not in ("live", "record", "replay"):
+            raise ValueError(f"UPSTREAM_MODE no valido: {mode} (live, record o replay)")
+        self.mode = mode
+        self.recorder: Optional[Recorder] = None
+        self.archive: Optional[ReplayArchive] = None
+        self.factory = None
+        if mode == "record":
+            self.recorder = Recorder(path)
+            self.factory = lambda **kwargs: RecordingClient(NotebookLMClient(**kwargs), self.recorder)
+            print(f"[RECORD] Grabando las llamadas a NotebookLM en {path}")
+        elif mode == "replay":
+            self.archive = ReplayArchive(path)
+            self.factory = lambda **kwargs: ReplayClient(self.archive, speed, **kwargs)
+            print(f"[REPLAY] Reproduciendo {path} a velocidad {speed:g}x (sin red)")
+
+    def close(self) -> None:
+        if self.recorder is not None:
+            self.recorder.close()
+
+    def stats(self) -> dict:
+        stats = {"mode": self.mode}
+        if self.recorder is not None:
+            stats.update(self.recorder.stats())
+        if self.archive is not None:
+            stats.update(self.archive.stats())
+        return stats
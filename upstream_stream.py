@@ -0,0 +1,153 @@
+"""
+Consulta en streaming a NotebookLM
+NotebookLMClient.query() descarga la respuesta completa antes de devolverla,
+aunque el endpoint GenerateFreeFormStreamed la envía por trozos. Este módulo
+reproduce la misma petición y va entregando el texto a medida que llega.
+"""
+import os
+import json
+import uuid
+import threading
+import urllib.parse
+from typing import Iterator, Optional
+
+from notebooklm_mcp.api_client import AuthenticationError
+
+
+def supports_streaming(client) -> bool:
+    """El streaming usa métodos internos del cliente; si faltan se usa query()"""
+    return all(
+        hasattr(client, name)
+        for name in (
+            "_get_client",
+            "_extract_source_ids_from_notebook",
+            "_build_conversation_history",
+            "_extract_answer_from_chunk",
+            "_cache_conversation_turn",
+        )
+    )
+
+
+def _build_request(client, notebook_id: str, query_text: str, conversation_id: Optional[str]):
+    """Construye (url, body, conversation_id, es_seguimiento) igual que query()"""
+    notebook_data = client.get_notebook(notebook_id)
+    source_ids = client._extract_source_ids_from_notebook(notebook_data)
+
+    is_follow_up = conversation_id is not None
+    if is_follow_up:
+        conversation_history = client._build_conversation_history(conversation_id)
+    else:
+        conversation_id = str(uuid.uuid4())
+        conversation_history = None
+
+    sources_array = [[[sid]] for sid in source_ids] if source_ids else []
+    params = [
+        sources_array,
+        query_text,
+        conversation_history,
+        [2, None, [1]],
+        conversation_id,
+    ]
+    params_json = json.dumps(params, separators=(",", ":"))
+    f_req_json = json.dumps([None, params_json], separators=(",", ":"))
+
+    body_parts = [f"f.req={urllib.parse.quote(f_req_json, safe='')}"]
+    if client.csrf_token:
+        body_parts.append(f"at={urllib.parse.quote(client.csrf_token, safe='')}")
+    body = "&".join(body_parts) + "&"
+
+    client._reqid_counter += 100000
+    url_params = {
+        "bl": os.environ.get("NOTEBOOKLM_BL", "boq_labs-tailwind-frontend_20260108.06_p0"),
+        "hl": "en",
+        "_reqid": str(client._reqid_counter),
+        "rt": "c",
+    }
+    if client._session_id:
+        url_params["f.sid"] = client._session_id
+
+    url = f"{client.BASE_URL}{client.QUERY_ENDPOINT}?{urllib.parse.urlencode(url_params)}"
+    return url, body, conversation_id, is_follow_up
+
+
+def stream_query(
+    client,
+    notebook_id: str,
+    query_text: str,
+    conversation_id: Optional[str] = None,
+    timeout: float = 120.0,
+    stop_event: Optional[threading.Event] = None,
+) -> Iterator[tuple[str, object]]:
+    """
+    Generador bloqueante (ejecutar en un hilo). Produce:
+      ("answer", texto)   - texto acumulado de la respuesta cada vez que crece
+      ("done", resultado) - al final, dict con el mismo formato que query()
+    Los pasos de "thinking" no se reenvían; solo se usan como respuesta si
+    NotebookLM no devuelve ningún trozo de tipo respuesta (igual que query()).
+    """
+    # Clientes de grabación y reproducción (upstream_recording.py)
+    if hasattr(client, "query_stream"):
+        yield from client.query_stream(
+            notebook_id=notebook_id,
+            query_text=query_text,
+            conversation_id=conversation_id,
+            timeout=timeout,
+            stop_event=stop_event
+        )
+        return
+
+    if not supports_streaming(client):
+        result = client.query(
+            notebook_id=notebook_id,
+            query_text=query_text,
+            conversation_id=conversation_id,
+            timeout=timeout
+        )
+        answer = (result or {}).get("answer") if isinstance(result, dict) else str(result)
+        if answer:
+            yield "answer", answer
+        yield "done", result
+        return
+
+    url, body, conversation_id, is_follow_up = _build_request(
+        client, notebook_id, query_text, conversation_id
+    )
+
+    longest_answer = ""
+    longest_thinking = ""
+    http = client._get_client()
+    with http.stream("POST", url, content=body, timeout=timeout) as response:
+        if response.status_code in (401, 403):
+            raise AuthenticationError(f"HTTP {response.status_code} en la consulta en streaming")
+        response.raise_for_status()
+
+        for line in response.iter_lines():
+            if stop_event is not None and stop_event.is_set():
+                return
+            line = line.strip()
+            if not line or line.startswith(")]}'") or line.isdigit():
+                continue
+            text, is_answer = client._extract_answer_from_chunk(line)
+            if not text:
+                continue
+            if is_answer:
+                if len(text) > len(longest_answer):
+                    longest_answer = text
+                    yield "answer", text
+            elif len(text) > len(longest_thinking):
+                longest_thinking = text
+
+    answer_text = longest_answer or longest_thinking
+    if not longest_answer and longest_thinking:
+        yield "answer", longest_thinking
+
+    if answer_text:
+        client._cache_conversation_turn(conversation_id, query_text, answer_text)
+    turns = client._conversation_cache.get(conversation_id, []) if hasattr(client, "_conversation_cache") else []
+
+    yield "done", {
+        "answer": answer_text,
+        "conversation_id": conversation_id,
+        "turn_number": len(turns),
+        "is_follow_up": is_follow_up,
+    }